@@ -13,5 +13,42 @@ class Settings(BaseSettings):
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
     OPENAI_API_KEY: str = ""
 
+    LLM_BASE_URL: str = "https://api.groq.com/openai/v1"
+    LLM_MODEL: str = "llama-3.3-70b-versatile"
+    LLM_TIMEOUT: float = 20.0
+    LLM_MAX_CONNECTIONS: int = 20
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_MAX_RETRIES: int = 3
+    LLM_BREAKER_THRESHOLD: int = 5
+    LLM_BREAKER_RESET: float = 30.0
+    LLM_CACHE_BACKEND: str = "memory"
+    LLM_CACHE_TTL: float = 86400.0
+    LLM_CACHE_MAX_ENTRIES: int = 1024
+    LLM_CACHE_PATH: str = "./llm_cache.sqlite3"
+
+    IMPORT_WORKERS: int = 2
+    JOB_HEARTBEAT_SECONDS: float = 15.0
+    JOB_LEASE_SECONDS: float = 120.0
+    EVENT_WRITE_CHUNK: int = 5000
+    CATALOG_IMPORT_CHUNK: int = 10000
+    SPOTIFY_RATE: float = 10.0
+    SPOTIFY_BURST: int = 20
+    SPOTIFY_MAX_CONCURRENCY: int = 8
+    SPOTIFY_MAX_RETRIES: int = 4
+    SPOTIFY_TIMEOUT: float = 15.0
+
+    EVENT_BROKER: str = "local"
+    EVENT_BROKER_PATH: str = "./event_broker.sqlite3"
+    EVENT_STREAM_QUEUE: int = 256
+    EVENT_REPLAY_BUFFER: int = 256
+    EVENT_REPLAY_TTL: float = 300.0
+
+    CATALOG_SNAPSHOT_PATH: str = "./catalog_snapshot"
+
+    ANN_INDEX_TYPE: str = "ivf"
+    ANN_INDEX_PATH: str = "./catalog_ann_index.npz"
+    ANN_MIN_ROWS: int = 5000
+    ANN_NPROBE: int = 8
+
 
 settings = Settings()
@@ -31,6 +31,13 @@ SessionLocal = sessionmaker(
 Base = declarative_base()
 
 
+def ensure_indexes(bind) -> None:
+    """Create indexes declared after their table was (`create_all` skips existing tables)."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
+
 def get_db() -> Session:
     db = SessionLocal()
     try:
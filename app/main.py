@@ -6,9 +6,12 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.database import Base, engine
+from app.database import Base, engine, ensure_indexes
 from app.middleware import RequestLoggingMiddleware, RateLimitMiddleware
 from app.routes import ai, analytics, auth, catalog, events, feedback, imports, mcp
+from app.services import catalog_search, event_stream, job_runner, llm
+from app.services.similarity import ann as ann_index
+from app.services.similarity import matrix as catalog_matrix
 from sqlalchemy import text
 from app.database import SessionLocal
 from fastapi.responses import HTMLResponse
@@ -26,7 +29,16 @@ logging.basicConfig(
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
     Base.metadata.create_all(bind=engine)
+    ensure_indexes(engine)
+    catalog_search.ensure_index(engine)
+    catalog_matrix.load_at_startup(engine)
+    ann_index.load_at_startup(engine)
+    job_runner.recover_orphans(engine)
     yield
+    job_runner.shutdown()
+    event_stream.shutdown()
+    ann_index.shutdown()
+    await llm.shutdown()
 
 
 openapi_tags = [
@@ -59,7 +71,7 @@ app.add_middleware(RequestLoggingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:8000", "http://127.0.0.1:8000"], allow_credentials=True,
-    allow_methods=["*"], allow_headers=["*"],
+    allow_methods=["*"], allow_headers=["*"], expose_headers=["ETag", "Last-Modified"],
 )
 
 app.include_router(auth.router, prefix=API)
@@ -106,6 +118,8 @@ def health_detailed_json():
             "version": "3.0.0",
             "database": "connected",
             "statistics": stats,
+            "llm_cache": llm.get_client().cache.stats(),
+            "event_stream": event_stream.stats(),
             "last_import": {
                 "source": last_import.source if last_import else None,
                 "status": last_import.status if last_import else None,
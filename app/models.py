@@ -20,6 +20,8 @@ from sqlalchemy import (
     JSON,
     Enum,
     ForeignKey,
+    Boolean,
+    Index,
 )
 from sqlalchemy.orm import relationship
 
@@ -84,6 +86,8 @@ class Track(Base):
 
 class ListeningEvent(Base):
     __tablename__ = "listening_events"
+    # Serves the per-user history listing newest first, keyset-paginated on (listened_at, id).
+    __table_args__ = (Index("ix_listening_events_user_time", "user_id", "listened_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -120,6 +124,48 @@ class CatalogTrack(Base):
     feedback = relationship("TrackFeedback", back_populates="catalog_track")
 
 
+class CatalogState(Base):
+    """Single-row version stamp for the discovery catalog.
+
+    Bumped in the same transaction as any write to `catalog_tracks` so that
+    process-wide caches (e.g. the similarity feature matrix) can detect a
+    changed catalog with one primary-key lookup.
+    """
+    __tablename__ = "catalog_state"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    token = Column(String(32), nullable=False)
+    updated_at = Column(DateTime, default=_utcnow, onupdate=_utcnow)
+
+
+class CatalogImportCheckpoint(Base):
+    """How far a catalog CSV import got, so an interrupted run can resume."""
+    __tablename__ = "catalog_import_checkpoints"
+
+    key = Column(String(500), primary_key=True)  # "<dataset_slug>:<file_path>"
+    rows_done = Column(Integer, nullable=False, default=0)
+    inserted = Column(Integer, nullable=False, default=0)
+    updated = Column(Integer, nullable=False, default=0)
+    completed_at = Column(DateTime)
+    updated_at = Column(DateTime, default=_utcnow, onupdate=_utcnow)
+
+
+class CatalogStats(Base):
+    """Materialized catalog-wide report (mood map, audio DNA, genre breakdown).
+
+    Stamped with the `CatalogState` version it was computed at; a row whose
+    token no longer matches the catalog is recomputed on the next read.
+    """
+    __tablename__ = "catalog_stats"
+
+    name = Column(String(32), primary_key=True)
+    version = Column(Integer, nullable=False)
+    token = Column(String(32), nullable=False)
+    payload = Column(JSON)  # NULL when the catalog has nothing to report
+    computed_at = Column(DateTime, default=_utcnow, onupdate=_utcnow)
+
+
 class UserFingerprint(Base):
     __tablename__ = "user_fingerprints"
 
@@ -137,11 +183,42 @@ class UserFingerprint(Base):
     top_artists_json = Column(JSON, default=list)
     peak_hour = Column(Integer)
     total_events = Column(Integer, default=0)
+    state_version = Column(Integer)  # FingerprintState.version it was built from
     updated_at = Column(DateTime, default=_utcnow, onupdate=_utcnow)
 
     user = relationship("User", back_populates="fingerprint")
 
 
+class FingerprintState(Base):
+    """Running aggregates behind a user's `UserFingerprint`.
+
+    Maintained incrementally as listening events are added, changed or
+    removed (see `app.services.fingerprint`). Histogram columns map a key to
+    `[count, first_listened_at]`; the timestamp breaks count ties in
+    first-heard order. `version` counts the changes folded in; 0 marks a row
+    claimed by a bootstrap that has not filled it yet.
+    """
+    __tablename__ = "fingerprint_states"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    total_events = Column(Integer, nullable=False, default=0)
+    distinct_tracks = Column(Integer, nullable=False, default=0)
+    energy_sum = Column(Float, nullable=False, default=0.0)
+    energy_count = Column(Integer, nullable=False, default=0)
+    valence_sum = Column(Float, nullable=False, default=0.0)
+    valence_count = Column(Integer, nullable=False, default=0)
+    danceability_sum = Column(Float, nullable=False, default=0.0)
+    danceability_count = Column(Integer, nullable=False, default=0)
+    tempo_sum = Column(Float, nullable=False, default=0.0)
+    tempo_count = Column(Integer, nullable=False, default=0)
+    genre_counts = Column(JSON, nullable=False, default=dict)
+    artist_counts = Column(JSON, nullable=False, default=dict)
+    hour_counts = Column(JSON, nullable=False, default=dict)
+    mood_counts = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime, default=_utcnow, onupdate=_utcnow)
+
+
 class TrackFeedback(Base):
     __tablename__ = "track_feedback"
 
@@ -162,6 +239,7 @@ class JobStatus(str, enum.Enum):
     RUNNING = "running"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 class ImportJob(Base):
@@ -180,6 +258,37 @@ class ImportJob(Base):
     completed_at = Column(DateTime)
 
     user = relationship("User", back_populates="jobs")
+    tracker = relationship("ImportJobProgress", uselist=False, lazy="joined",
+                           cascade="all, delete-orphan")
+
+    @property
+    def stage(self):
+        return self.tracker.stage if self.tracker else None
+
+    @property
+    def progress(self):
+        return self.tracker.counters if self.tracker else {}
+
+    @property
+    def cancel_requested(self):
+        return bool(self.tracker and self.tracker.cancel_requested)
+
+
+class ImportJobProgress(Base):
+    """Live stage, per-stage counters, cancel flag and lease for a background import job.
+
+    Kept beside `import_jobs` rather than as extra columns on it so that
+    existing databases pick it up through `create_all`. `owner` is the
+    process running the job; it refreshes `updated_at` as a heartbeat.
+    """
+    __tablename__ = "import_job_progress"
+
+    job_id = Column(String(12), ForeignKey("import_jobs.id", ondelete="CASCADE"), primary_key=True)
+    stage = Column(String(30))
+    counters = Column(JSON, default=dict)  # {stage: {"done": n, "total": m}}
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    owner = Column(String(80))
+    updated_at = Column(DateTime, default=_utcnow, onupdate=_utcnow)
 
 
 class Insight(Base):
@@ -1,18 +1,20 @@
 """Focused hybrid AI routes."""
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from app.auth import get_current_user
 from app.database import get_db
 from app.models import User
 from app.schemas import (
+    EnrichmentRead,
     InsightCritiqueResult,
     InsightRead,
     RecommendationExplainRequest,
     RecommendationExplainResult,
     WhatIfRecommendationRequest,
 )
+from app.services import enrichment
 from app.services import hybrid as hybrid_svc
 
 router = APIRouter(prefix="/ai", tags=["AI"])
@@ -41,22 +43,38 @@ async def critique_insight(
              summary="Return explainable hybrid recommendations grounded in your fingerprint")
 async def recommendations_explain(
     body: RecommendationExplainRequest,
+    background: BackgroundTasks,
+    enrich: str = enrichment.ENRICH_QUERY,
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    return await hybrid_svc.explain_recommendations(
+    result = await hybrid_svc.explain_recommendations(
         db, user.id, context=body.context,
         strategy=body.strategy, max_tracks=body.max_tracks,
+        defer=enrich == "async",
     )
+    return enrichment.schedule(result, background)
 
 
 @router.post("/recommendations/what-if", response_model=RecommendationExplainResult,
              summary="Generate counterfactual recommendations for a scenario")
 async def recommendations_what_if(
     body: WhatIfRecommendationRequest,
+    background: BackgroundTasks,
+    enrich: str = enrichment.ENRICH_QUERY,
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    return await hybrid_svc.what_if_recommendations(
-        db, user.id, body.scenario, body.max_tracks
-    )
\ No newline at end of file
+    result = await hybrid_svc.what_if_recommendations(
+        db, user.id, body.scenario, body.max_tracks, defer=enrich == "async"
+    )
+    return enrichment.schedule(result, background)
+
+
+@router.get("/enrichments/{key}", response_model=EnrichmentRead,
+            summary="Fetch the LLM rewrite for a result requested with ?enrich=async")
+async def get_enrichment(key: str, user: User = Depends(get_current_user)):
+    entry = enrichment.get(user.id, key)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Enrichment not found")
+    return EnrichmentRead(key=entry.key, status=entry.status, text=entry.text)
\ No newline at end of file
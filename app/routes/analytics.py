@@ -1,15 +1,17 @@
 """Focused analytics routes for Sonic Insights Hybrid."""
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends
 from sqlalchemy.orm import Session
 
 from app.auth import get_current_user
 from app.database import get_db
 from app.models import User
 from app.schemas import FingerprintResult, HighlightResult, OverviewResult, RecentChangesResult
+from app.services import enrichment, http_cache
 from app.services import hybrid as hybrid_svc
 
-router = APIRouter(prefix="/analytics", tags=["Analytics"])
+router = APIRouter(prefix="/analytics", tags=["Analytics"],
+                   dependencies=[Depends(http_cache.user_analytics)])
 
 
 @router.get("/overview", response_model=OverviewResult, summary="High-level hybrid listening summary")
@@ -18,13 +20,17 @@ async def get_overview(user: User = Depends(get_current_user), db: Session = Dep
 
 
 @router.get("/fingerprint", response_model=FingerprintResult, summary="Build your listening fingerprint")
-async def get_fingerprint(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return await hybrid_svc.fingerprint_result(db, user.id)
+async def get_fingerprint(background: BackgroundTasks, enrich: str = enrichment.ENRICH_QUERY,
+                          user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    result = await hybrid_svc.fingerprint_result(db, user.id, defer=enrich == "async")
+    return enrichment.schedule(result, background)
 
 
 @router.get("/changes/recent", response_model=RecentChangesResult, summary="Explain recent taste drift")
-async def get_recent_changes(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return await hybrid_svc.recent_changes(db, user.id)
+async def get_recent_changes(background: BackgroundTasks, enrich: str = enrichment.ENRICH_QUERY,
+                             user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    result = await hybrid_svc.recent_changes(db, user.id, defer=enrich == "async")
+    return enrichment.schedule(result, background)
 
 
 @router.get("/highlights", response_model=HighlightResult, summary="Compact analytics highlights")
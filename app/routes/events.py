@@ -2,8 +2,10 @@
 Listening events — full CRUD entity + SSE live stream.
 
 POST   /listening-events
+POST   /listening-events/batch
 GET    /listening-events
 GET    /listening-events/stream   ← must be before /{event_id}
+GET    /listening-events/export   ← must be before /{event_id}
 GET    /listening-events/{event_id}
 PATCH  /listening-events/{event_id}
 DELETE /listening-events/{event_id}
@@ -14,14 +16,18 @@ import json as _json
 from datetime import datetime, timezone
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
 from app.auth import get_current_user
 from app.database import get_db
 from app.models import ListeningEvent, Track, User
-from app.schemas import EventCreate, EventList, EventRead, EventUpdate
+from app.schemas import (
+    EventBatchCreate, EventBatchItem, EventBatchResult, EventCreate, EventList, EventRead, EventUpdate,
+)
+from app.services import event_stream, event_writer, history_export, pagination
 
 router = APIRouter(prefix="/listening-events", tags=["Listening Events"])
 
@@ -31,7 +37,8 @@ router = APIRouter(prefix="/listening-events", tags=["Listening Events"])
 def create_event(body: EventCreate,
                  user: User = Depends(get_current_user),
                  db: Session = Depends(get_db)):
-    if not db.query(Track).filter(Track.id == body.track_id).first():
+    track = db.query(Track).filter(Track.id == body.track_id).first()
+    if not track:
         raise HTTPException(404, "Track not found")
     event = ListeningEvent(
         user_id=user.id,
@@ -43,9 +50,46 @@ def create_event(body: EventCreate,
     db.add(event)
     db.commit()
     db.refresh(event)
+    event_stream.publish(user.id, [event_stream.event_payload(event, track)])
     return event
 
 
+@router.post("/batch", response_model=EventBatchResult,
+             summary="Record many listening events in one request")
+def create_events_batch(body: EventBatchCreate,
+                        user: User = Depends(get_current_user),
+                        db: Session = Depends(get_db)):
+    """
+    Bulk counterpart of `POST /listening-events` for devices reporting plays
+    in bursts. Track ids are checked with one query and the valid events are
+    inserted in one statement; each item's outcome is reported by position.
+    """
+    known = {track_id for (track_id,) in db.query(Track.id).filter(
+        Track.id.in_({e.track_id for e in body.events}))}
+    now = datetime.now(timezone.utc)
+    items: list[Optional[EventBatchItem]] = [None] * len(body.events)
+    rows, accepted = [], []
+    for index, e in enumerate(body.events):
+        if e.track_id not in known:
+            items[index] = EventBatchItem(index=index, status="rejected", error="Track not found")
+            continue
+        row = {
+            "user_id": user.id,
+            "track_id": e.track_id,
+            "listened_at": e.listened_at or now,
+            "duration_listened_ms": e.duration_listened_ms,
+            "source": "manual",
+        }
+        rows.append(row)
+        accepted.append(index)
+
+    written = event_writer.write_batch(db, rows)
+    for index, row in zip(accepted, written):
+        items[index] = EventBatchItem(index=index, status="created", id=row.id)
+    return EventBatchResult(created=len(written), rejected=len(body.events) - len(written),
+                            items=items)
+
+
 @router.get("", response_model=EventList,
             summary="List your listening events (paginated, filterable)")
 def list_events(
@@ -53,6 +97,8 @@ def list_events(
     limit: int = Query(20, ge=1, le=100),
     dt_from: Optional[str] = Query(None, alias="from"),
     dt_to: Optional[str] = Query(None, alias="to"),
+    cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+    include_total: bool = Query(True, description="Count all matching events (costs an extra query)"),
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -61,11 +107,16 @@ def list_events(
         q = q.filter(ListeningEvent.listened_at >= dt_from)
     if dt_to:
         q = q.filter(ListeningEvent.listened_at <= dt_to)
-    total = q.count()
-    items = q.order_by(ListeningEvent.listened_at.desc()).offset(offset).limit(limit).all()
+    total = q.count() if include_total else None
+    keys = [ListeningEvent.listened_at, ListeningEvent.id]
+    items, next_cursor = pagination.page(
+        q.order_by(*(k.desc() for k in keys)), keys,
+        limit=limit, cursor=cursor, offset=offset, descending=True,
+        scope=pagination.scope("events", dt_from=dt_from, dt_to=dt_to),
+    )
     return EventList(
         items=[EventRead.model_validate(e) for e in items],
-        total=total, offset=offset, limit=limit,
+        total=total, offset=offset, limit=limit, next_cursor=next_cursor,
     )
 
 
@@ -76,21 +127,27 @@ def list_events(
         "Opens a persistent SSE connection that pushes a JSON event to the client "
         "every time a new listening event is recorded for the authenticated user. "
         "Also emits a heartbeat every 15 seconds to keep the connection alive. "
+        "Every event carries an SSE `id`; reconnecting with `Last-Event-ID` replays what was missed "
+        "(or sends `resync` if too much was). "
         "Compatible with MCP clients, Claude Desktop, and any EventSource-capable client."
     ),
     response_class=StreamingResponse,
 )
 async def stream_events(
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID", ge=0,
+                                          description="Resume after this event id (sent by EventSource on reconnect)"),
+    resume_after: Optional[int] = Query(None, ge=0, description="Same as `Last-Event-ID`, for clients "
+                                                                  "that cannot set headers"),
     user: User = Depends(get_current_user),
 ):
     from app.database import SessionLocal
 
     user_id = user.id
+    resume_from = last_event_id if last_event_id is not None else resume_after
 
-    async def event_generator():
-        # Each poll opens and closes its own DB session — safe for async context
+    def latest_event_id() -> int:
         with SessionLocal() as db:
-            last_seen_id = (
+            return (
                 db.query(ListeningEvent.id)
                 .filter(ListeningEvent.user_id == user_id)
                 .order_by(ListeningEvent.id.desc())
@@ -98,47 +155,61 @@ async def stream_events(
                 .scalar() or 0
             )
 
-        yield (
-            f"event: connected\n"
-            f"data: {_json.dumps({'status': 'connected', 'user_id': user_id, 'last_seen_id': last_seen_id})}\n\n"
-        )
-
-        heartbeat_counter = 0
-        while True:
-            await asyncio.sleep(2)
-            heartbeat_counter += 1
-
-            # Fresh session per poll — avoids stale state in async generator
-            with SessionLocal() as db:
-                new_events = (
-                    db.query(ListeningEvent)
-                    .filter(
-                        ListeningEvent.user_id == user_id,
-                        ListeningEvent.id > last_seen_id,
-                    )
-                    .order_by(ListeningEvent.id.asc())
-                    .all()
-                )
-                payloads = []
-                for event in new_events:
-                    last_seen_id = event.id
-                    track = db.query(Track).filter(Track.id == event.track_id).first()
-                    payloads.append({
-                        "event_id": event.id,
-                        "track_id": event.track_id,
-                        "track_title": track.title if track else None,
-                        "artist": track.artist if track else None,
-                        "genre": track.genre if track else None,
-                        "listened_at": event.listened_at.isoformat() if event.listened_at else None,
-                        "duration_ms": event.duration_listened_ms,
-                        "source": event.source,
-                    })
-
-            for payload in payloads:
-                yield f"event: new_event\ndata: {_json.dumps(payload)}\n\n"
-
-            if heartbeat_counter % 8 == 0:
-                yield f"event: heartbeat\ndata: {_json.dumps({'ts': asyncio.get_event_loop().time()})}\n\n"
+    def missed_events(after: int) -> Optional[list[dict]]:
+        with SessionLocal() as db:
+            return event_stream.missed_events(db, user_id, after, event_stream.hub.replay_size)
+
+    def frame(event: str, data: dict, event_id: Optional[int] = None) -> str:
+        head = f"id: {event_id}\n" if event_id is not None else ""
+        return f"{head}event: {event}\ndata: {_json.dumps(data)}\n\n"
+
+    async def event_generator():
+        # Subscribe before reading any watermark so nothing committed in between is missed.
+        # From here on events are pushed by the writers; waiting costs no DB work.
+        subscription = event_stream.subscribe(user_id)
+        try:
+            backlog = None
+            if resume_from is not None:
+                backlog = event_stream.hub.replay(user_id, resume_from)
+                if backlog is None:
+                    backlog = await run_in_threadpool(missed_events, resume_from)
+                    if backlog is not None:
+                        event_stream.hub.cover(
+                            user_id, max([resume_from] + [p["event_id"] for p in backlog]))
+            if backlog is None:
+                connected_id = await run_in_threadpool(latest_event_id)
+                event_stream.hub.cover(user_id, connected_id)
+            else:
+                connected_id = resume_from
+            yield frame("connected", {
+                "status": "connected", "user_id": user_id, "last_seen_id": connected_id,
+                "resumed": backlog is not None,
+            }, connected_id)
+            if resume_from is not None and backlog is None:
+                # Too far behind to replay: the client should re-page GET /listening-events.
+                yield frame("resync", {"last_event_id": resume_from, "last_seen_id": connected_id})
+
+            last_seen_id = connected_id
+            replayed = set()
+            for payload in backlog or []:
+                replayed.add(payload["event_id"])
+                last_seen_id = max(last_seen_id, payload["event_id"])
+                yield frame("new_event", payload, payload["event_id"])
+            while True:
+                try:
+                    batch = await subscription.get(timeout=event_stream.HEARTBEAT_SECONDS)
+                except event_stream.SubscriberOverflow:
+                    yield frame("overflow", {"last_seen_id": last_seen_id})
+                    return
+                if not batch:
+                    yield frame("heartbeat", {"ts": asyncio.get_running_loop().time()})
+                for payload in batch:
+                    # Events at or before the watermark were already sent (or predate the stream).
+                    if payload["event_id"] > connected_id and payload["event_id"] not in replayed:
+                        last_seen_id = max(last_seen_id, payload["event_id"])
+                        yield frame("new_event", payload, payload["event_id"])
+        finally:
+            event_stream.unsubscribe(subscription)
 
     return StreamingResponse(
         event_generator(),
@@ -147,6 +218,31 @@ async def stream_events(
     )
 
 
+@router.get(
+    "/export",
+    summary="Export your full listening history (NDJSON or CSV)",
+    description=(
+        "Streams every listening event, oldest first, with the track's title, artist, album, "
+        "genre and release year joined in. Rows are read with a server-side cursor and written "
+        "as they are read, so any history size exports in one request."
+    ),
+    response_class=StreamingResponse,
+)
+def export_events(
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    dt_from: Optional[datetime] = Query(None, alias="from"),
+    dt_to: Optional[datetime] = Query(None, alias="to"),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    media_type, _ = history_export.FORMATS[fmt]
+    return StreamingResponse(
+        history_export.export(db.get_bind(), user.id, fmt, dt_from=dt_from, dt_to=dt_to),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="listening-history.{fmt}"'},
+    )
+
+
 @router.get("/{event_id}", response_model=EventRead,
             summary="Get a single listening event")
 def get_event(event_id: int,
@@ -7,7 +7,6 @@ GET  /mcp/manifest  — list all available tools and their schemas
 POST /mcp/invoke    — invoke a named tool with arguments
 """
 
-import math
 import statistics
 from collections import Counter
 from typing import Any, Optional
@@ -19,6 +18,8 @@ from sqlalchemy.orm import Session
 from app.auth import get_current_user
 from app.database import get_db
 from app.models import CatalogTrack, ListeningEvent, Track, User
+from app.services import catalog_search
+from app.services.similarity import find_similar, match_mood, mood_label, parse_mood
 
 router = APIRouter(prefix="/mcp", tags=["MCP"])
 
@@ -86,6 +87,9 @@ TOOLS = [
             MCPToolParameter(name="limit", type="integer",
                              description="Number of recommendations (default 5)",
                              required=False),
+            MCPToolParameter(name="exact", type="boolean",
+                             description="Score every candidate instead of using the ANN index (default false)",
+                             required=False),
         ],
     ),
     MCPTool(
@@ -110,6 +114,9 @@ TOOLS = [
             MCPToolParameter(name="limit", type="integer",
                              description="Number of similar tracks (default 5)",
                              required=False),
+            MCPToolParameter(name="exact", type="boolean",
+                             description="Score every candidate instead of using the ANN index (default false)",
+                             required=False),
         ],
     ),
 ]
@@ -117,57 +124,16 @@ TOOLS = [
 
 # ── tool implementations ──────────────────────────────────────────────────────
 
-MOOD_KEYWORDS = {
-    "happy": {"valence_min": 0.65}, "upbeat": {"valence_min": 0.6},
-    "sad": {"valence_max": 0.4}, "dark": {"valence_max": 0.35},
-    "energetic": {"energy_min": 0.7}, "calm": {"energy_max": 0.45},
-    "chill": {"energy_max": 0.5}, "hype": {"energy_min": 0.75},
-    "rainy": {"valence_max": 0.45, "energy_max": 0.5},
-    "study": {"energy_max": 0.55}, "party": {"valence_min": 0.6, "energy_min": 0.65},
-    "angry": {"valence_max": 0.45, "energy_min": 0.65},
-    "night": {"energy_max": 0.55}, "morning": {"energy_max": 0.6, "valence_min": 0.45},
-    "workout": {"energy_min": 0.7}, "focus": {"energy_max": 0.6},
-    "acoustic": {"acousticness_min": 0.5}, "sunday": {"acousticness_min": 0.3, "energy_max": 0.55},
-}
-
-FEATURES = ["energy", "valence", "danceability", "acousticness",
-            "instrumentalness", "speechiness", "liveness"]
-
-
-def _mood_label(energy: float, valence: float) -> str:
-    if energy >= 0.55 and valence >= 0.55:
-        return "Happy"
-    if energy >= 0.55 and valence < 0.55:
-        return "Angry"
-    if energy < 0.55 and valence >= 0.55:
-        return "Calm"
-    return "Sad"
-
-
-def _cosine(a: list, b: list) -> float:
-    dot = sum(x * y for x, y in zip(a, b))
-    ma = math.sqrt(sum(x * x for x in a))
-    mb = math.sqrt(sum(y * y for y in b))
-    return round(dot / (ma * mb), 4) if ma and mb else 0.0
-
-
-def _to_vec(track: CatalogTrack) -> list:
-    vec = [getattr(track, f) or 0.0 for f in FEATURES]
-    vec.append((track.tempo or 0.0) / 250.0)
-    return vec
-
-
 def _search_catalog(args: dict, db: Session) -> dict:
     query_str = args.get("query", "")
     genre = args.get("genre")
     limit = min(int(args.get("limit", 5)), 20)
 
     q = db.query(CatalogTrack)
-    if query_str:
-        p = f"%{query_str}%"
-        q = q.filter(CatalogTrack.name.ilike(p) | CatalogTrack.artist.ilike(p))
     if genre:
         q = q.filter(CatalogTrack.genre.ilike(f"%{genre}%"))
+    if query_str:
+        q, _, _ = catalog_search.apply(db, q, query_str)
 
     tracks = q.limit(limit).all()
     return {
@@ -184,55 +150,18 @@ def _recommend_by_mood(args: dict, db: Session) -> dict:
     description = args.get("description", "")
     limit = min(int(args.get("limit", 5)), 20)
 
-    words = description.lower().split()
-    targets: dict = {}
-    matched = []
-    for word in words:
-        if word in MOOD_KEYWORDS:
-            matched.append(word)
-            for k, v in MOOD_KEYWORDS[word].items():
-                targets[k] = v
-
-    def tval(feature):
-        mn, mx = f"{feature}_min", f"{feature}_max"
-        if mn in targets and mx in targets:
-            return (targets[mn] + targets[mx]) / 2
-        if mn in targets:
-            return min(targets[mn] + 0.1, 1.0)
-        if mx in targets:
-            return max(targets[mx] - 0.1, 0.0)
-        return 0.5
-
-    target_vec = [tval(f) for f in FEATURES] + [0.5]
-
-    q = db.query(CatalogTrack).filter(
-        CatalogTrack.energy.isnot(None),
-        CatalogTrack.valence.isnot(None),
-    )
-    if "energy_min" in targets:
-        q = q.filter(CatalogTrack.energy >= targets["energy_min"])
-    if "energy_max" in targets:
-        q = q.filter(CatalogTrack.energy <= targets["energy_max"])
-    if "valence_min" in targets:
-        q = q.filter(CatalogTrack.valence >= targets["valence_min"])
-    if "valence_max" in targets:
-        q = q.filter(CatalogTrack.valence <= targets["valence_max"])
-
-    candidates = q.all()
-    scored = sorted(
-        [(t, _cosine(target_vec, _to_vec(t))) for t in candidates],
-        key=lambda x: -x[1]
-    )
+    targets, matched = parse_mood(description)
+    found = match_mood(db, targets, limit, exact=bool(args.get("exact", False)))
 
     return {
         "description": description,
         "matched_keywords": matched,
-        "total_candidates": len(candidates),
+        "total_candidates": found.total_candidates,
         "recommendations": [
             {"id": t.id, "name": t.name, "artist": t.artist,
              "genre": t.genre, "mood_match_score": s,
-             "mood_label": _mood_label(t.energy or 0.5, t.valence or 0.5)}
-            for t, s in scored[:limit]
+             "mood_label": mood_label(t.energy or 0.5, t.valence or 0.5)}
+            for t, s, _ in found.matches
         ],
     }
 
@@ -257,7 +186,7 @@ def _get_listening_summary(args: dict, db: Session, user: User) -> dict:
             continue
         play_counts[t.title] += 1
         if t.energy is not None and t.valence is not None:
-            moods[_mood_label(t.energy, t.valence)] += 1
+            moods[mood_label(t.energy, t.valence)] += 1
         if t.genre:
             genres[t.genre] += 1
 
@@ -279,7 +208,7 @@ def _get_catalog_mood_map(args: dict, db: Session) -> dict:
 
     buckets: Counter = Counter()
     for t in tracks:
-        buckets[_mood_label(t.energy, t.valence)] += 1
+        buckets[mood_label(t.energy, t.valence)] += 1
 
     total = len(tracks)
     return {
@@ -303,31 +232,14 @@ def _find_similar_tracks(args: dict, db: Session) -> dict:
     if not seed:
         raise ValueError(f"Track {track_id} not found")
 
-    seed_vec = _to_vec(seed)
-    BAND = 0.35
-    candidates = db.query(CatalogTrack).filter(
-        CatalogTrack.id != seed.id,
-        CatalogTrack.energy.isnot(None),
-        CatalogTrack.valence.isnot(None),
-        CatalogTrack.energy.between(
-            max(0.0, (seed.energy or 0.5) - BAND),
-            min(1.0, (seed.energy or 0.5) + BAND)),
-        CatalogTrack.valence.between(
-            max(0.0, (seed.valence or 0.5) - BAND),
-            min(1.0, (seed.valence or 0.5) + BAND)),
-    ).all()
-
-    scored = sorted(
-        [(t, _cosine(seed_vec, _to_vec(t))) for t in candidates],
-        key=lambda x: -x[1]
-    )
+    found = find_similar(db, seed, limit, exact=bool(args.get("exact", False)))
 
     return {
         "seed_track": {"id": seed.id, "name": seed.name, "artist": seed.artist},
         "similar_tracks": [
             {"id": t.id, "name": t.name, "artist": t.artist,
              "genre": t.genre, "similarity_score": s}
-            for t, s in scored[:limit]
+            for t, s, _ in found.matches
         ],
     }
 
@@ -40,6 +40,7 @@ class ImportStartRequest(BaseModel):
 class CatalogImportRequest(BaseModel):
     dataset_slug: str = "ramithgajjala/ramith-top-songs"
     file_path: str = "ramith-top-songs.csv"
+    resume: bool = True
 
 
 class ImportJobRead(BaseModel):
@@ -55,6 +56,9 @@ class ImportJobRead(BaseModel):
     errors: List[Any]
     started_at: datetime
     completed_at: Optional[datetime] = None
+    stage: Optional[str] = None
+    progress: Dict[str, Any] = {}
+    cancel_requested: bool = False
 
 
 class CatalogImportResult(BaseModel):
@@ -64,6 +68,8 @@ class CatalogImportResult(BaseModel):
     inserted: int
     updated: int
     total_rows: int
+    resumed_from: int = 0
+    rows_per_second: float = 0.0
 
 
 # Feedback CRUD
@@ -135,6 +141,7 @@ class FingerprintResult(BaseModel):
     traits: FingerprintTraits
     explanation: str
     evidence: List[Dict[str, Any]]
+    enrichment_key: Optional[str] = None
 
 
 class ChangeMetric(BaseModel):
@@ -151,6 +158,7 @@ class RecentChangesResult(BaseModel):
     summary: str
     metrics: List[ChangeMetric]
     evidence: List[Dict[str, Any]]
+    enrichment_key: Optional[str] = None
 
 
 # AI / recommendations / insights
@@ -182,6 +190,13 @@ class RecommendationExplainResult(BaseModel):
     context: Optional[str] = None
     recommendations: List[RecommendationItem]
     summary: str
+    enrichment_key: Optional[str] = None
+
+
+class EnrichmentRead(BaseModel):
+    key: str
+    status: str
+    text: Optional[str] = None
 
 
 class InsightRead(BaseModel):
@@ -233,10 +248,12 @@ class CatalogTrackRead(BaseModel):
 
 
 class CatalogSearchResult(BaseModel):
-    total: int
+    total: Optional[int]  # None when requested with include_total=false
     limit: int
     offset: int
     items: List[CatalogTrackRead]
+    fuzzy: bool = False  # no track contained `q`; items are the closest spellings
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page; None on the last
 
 
 # Genre analytics
@@ -252,6 +269,7 @@ class GenreStat(BaseModel):
 class GenreBreakdownResult(BaseModel):
     total_genres: int
     genres: List[GenreStat]
+    catalog_version: int = 0  # catalog_state version the report was computed at
 
 
 # Similarity search
@@ -284,6 +302,23 @@ class EventCreate(BaseModel):
     duration_listened_ms: Optional[int] = None
 
 
+class EventBatchCreate(BaseModel):
+    events: List[EventCreate] = Field(..., min_length=1, max_length=5000)
+
+
+class EventBatchItem(BaseModel):
+    index: int  # position in the submitted `events`
+    status: str  # created | rejected
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class EventBatchResult(BaseModel):
+    created: int
+    rejected: int
+    items: List[EventBatchItem]
+
+
 class EventRead(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     id: int
@@ -300,10 +335,11 @@ class EventUpdate(BaseModel):
 
 
 class EventList(BaseModel):
-    total: int
+    total: Optional[int]  # None when requested with include_total=false
     limit: int
     offset: int
     items: List[EventRead]
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page; None on the last
 
 
 # Analytics — Top
@@ -470,6 +506,7 @@ class CatalogMoodMapResult(BaseModel):
     quadrants: List[MoodQuadrantStat]
     most_common_mood: str
     description: str
+    catalog_version: int = 0  # catalog_state version the report was computed at
 
 
 # ── Catalog Audio DNA ────────────────────────────────────────────────────────
@@ -488,6 +525,7 @@ class CatalogAudioDNAResult(BaseModel):
     features: List[AudioDNAFeature]
     genre_fingerprints: Dict[str, Dict[str, float]]
     insight: str
+    catalog_version: int = 0  # catalog_state version the report was computed at
 
 
 # ── Catalog Mood Recommendation ──────────────────────────────────────────────
@@ -1,15 +1,27 @@
-"""Catalog dataset import service using kagglehub."""
+"""Streaming catalog dataset import service using kagglehub."""
 
 from __future__ import annotations
 
+import logging
 import os
-from typing import Any
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
 
 import kagglehub
-from kagglehub import KaggleDatasetAdapter
+import pandas as pd
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import Session
 
-from app.models import CatalogTrack
+from app.config import settings
+from app.models import CatalogImportCheckpoint, CatalogTrack
+from app.services import catalog_search, catalog_state, catalog_stats
+from app.services.similarity import matrix
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_CHUNK = 500
 
 
 COLUMN_ALIASES = {
@@ -41,18 +53,10 @@ FLOAT_FIELDS = [
 ]
 
 
-def _safe_float(value: Any):
-    try:
-        return float(value) if value is not None else None
-    except Exception:
-        return None
-
-
 def _inject_kaggle_credentials() -> None:
     if os.environ.get("KAGGLE_USERNAME") and os.environ.get("KAGGLE_KEY"):
         return
     try:
-        from app.config import settings
         if settings.KAGGLE_USERNAME and settings.KAGGLE_KEY:
             os.environ["KAGGLE_USERNAME"] = settings.KAGGLE_USERNAME
             os.environ["KAGGLE_KEY"] = settings.KAGGLE_KEY
@@ -60,65 +64,153 @@ def _inject_kaggle_credentials() -> None:
         pass
 
 
-def import_catalog_tracks(db: Session, dataset_slug: str, file_path: str = "") -> dict[str, int]:
+def _download_csv(dataset_slug: str, file_path: str) -> str:
+    """Local path of the dataset CSV, downloaded (or cached) by kagglehub."""
     _inject_kaggle_credentials()
+    path = kagglehub.dataset_download(dataset_slug, path=file_path or None)
+    if os.path.isdir(path):
+        csvs = sorted(f for f in os.listdir(path) if f.endswith(".csv"))
+        if not csvs:
+            raise FileNotFoundError(f"No CSV file in dataset {dataset_slug}")
+        path = os.path.join(path, csvs[0])
+    return path
+
+
+def _normalize(chunk: pd.DataFrame, dataset_slug: str, seen_ids: set[str]) -> list[dict[str, Any]]:
+    """Map one CSV chunk onto `CatalogTrack` rows, dropping invalid and repeated tracks."""
+    chunk = chunk.rename(columns={src: dest for src, dest in COLUMN_ALIASES.items() if src in chunk.columns})
+    chunk = chunk.loc[:, ~chunk.columns.duplicated()]
+
+    def text(column: str) -> pd.Series:
+        if column not in chunk.columns:
+            return pd.Series(pd.NA, index=chunk.index, dtype="string")
+        values = chunk[column].astype("string")
+        return values.mask(values == "")
+
+    name, artist = text("name"), text("artist")
+    frame = pd.DataFrame({
+        "external_id": text("external_id").fillna(name + "::" + artist),
+        "name": name,
+        "artist": artist,
+        "album": text("album"),
+        "genre": text("genre"),
+    })
+    for field in FLOAT_FIELDS:
+        frame[field] = (pd.to_numeric(chunk[field], errors="coerce")
+                        if field in chunk.columns else float("nan"))
+
+    # guard against duplicates within the CSV
+    frame = frame[name.notna() & artist.notna()]
+    frame = frame[~frame["external_id"].duplicated() & ~frame["external_id"].isin(seen_ids)]
+    seen_ids.update(frame["external_id"])
+
+    frame = frame.astype(object).where(frame.notna(), None)
+    frame["source_dataset"] = dataset_slug
+    rows = frame.to_dict("records")
+    for row in rows:
+        row["metadata_json"] = {}
+    return rows
+
+
+def _write_chunk(connection: Connection, rows: list[dict[str, Any]]) -> tuple[int, int]:
+    """Bulk upsert one chunk; returns (inserted, updated)."""
+    existing: set[str] = set()
+    ids = [row["external_id"] for row in rows]
+    for i in range(0, len(ids), LOOKUP_CHUNK):
+        existing.update(connection.execute(
+            select(CatalogTrack.external_id).where(CatalogTrack.external_id.in_(ids[i:i + LOOKUP_CHUNK]))
+        ).scalars())
+
+    new_rows = [row for row in rows if row["external_id"] not in existing]
+    changed = [
+        {"match_id": row["external_id"], **{k: v for k, v in row.items() if k != "external_id"}}
+        for row in rows if row["external_id"] in existing
+    ]
+    if new_rows:
+        connection.execute(insert(CatalogTrack), new_rows)
+    if changed:
+        connection.execute(
+            update(CatalogTrack).where(CatalogTrack.external_id == bindparam("match_id")),
+            changed,
+        )
+    return len(new_rows), len(changed)
+
+
+def import_catalog_tracks(db: Session, dataset_slug: str, file_path: str = "", *,
+                          csv_path: Optional[str] = None, chunk_size: Optional[int] = None,
+                          resume: bool = True) -> dict[str, Any]:
+    """
+    Stream the dataset CSV into `catalog_tracks` in chunks of CATALOG_IMPORT_CHUNK.
+
+    Each chunk is normalised column-wise, upserted with bulk statements and
+    committed together with a checkpoint of the rows consumed; the catalog
+    version is bumped once, with the completion mark, or when the run fails
+    or is cancelled after committing chunks. A run that stops part-way
+    resumes after the last committed chunk the next time the same dataset
+    file is imported. `csv_path` reads a
+    local copy instead of downloading the dataset. A finished import writes
+    a fresh columnar catalog snapshot (see `similarity.matrix`) and rebuilds
+    the materialized catalog reports (see `catalog_stats`).
+    """
+    chunk_size = chunk_size or settings.CATALOG_IMPORT_CHUNK
+    path = csv_path or _download_csv(dataset_slug, file_path)
+
+    key = f"{dataset_slug}:{file_path}"
+    checkpoint = db.get(CatalogImportCheckpoint, key)
+    if checkpoint is None:
+        checkpoint = CatalogImportCheckpoint(key=key, rows_done=0, inserted=0, updated=0)
+        db.add(checkpoint)
+    elif not resume or checkpoint.completed_at is not None:
+        checkpoint.rows_done, checkpoint.inserted, checkpoint.updated = 0, 0, 0
+        checkpoint.completed_at = None
+    resumed_from = checkpoint.rows_done
+    db.commit()
 
-    df = kagglehub.load_dataset(
-        KaggleDatasetAdapter.PANDAS,
-        dataset_slug,
-        file_path,
-    )
-
-    present_map = {src: dest for src, dest in COLUMN_ALIASES.items() if src in df.columns}
-    df = df.rename(columns=present_map)
-
-    defaults = {
-        "external_id": None, "name": None, "artist": None,
-        "album": None, "genre": None, "energy": None, "valence": None,
-        "danceability": None, "tempo": None, "acousticness": None,
-        "instrumentalness": None, "speechiness": None, "liveness": None,
-    }
-    for col, default in defaults.items():
-        if col not in df.columns:
-            df[col] = default
-
-    inserted = 0
-    updated = 0
-    seen_ids: set[str] = set()  # guard against duplicates within the CSV
-
-    for _, row in df.iterrows():
-        name = row.get("name")
-        artist = row.get("artist")
-        if not name or not artist:
-            continue
-
-        external_id = str(row.get("external_id") or f"{name}::{artist}")
-
-        if external_id in seen_ids:
-            continue
-        seen_ids.add(external_id)
-
-        existing = db.query(CatalogTrack).filter(CatalogTrack.external_id == external_id).first()
-
-        payload = {
-            "external_id": external_id,
-            "name": str(name),
-            "artist": str(artist),
-            "album": str(row.get("album")) if row.get("album") is not None else None,
-            "genre": str(row.get("genre")) if row.get("genre") is not None else None,
-            "source_dataset": dataset_slug,
-            "metadata_json": {},
-        }
-        for field in FLOAT_FIELDS:
-            payload[field] = _safe_float(row.get(field))
-
-        if existing:
-            for key, value in payload.items():
-                setattr(existing, key, value)
-            updated += 1
-        else:
-            db.add(CatalogTrack(**payload))
-            inserted += 1
-
+    started = time.perf_counter()
+    seen_ids: set[str] = set()
+    if resumed_from:
+        # Replay the dedupe over the committed prefix so a repeated id after
+        # the checkpoint is still dropped instead of overwriting the first.
+        for chunk in pd.read_csv(path, chunksize=chunk_size, nrows=resumed_from):
+            _normalize(chunk, dataset_slug, seen_ids)
+    reader = pd.read_csv(path, chunksize=chunk_size, skiprows=range(1, resumed_from + 1))
+    written = False
+    try:
+        for chunk in reader:
+            rows = _normalize(chunk, dataset_slug, seen_ids)
+            if rows:
+                connection = db.connection()
+                inserted, updated = _write_chunk(connection, rows)
+                catalog_search.reindex(connection, select(CatalogTrack.id).where(
+                    CatalogTrack.external_id.in_([row["external_id"] for row in rows])))
+                checkpoint.inserted += inserted
+                checkpoint.updated += updated
+            checkpoint.rows_done += len(chunk)
+            db.commit()
+            written = written or bool(rows)
+            elapsed = time.perf_counter() - started
+            logger.info("Catalog import %s: %d rows (%.0f rows/s)", key, checkpoint.rows_done,
+                        (checkpoint.rows_done - resumed_from) / elapsed if elapsed else 0.0)
+    except BaseException:
+        # The chunks committed so far are live; publish them to the caches
+        # even if this run is never resumed.
+        db.rollback()
+        if written:
+            catalog_state.bump(db.connection())
+            db.commit()
+        raise
+
+    catalog_state.bump(db.connection())
+    checkpoint.completed_at = datetime.now(timezone.utc)
     db.commit()
-    return {"inserted": inserted, "updated": updated, "total_rows": int(len(df))}
\ No newline at end of file
+    matrix.write_snapshot(db)
+    catalog_stats.rebuild(db)
+    elapsed = time.perf_counter() - started
+    processed = checkpoint.rows_done - resumed_from
+    return {
+        "inserted": checkpoint.inserted,
+        "updated": checkpoint.updated,
+        "total_rows": checkpoint.rows_done,
+        "resumed_from": resumed_from,
+        "rows_per_second": round(processed / elapsed, 1) if elapsed else 0.0,
+    }
@@ -0,0 +1,235 @@
+"""
+Text search over catalog track names and artists.
+
+SQLite keeps an FTS5 index with the trigram tokenizer (`catalog_search`,
+rowid = track id). Every flush that writes a `CatalogTrack` re-indexes those
+tracks in the same transaction, and the bulk catalog import calls `reindex`
+once per chunk. PostgreSQL uses `pg_trgm` GIN indexes on `name` and `artist`.
+Either way a query is answered from the index instead of scanning the table:
+
+  substring – `q` anywhere in the name or artist (the old ILIKE semantics),
+              ranked by bm25 on SQLite and trigram similarity on PostgreSQL
+  fuzzy     – when nothing matches, the closest spellings among the tracks
+              sharing trigrams with `q`, best first (tolerates typos)
+
+Queries shorter than a trigram, or databases without an index (an SQLite
+build lacking FTS5 or its trigram tokenizer), fall back to ILIKE.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from difflib import SequenceMatcher
+from itertools import chain
+from typing import Iterable, Optional, Union
+
+from sqlalchemy import (
+    Select, case, column, delete, event, func, insert, inspect, literal, literal_column, or_,
+    select, table,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Query, Session
+
+from app.models import CatalogTrack
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "catalog_search"
+FTS_TOKENIZER = "trigram"
+FUZZY_MIN_SCORE = 0.75
+FUZZY_CANDIDATES = 500
+CANDIDATE_MIN_OVERLAP = 0.3
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_catalog_tracks_name_trgm "
+    "ON catalog_tracks USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_catalog_tracks_artist_trgm "
+    "ON catalog_tracks USING gin (artist gin_trgm_ops)",
+]
+
+_fts = table(FTS_TABLE, column("rowid"), column("name"), column("artist"))
+_has_index: dict[int, bool] = {}
+
+
+def _install(connection: Connection) -> None:
+    if connection.dialect.name == "postgresql":
+        for statement in _POSTGRES_DDL:
+            connection.exec_driver_sql(statement)
+    elif connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        try:
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(name, artist, tokenize='{FTS_TOKENIZER}')")
+        except OperationalError as exc:
+            # FTS5 left out of the build, or SQLite older than 3.34 (no trigram).
+            logger.warning("Catalog search index unavailable, searching with ILIKE: %s", exc.orig)
+        else:
+            connection.execute(insert(_fts).from_select(
+                ["rowid", "name", "artist"],
+                select(CatalogTrack.id, CatalogTrack.name, CatalogTrack.artist),
+            ))
+    _has_index.pop(id(connection.engine), None)
+
+
+@event.listens_for(CatalogTrack.__table__, "after_create")
+def _create_with_catalog(target, connection: Connection, **_kw) -> None:
+    _install(connection)
+
+
+def ensure_index(engine: Engine) -> None:
+    """Create the index for a catalog table that predates it (run at startup)."""
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql" or not inspect(connection).has_table(FTS_TABLE):
+            logger.info("Building catalog search index")
+            _install(connection)
+
+
+def _sqlite_index(connection: Connection) -> bool:
+    if connection.dialect.name != "sqlite":
+        return False
+    key = id(connection.engine)
+    if key not in _has_index:
+        _has_index[key] = inspect(connection).has_table(FTS_TABLE)
+    return _has_index[key]
+
+
+def reindex(connection: Connection, track_ids: Union[Iterable[int], Select]) -> None:
+    """Refresh the SQLite index entries of `track_ids` (ids or a select of ids).
+
+    Tracks that no longer exist are dropped from the index. Bulk writers that
+    bypass the ORM call this in the same transaction as their write; PostgreSQL
+    maintains its indexes itself.
+    """
+    if not _sqlite_index(connection):
+        return
+    if not isinstance(track_ids, Select):
+        track_ids = list(track_ids)
+    connection.execute(delete(_fts).where(_fts.c.rowid.in_(track_ids)))
+    connection.execute(insert(_fts).from_select(
+        ["rowid", "name", "artist"],
+        select(CatalogTrack.id, CatalogTrack.name, CatalogTrack.artist)
+        .where(CatalogTrack.id.in_(track_ids)),
+    ))
+
+
+@event.listens_for(Session, "after_flush")
+def _index_catalog_writes(session: Session, _flush_context) -> None:
+    track_ids = {obj.id for obj in chain(session.new, session.dirty, session.deleted)
+                 if isinstance(obj, CatalogTrack)}
+    if track_ids:
+        reindex(session.connection(), track_ids)
+
+
+def _index_available(db: Session) -> bool:
+    connection = db.connection()
+    return connection.dialect.name == "postgresql" or _sqlite_index(connection)
+
+
+def _phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _words(text: Optional[str]) -> list[str]:
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def _trigrams(text: str) -> set[str]:
+    return {word[i:i + 3] for word in _words(text) for i in range(len(word) - 2)}
+
+
+def similarity(query: str, text: Optional[str]) -> float:
+    """How closely `text` spells `query` (0–1): each query word is matched to its
+    closest word in `text` by edit similarity and the ratios are averaged."""
+    wanted, words = _words(query), _words(text)
+    if not wanted or not words:
+        return 0.0
+    return sum(max(SequenceMatcher(None, w, t).ratio() for t in words) for w in wanted) / len(wanted)
+
+
+def substring_matches(db: Session, q: str) -> Optional[Select]:
+    """`(id, rank)` rows whose name or artist contains `q`, lower rank first.
+
+    None when `q` is too short for the trigram index or there is no index;
+    callers then fall back to ILIKE.
+    """
+    if len(q.strip()) < 3 or not _index_available(db):
+        return None
+    if db.get_bind().dialect.name == "postgresql":
+        pattern = f"%{q}%"
+        rank = -func.greatest(func.similarity(CatalogTrack.name, q),
+                              func.similarity(CatalogTrack.artist, q))
+        return (select(CatalogTrack.id.label("id"), rank.label("rank"))
+                .where(CatalogTrack.name.ilike(pattern) | CatalogTrack.artist.ilike(pattern)))
+    rank = func.bm25(literal_column(FTS_TABLE))
+    return (select(_fts.c.rowid.label("id"), rank.label("rank"))
+            .where(literal_column(FTS_TABLE).match(_phrase(q.strip()))))
+
+
+def _candidates(db: Session, q: str, limit: int) -> list:
+    """Rows sharing trigrams with `q`, most overlap first."""
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.set_config("pg_trgm.word_similarity_threshold",
+                                          str(CANDIDATE_MIN_OVERLAP), True)))
+        query = literal(q)
+        overlap = func.greatest(func.word_similarity(q, CatalogTrack.name),
+                                func.word_similarity(q, CatalogTrack.artist))
+        return db.execute(
+            select(CatalogTrack.id, CatalogTrack.name, CatalogTrack.artist)
+            .where(or_(query.op("<%")(CatalogTrack.name), query.op("<%")(CatalogTrack.artist)))
+            .order_by(overlap.desc())
+            .limit(limit)
+        ).all()
+    match = " OR ".join(_phrase(g) for g in sorted(_trigrams(q)))
+    return db.execute(
+        select(CatalogTrack.id, CatalogTrack.name, CatalogTrack.artist)
+        .join(_fts, _fts.c.rowid == CatalogTrack.id)
+        .where(literal_column(FTS_TABLE).match(match))
+        .order_by(func.bm25(literal_column(FTS_TABLE)))
+        .limit(limit)
+    ).all()
+
+
+def fuzzy_matches(db: Session, q: str, limit: int = FUZZY_CANDIDATES) -> list[tuple[int, float]]:
+    """Typo-tolerant `(id, score)` matches, best first.
+
+    The trigram index narrows the catalog to a few hundred candidates, which
+    are then re-ranked by `similarity`; trigram overlap alone ranks
+    transpositions ("beatels") poorly.
+    """
+    if not _trigrams(q) or not _index_available(db):
+        return []
+    scored = [
+        (row.id, round(max(similarity(q, row.name), similarity(q, row.artist)), 4))
+        for row in _candidates(db, q, limit)
+    ]
+    scored = [hit for hit in scored if hit[1] >= FUZZY_MIN_SCORE]
+    scored.sort(key=lambda hit: (-hit[1], hit[0]))
+    return scored
+
+
+def apply(db: Session, query: Query, q: str) -> tuple[Query, list, bool]:
+    """
+    Restrict a `CatalogTrack` query to tracks matching `q`, best match first.
+    Falls back to fuzzy matching when nothing contains `q`. Returns the query,
+    the columns it is ordered by (ending in the id, for keyset pagination) and
+    whether it fell back to fuzzy matching.
+    """
+    matches = substring_matches(db, q)
+    if matches is None:
+        pattern = f"%{q}%"
+        keys = [CatalogTrack.name, CatalogTrack.id]
+        return (query.filter(CatalogTrack.name.ilike(pattern) | CatalogTrack.artist.ilike(pattern))
+                .order_by(*keys), keys, False)
+    ranked = matches.subquery()
+    exact = query.join(ranked, ranked.c.id == CatalogTrack.id)
+    keys = [ranked.c.rank, CatalogTrack.name, CatalogTrack.id]
+    if exact.first() is not None:
+        return exact.order_by(*keys), keys, False
+    positions = {track_id: i for i, (track_id, _) in enumerate(fuzzy_matches(db, q))}
+    if not positions:
+        return exact, keys, False
+    keys = [case(positions, value=CatalogTrack.id), CatalogTrack.id]
+    return query.filter(CatalogTrack.id.in_(positions)).order_by(*keys), keys, True
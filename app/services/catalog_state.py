@@ -0,0 +1,52 @@
+"""Catalog version tracking for process-wide catalog caches.
+
+Every flush that inserts, updates or deletes a `CatalogTrack` bumps the
+single `catalog_state` row inside the same transaction, so the new token
+becomes visible to other sessions and workers exactly when the catalog
+change commits. Bulk importers that bypass the ORM call `bump` directly.
+"""
+
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timezone
+from itertools import chain
+from typing import Optional
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.models import CatalogState, CatalogTrack
+
+STATE_ID = 1
+
+
+def current_token(db: Session) -> Optional[str]:
+    """Return the catalog version token, or None if the catalog was never written."""
+    return db.execute(
+        select(CatalogState.token).where(CatalogState.id == STATE_ID)
+    ).scalar()
+
+
+def bump(connection: Connection) -> None:
+    """Advance the catalog version on the given connection's transaction."""
+    now = datetime.now(timezone.utc)
+    token = uuid.uuid4().hex
+    result = connection.execute(
+        update(CatalogState)
+        .where(CatalogState.id == STATE_ID)
+        .values(version=CatalogState.version + 1, token=token, updated_at=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(
+            insert(CatalogState).values(id=STATE_ID, version=1, token=token, updated_at=now)
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_on_catalog_write(session: Session, _flush_context) -> None:
+    # new/dirty/deleted still describe the pre-flush state here.
+    if any(isinstance(obj, CatalogTrack)
+           for obj in chain(session.new, session.dirty, session.deleted)):
+        bump(session.connection())
@@ -0,0 +1,259 @@
+"""
+Materialized catalog-wide analytics.
+
+The mood map, audio DNA and genre breakdown only change when the catalog
+does, so each report is computed once from the catalog feature matrix and
+stored in `catalog_stats`, stamped with the `catalog_state` version it was
+built at. `rebuild` runs at the end of every catalog import; `get` serves the
+stored row and recomputes it only when the catalog has moved on since (e.g.
+tracks written through the ORM). Reads are two primary-key lookups however
+large the catalog is.
+"""
+
+from __future__ import annotations
+
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import numpy as np
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import CatalogState, CatalogStats, CatalogTrack
+from app.schemas import (
+    AudioDNAFeature, CatalogAudioDNAResult, CatalogMoodMapResult,
+    GenreBreakdownResult, GenreStat, MoodQuadrantStat,
+)
+from app.services.catalog_state import STATE_ID
+from app.services.similarity import (
+    FEATURES, TEMPO_MAX, CatalogMatrix, get_catalog_matrix, mood_label, mood_masks,
+)
+
+MOOD_MAP = "mood_map"
+AUDIO_DNA = "audio_dna"
+GENRES = "genres"
+
+FEATURE_DESCRIPTIONS = {
+    "energy":           "Intensity and activity — higher means louder and faster",
+    "valence":          "Musical positivity — higher means happier and more cheerful",
+    "danceability":     "How suitable a track is for dancing based on tempo and rhythm",
+    "acousticness":     "Confidence that the track is acoustic (unplugged)",
+    "instrumentalness": "Predicts whether a track contains no vocals",
+    "speechiness":      "Presence of spoken words — high values indicate rap or spoken word",
+    "liveness":         "Likelihood the track was performed live",
+    "tempo":            "Estimated tempo in BPM, normalised 0–1",
+}
+
+MOOD_DESCRIPTIONS = {
+    "Happy": "Your catalog leans upbeat and energetic — great for workouts and parties.",
+    "Calm":  "Your catalog leans calm and positive — ideal for studying and relaxing.",
+    "Angry": "Your catalog leans intense and driven — perfect for focus and motivation.",
+    "Sad":   "Your catalog leans reflective and mellow — suited for late nights.",
+}
+
+
+def _safe_mean(vals: np.ndarray) -> float:
+    return round(float(vals.mean(dtype=np.float64)), 4) if len(vals) else 0.0
+
+
+def _percentile(vals: np.ndarray, p: float) -> float:
+    return round(float(np.percentile(vals.astype(np.float64), p)), 4) if len(vals) else 0.0
+
+
+def _present(vals: np.ndarray) -> np.ndarray:
+    return vals[~np.isnan(vals)]
+
+
+def mood_map(db: Session, matrix: CatalogMatrix) -> Optional[CatalogMoodMapResult]:
+    energy, valence = matrix.column("energy"), matrix.column("valence")
+    rated = ~np.isnan(energy) & ~np.isnan(valence)
+    total = int(np.count_nonzero(rated))
+    if not total:
+        return None
+
+    masks = {mood: np.flatnonzero(rated & mask)
+             for mood, mask in mood_masks(energy, valence).items()}
+    example_ids = [int(matrix.ids[r]) for rows in masks.values() for r in rows[:3]]
+    names = {
+        t.id: f"{t.name} — {t.artist}"
+        for t in db.query(CatalogTrack.id, CatalogTrack.name, CatalogTrack.artist)
+        .filter(CatalogTrack.id.in_(example_ids))
+    }
+
+    danceability = matrix.column("danceability")
+    quadrants = []
+    for mood in ["Happy", "Calm", "Angry", "Sad"]:
+        rows = masks[mood]
+        if not len(rows):
+            continue
+        quadrants.append(MoodQuadrantStat(
+            mood=mood,
+            count=len(rows),
+            percentage=round(len(rows) / total * 100, 2),
+            avg_energy=_safe_mean(energy[rows]),
+            avg_valence=_safe_mean(valence[rows]),
+            avg_danceability=_safe_mean(_present(danceability[rows])),
+            example_tracks=[names[int(i)] for i in matrix.ids[rows[:3]] if int(i) in names],
+        ))
+
+    most_common = max(quadrants, key=lambda x: x.count).mood
+    return CatalogMoodMapResult(
+        total_tracks=total,
+        quadrants=quadrants,
+        most_common_mood=most_common,
+        description=MOOD_DESCRIPTIONS.get(most_common, "A balanced mood distribution."),
+    )
+
+
+def audio_dna(db: Session, matrix: CatalogMatrix) -> Optional[CatalogAudioDNAResult]:
+    rows = np.flatnonzero(~np.isnan(matrix.column("energy")))
+    if not len(rows):
+        return None
+
+    columns = {f: matrix.column(f)[rows] for f in FEATURES}
+    columns["tempo"] = np.round(matrix.column("tempo")[rows].astype(np.float64) / TEMPO_MAX, 4)
+
+    features = []
+    for f in FEATURES + ["tempo"]:
+        vals = _present(columns[f])
+        if not len(vals):
+            continue
+        features.append(AudioDNAFeature(
+            feature=f,
+            mean=_safe_mean(vals),
+            percentile_25=_percentile(vals, 25),
+            percentile_75=_percentile(vals, 75),
+            min_value=round(float(vals.min()), 4),
+            max_value=round(float(vals.max()), 4),
+            description=FEATURE_DESCRIPTIONS.get(f, f),
+        ))
+
+    codes = matrix.genre_codes[rows]
+    genre_fingerprints = {}
+    for code in dict.fromkeys(codes[codes >= 0].tolist()):
+        in_genre = codes == code
+        if np.count_nonzero(in_genre) < 3:
+            continue
+        fingerprint = {}
+        for f in FEATURES:
+            vals = _present(columns[f][in_genre])
+            if len(vals):
+                fingerprint[f] = _safe_mean(vals)
+        genre_fingerprints[matrix.genres[code]] = fingerprint
+
+    energy_mean = next((f.mean for f in features if f.feature == "energy"), 0.5)
+    valence_mean = next((f.mean for f in features if f.feature == "valence"), 0.5)
+    dance_mean = next((f.mean for f in features if f.feature == "danceability"), 0.5)
+    insight = (
+        f"Across {len(rows)} catalog tracks, the average energy is {energy_mean} "
+        f"and average valence is {valence_mean}, placing the catalog in the "
+        f"'{mood_label(energy_mean, valence_mean)}' mood quadrant. "
+        f"Average danceability is {dance_mean} across "
+        f"{len(genre_fingerprints)} distinct genre fingerprints."
+    )
+
+    return CatalogAudioDNAResult(
+        total_tracks=len(rows),
+        features=features,
+        genre_fingerprints=genre_fingerprints,
+        insight=insight,
+    )
+
+
+def genre_breakdown(db: Session, matrix: CatalogMatrix) -> GenreBreakdownResult:
+    codes = matrix.genre_codes
+    tagged = codes >= 0
+    n_genres = len(matrix.genres)
+
+    def per_genre(feature: str) -> tuple[np.ndarray, np.ndarray]:
+        vals = matrix.column(feature)
+        ok = tagged & ~np.isnan(vals)
+        counts = np.bincount(codes[ok], minlength=n_genres)
+        sums = np.bincount(codes[ok], weights=vals[ok].astype(np.float64), minlength=n_genres)
+        return counts, sums
+
+    stats = {f: per_genre(f) for f in ("energy", "valence", "danceability", "tempo")}
+
+    def mean(feature: str, code: int) -> Optional[float]:
+        counts, sums = stats[feature]
+        return round(float(sums[code] / counts[code]), 4) if counts[code] else None
+
+    genres = sorted(
+        [
+            GenreStat(
+                genre=genre,
+                track_count=int(stats["energy"][0][code] or stats["valence"][0][code] or 1),
+                avg_energy=mean("energy", code),
+                avg_valence=mean("valence", code),
+                avg_danceability=mean("danceability", code),
+                avg_tempo=mean("tempo", code),
+            )
+            for code, genre in enumerate(matrix.genres)
+        ],
+        key=lambda x: -x.track_count,
+    )
+    return GenreBreakdownResult(total_genres=len(genres), genres=genres)
+
+
+REPORTS: dict[str, Callable[[Session, CatalogMatrix], Optional[BaseModel]]] = {
+    MOOD_MAP: mood_map,
+    AUDIO_DNA: audio_dna,
+    GENRES: genre_breakdown,
+}
+
+_lock = threading.Lock()
+
+
+def _catalog_version(db: Session) -> tuple[int, Optional[str]]:
+    row = db.execute(
+        select(CatalogState.version, CatalogState.token).where(CatalogState.id == STATE_ID)
+    ).first()
+    return (row.version, row.token) if row else (0, None)
+
+
+def _refresh(db: Session, name: str, version: int, token: str) -> Optional[dict]:
+    result = REPORTS[name](db, get_catalog_matrix(db))
+    payload = None
+    if result is not None:
+        result.catalog_version = version
+        payload = result.model_dump()
+    row = db.get(CatalogStats, name)
+    if row is None:
+        row = CatalogStats(name=name)
+        db.add(row)
+    row.version, row.token, row.payload = version, token, payload
+    row.computed_at = datetime.now(timezone.utc)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker stored the same report first; ours is just as current.
+        db.rollback()
+    return payload
+
+
+def rebuild(db: Session) -> int:
+    """Recompute and store every report; returns the catalog version they describe."""
+    version, token = _catalog_version(db)
+    if token is not None:
+        with _lock:
+            for name in REPORTS:
+                _refresh(db, name, version, token)
+    return version
+
+
+def get(db: Session, name: str) -> Optional[dict]:
+    """
+    The stored report `name`, stamped with the catalog version it describes,
+    or None when the catalog has nothing to report on.
+    """
+    version, token = _catalog_version(db)
+    if token is None:
+        return None
+    row = db.get(CatalogStats, name)
+    if row is not None and row.token == token:
+        return row.payload
+    with _lock:
+        return _refresh(db, name, version, token)
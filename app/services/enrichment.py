@@ -0,0 +1,126 @@
+"""
+Deferred LLM enrichment.
+
+With `?enrich=async` the analytics and recommendation endpoints answer with
+their deterministic template text straight away and hand back an
+`enrichment_key`. The LLM rewrite runs as a background task after the
+response has been sent and is kept here until the client fetches it from
+`GET /ai/enrichments/{key}`.
+
+Keys are the content hash of the LLM request (see `llm_cache.cache_key`), so
+repeating the same request reuses the pending or finished entry instead of
+calling the provider again. Entries are held in a bounded in-process map;
+the oldest are dropped first.
+
+The finished text is also in the LLM cache under the same key, and each
+requester gets a small grant entry there that records the status. When the
+local map has no entry, because the poll reached another worker, the
+process restarted or the entry was evicted, `get` answers from the cache
+instead. With the sqlite backend this works across workers and restarts.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import BackgroundTasks, Query
+
+from app.services import llm as llm_client
+from app.services.llm_cache import cache_key
+
+MAX_ENTRIES = 1024
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+ENRICH_QUERY = Query("sync", pattern="^(sync|async)$",
+                     description="`async` returns the template text at once with an `enrichment_key` "
+                                 "to poll at GET /ai/enrichments/{key}")
+
+
+@dataclass
+class Enrichment:
+    key: str
+    prompt: str
+    max_tokens: int
+    temperature: float
+    owners: set[int] = field(default_factory=set)
+    status: str = PENDING
+    text: Optional[str] = None
+    started: bool = False
+
+
+_entries: OrderedDict[str, Enrichment] = OrderedDict()
+_lock = threading.Lock()
+
+
+def _grant(user_id: int, key: str) -> str:
+    return hashlib.sha256(f"enrichment|{user_id}|{key}".encode()).hexdigest()
+
+
+def _record(owners: set[int], key: str, status: str) -> None:
+    cache = llm_client.get_client().cache
+    for user_id in owners:
+        cache.set(_grant(user_id, key), status)
+
+
+def submit(user_id: int, prompt: str, *, max_tokens: int, temperature: float) -> str:
+    """Register a rewrite for `user_id` and return its key; `run` performs it."""
+    key = cache_key(llm_client.get_client().model, prompt, max_tokens, temperature)
+    _record({user_id}, key, PENDING)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            entry = Enrichment(key, prompt, max_tokens, temperature)
+            _entries[key] = entry
+            while len(_entries) > MAX_ENTRIES:
+                _entries.popitem(last=False)
+        elif entry.status == FAILED:
+            entry.status, entry.started = PENDING, False
+        entry.owners.add(user_id)
+    return key
+
+
+async def run(key: str) -> None:
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry.started:
+            return
+        entry.started = True
+    text = await llm_client.chat(entry.prompt, max_tokens=entry.max_tokens,
+                                 temperature=entry.temperature)
+    entry.text = text
+    entry.status = READY if text else FAILED
+    if not text:
+        _record(set(entry.owners), key, FAILED)
+
+
+def schedule(result, background: BackgroundTasks):
+    """Queue the rewrite for a deferred result to run after the response is sent."""
+    if result.enrichment_key:
+        background.add_task(run, result.enrichment_key)
+    return result
+
+
+def get(user_id: int, key: str) -> Optional[Enrichment]:
+    """The entry for `key`, or None when unknown or not owned by `user_id`."""
+    entry = _entries.get(key)
+    if entry is not None:
+        return entry if user_id in entry.owners else None
+    cache = llm_client.get_client().cache
+    status = cache.get(_grant(user_id, key))
+    if status is None:
+        return None
+    text = cache.get(key)
+    return Enrichment(key, "", 0, 0.0, owners={user_id},
+                      status=READY if text else status, text=text)
+
+
+def clear() -> None:
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,363 @@
+"""
+Push-based fan-out of new listening events to `/listening-events/stream`.
+
+Writers publish once their transaction has committed: `create_event` one
+event at a time, `event_writer` once per committed chunk. Every stream
+subscribes with its own bounded asyncio queue and simply waits on it, so an
+idle stream does no database work at all.
+
+Messages are batches (lists of event payloads), one per publish, and each
+queue holds EVENT_STREAM_QUEUE of them. A subscriber that falls further
+behind is cut off (its queue is replaced by an overflow marker) instead of
+stalling the publisher or buffering without bound; the client reconnects.
+
+Publishing goes through a broker selected by EVENT_BROKER:
+
+  local  – delivers straight to this process's subscribers
+  sqlite – appends to a SQLite file (EVENT_BROKER_PATH) that one thread per
+           worker tails, so an event written by any worker reaches streams
+           on all of them (a stand-in for Redis pub/sub on a single host)
+
+Publishers may run on any thread; delivery hops onto each subscriber's
+event loop with `call_soon_threadsafe`.
+
+Streams are resumable. Frames carry the event id as the SSE `id:`, and while
+a user has a stream open (and for EVENT_REPLAY_TTL seconds after the last
+one closes) the hub also keeps their last EVENT_REPLAY_BUFFER payloads in a
+ring buffer. A reconnect with `Last-Event-ID` is answered from that buffer
+when it reaches back far enough, and from one database query otherwise.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import ListeningEvent, Track
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15.0
+
+_OVERFLOW: list = []
+
+
+class SubscriberOverflow(Exception):
+    """The subscriber fell more than a full queue behind and was dropped."""
+
+
+def event_payload(event: ListeningEvent, track: Optional[Track]) -> dict:
+    return {
+        "event_id": event.id,
+        "track_id": event.track_id,
+        "track_title": track.title if track else None,
+        "artist": track.artist if track else None,
+        "genre": track.genre if track else None,
+        "listened_at": event.listened_at.isoformat() if event.listened_at else None,
+        "duration_ms": event.duration_listened_ms,
+        "source": event.source,
+    }
+
+
+def row_payloads(connection: Connection, rows: Sequence) -> dict[int, list[dict]]:
+    """Payloads for bulk-inserted `listening_events` rows, per user, in id order."""
+    tracks = {
+        t.id: t for t in connection.execute(
+            select(Track.id, Track.title, Track.artist, Track.genre)
+            .where(Track.id.in_({row.track_id for row in rows}))
+        )
+    }
+    by_user: dict[int, list[dict]] = defaultdict(list)
+    for row in sorted(rows, key=lambda r: r.id):
+        by_user[row.user_id].append(event_payload(row, tracks.get(row.track_id)))
+    return by_user
+
+
+def missed_events(db: Session, user_id: int, after: int, limit: int) -> Optional[list[dict]]:
+    """Payloads for `user_id`'s events after id `after`, or None if more than `limit`."""
+    rows = (
+        db.query(ListeningEvent, Track)
+        .outerjoin(Track, Track.id == ListeningEvent.track_id)
+        .filter(ListeningEvent.user_id == user_id, ListeningEvent.id > after)
+        .order_by(ListeningEvent.id)
+        .limit(limit + 1)
+        .all()
+    )
+    if len(rows) > limit:
+        return None
+    return [event_payload(event, track) for event, track in rows]
+
+
+class _Replay:
+    """One user's recent payloads; every event after `complete_after()` is held."""
+
+    __slots__ = ("items", "covered_from", "evicted", "idle_since")
+
+    def __init__(self, size: int):
+        self.items: deque = deque(maxlen=size)
+        self.covered_from: Optional[int] = None
+        self.evicted = 0
+        self.idle_since: Optional[float] = None
+
+    def add(self, batch: list[dict]) -> None:
+        for payload in batch:
+            if len(self.items) == self.items.maxlen:
+                self.evicted = max(self.evicted, self.items[0]["event_id"])
+            self.items.append(payload)
+
+    def complete_after(self) -> Optional[int]:
+        return None if self.covered_from is None else max(self.covered_from, self.evicted)
+
+
+class Subscription:
+    """One stream's bounded queue; create it on the event loop that reads it."""
+
+    def __init__(self, user_id: int, maxsize: int):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def _put(self, batch: list) -> None:
+        if self.queue.maxsize and self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            batch = _OVERFLOW
+        self.queue.put_nowait(batch)
+
+    async def get(self, timeout: float) -> list[dict]:
+        """The next batch, or [] after `timeout` quiet seconds."""
+        try:
+            batch = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        if batch is _OVERFLOW:
+            raise SubscriberOverflow(self.user_id)
+        return batch
+
+
+class Hub:
+    """Per-process registry of subscriptions, keyed by user."""
+
+    def __init__(self, queue_size: int = 256, replay_size: int = 256, replay_ttl: float = 300.0):
+        self.queue_size = queue_size
+        self.replay_size = replay_size
+        self.replay_ttl = replay_ttl
+        self._subscribers: dict[int, set[Subscription]] = defaultdict(set)
+        self._replays: dict[int, _Replay] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+            if self.replay_size > 0:
+                replay = self._replays.get(user_id)
+                if replay is None:
+                    replay = self._replays[user_id] = _Replay(self.replay_size)
+                replay.idle_since = None
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        now = time.monotonic()
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+                    replay = self._replays.get(subscription.user_id)
+                    if replay is not None:
+                        replay.idle_since = now
+            for user_id in [u for u, r in self._replays.items()
+                            if r.idle_since is not None and now - r.idle_since > self.replay_ttl]:
+                del self._replays[user_id]
+
+    def cover(self, user_id: int, after: int) -> None:
+        """Record that every event of `user_id` after id `after` reaches the buffer.
+
+        Call with a watermark read after subscribing: later commits are
+        published to the subscription, and so to the buffer, too.
+        """
+        with self._lock:
+            replay = self._replays.get(user_id)
+            if replay is not None and (replay.covered_from is None or after < replay.covered_from):
+                replay.covered_from = after
+
+    def replay(self, user_id: int, after: int) -> Optional[list[dict]]:
+        """Buffered payloads after id `after`, or None if the buffer does not reach back."""
+        with self._lock:
+            replay = self._replays.get(user_id)
+            complete_after = replay.complete_after() if replay is not None else None
+            if complete_after is None or after < complete_after:
+                return None
+            return sorted((p for p in replay.items if p["event_id"] > after),
+                          key=lambda p: p["event_id"])
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def deliver(self, user_id: int, batch: list[dict]) -> None:
+        with self._lock:
+            replay = self._replays.get(user_id)
+            if replay is not None:
+                replay.add(batch)
+            subscribers = tuple(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, batch)
+            except RuntimeError:
+                # The stream's event loop has closed under it.
+                self.unsubscribe(subscription)
+
+
+class Broker(ABC):
+    """Backend interface: `publish` must reach `hub.deliver` in every worker."""
+
+    backend = "none"
+
+    def __init__(self, hub: Hub):
+        self.hub = hub
+
+    @abstractmethod
+    def publish(self, user_id: int, batch: list[dict]) -> None:
+        ...
+
+    def start(self) -> None:
+        """Called before each subscription; start listening if not already."""
+
+    def close(self) -> None:
+        pass
+
+
+class LocalBroker(Broker):
+    backend = "local"
+
+    def publish(self, user_id: int, batch: list[dict]) -> None:
+        self.hub.deliver(user_id, batch)
+
+
+class SQLiteBroker(Broker):
+    backend = "sqlite"
+
+    def __init__(self, hub: Hub, path: str, poll_interval: float = 0.25,
+                 retention: float = 60.0):
+        super().__init__(hub)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS event_broker ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,"
+            " batch TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def publish(self, user_id: int, batch: list[dict]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO event_broker (user_id, batch, created_at) VALUES (?, ?, ?)",
+                (user_id, json.dumps(batch), now),
+            )
+            self._conn.execute("DELETE FROM event_broker WHERE created_at < ?",
+                               (now - self.retention,))
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM event_broker").fetchone()[0]
+            self._thread = threading.Thread(target=self._tail, args=(last_seq,),
+                                            name="event-broker", daemon=True)
+            self._thread.start()
+
+    def _tail(self, last_seq: int) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                with self._lock:
+                    rows = self._conn.execute(
+                        "SELECT seq, user_id, batch FROM event_broker WHERE seq > ? ORDER BY seq",
+                        (last_seq,),
+                    ).fetchall()
+            except sqlite3.Error:
+                logger.exception("Event broker poll failed")
+                continue
+            for seq, user_id, batch in rows:
+                last_seq = seq
+                self.hub.deliver(user_id, json.loads(batch))
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval * 4)
+        self._conn.close()
+
+
+def build_broker(hub: Hub) -> Broker:
+    """Broker selected by EVENT_BROKER (local | sqlite)."""
+    backend = settings.EVENT_BROKER.lower()
+    if backend == "local":
+        return LocalBroker(hub)
+    if backend == "sqlite":
+        return SQLiteBroker(hub, settings.EVENT_BROKER_PATH)
+    raise ValueError(f"Unknown EVENT_BROKER {settings.EVENT_BROKER!r}")
+
+
+hub = Hub(settings.EVENT_STREAM_QUEUE, settings.EVENT_REPLAY_BUFFER, settings.EVENT_REPLAY_TTL)
+_broker: Optional[Broker] = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> Broker:
+    """The process-wide broker, configured from settings on first use."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = build_broker(hub)
+        return _broker
+
+
+def publish(user_id: int, batch: Iterable[dict]) -> None:
+    """Push committed events to `user_id`'s streams (in every worker)."""
+    batch = list(batch)
+    if batch:
+        get_broker().publish(user_id, batch)
+
+
+def subscribe(user_id: int) -> Subscription:
+    """Open a subscription for the calling event loop; pair with `unsubscribe`."""
+    get_broker().start()
+    return hub.subscribe(user_id)
+
+
+def unsubscribe(subscription: Subscription) -> None:
+    hub.unsubscribe(subscription)
+
+
+def stats() -> dict:
+    return {"backend": get_broker().backend, "subscribers": hub.subscriber_count()}
+
+
+def shutdown() -> None:
+    global _broker
+    with _broker_lock:
+        broker, _broker = _broker, None
+    if broker is not None:
+        broker.close()
@@ -0,0 +1,84 @@
+"""
+Chunked bulk writer for listening events.
+
+Large imports produce tens of thousands of events. Rather than building one
+ORM object per event and committing them all at once, `write_events` drains
+an iterable of row dicts in chunks of EVENT_WRITE_CHUNK. Each chunk is a
+single executemany INSERT plus the matching fingerprint update, committed
+as its own transaction. Memory stays bounded by the chunk size, and the
+database write lock is only held for one chunk at a time. Once a chunk has
+committed, its events are published to the live stream as one batch per
+user.
+
+`write_batch` writes one client-submitted batch as a single chunk and
+returns the new rows in submission order.
+
+Rows are dicts with `user_id`, `track_id`, `listened_at`,
+`duration_listened_ms` and `source`.
+"""
+
+from __future__ import annotations
+
+from itertools import islice
+from typing import Callable, Iterable, Optional, Sequence
+
+from sqlalchemy import Row, insert
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import ListeningEvent
+from app.services import event_stream, fingerprint
+
+
+def _write_chunk(db: Session, chunk: list[dict],
+                 on_chunk: Optional[Callable[[int], None]] = None) -> Sequence[Row]:
+    connection = db.connection()
+    written = connection.execute(
+        insert(ListeningEvent).returning(*ListeningEvent.__table__.columns), chunk
+    ).all()
+    fingerprint.apply(connection, [
+        fingerprint.Contribution(row["user_id"], row["track_id"], row["listened_at"], 1)
+        for row in chunk
+    ])
+    fingerprint.expire_states(db, {row["user_id"] for row in chunk})
+    if on_chunk is not None:
+        on_chunk(len(chunk))
+    payloads = event_stream.row_payloads(connection, written)
+    db.commit()
+    for user_id, batch in payloads.items():
+        event_stream.publish(user_id, batch)
+    return written
+
+
+def write_events(db: Session, rows: Iterable[dict], *, chunk_size: Optional[int] = None,
+                 on_chunk: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Insert `rows` chunk by chunk and return how many were written.
+
+    `on_chunk(n)` runs before each chunk's commit, so ORM changes it makes
+    (e.g. a running `ImportJob.events_created`) commit with that chunk.
+    Pending changes already on `db` are committed with the first chunk.
+    """
+    chunk_size = chunk_size or settings.EVENT_WRITE_CHUNK
+    rows = iter(rows)
+    written = 0
+    while chunk := list(islice(rows, chunk_size)):
+        _write_chunk(db, chunk, on_chunk)
+        written += len(chunk)
+    return written
+
+
+def write_batch(db: Session, rows: list[dict]) -> list[Row]:
+    """
+    Insert `rows` as a single chunk, whatever its size, and return the new
+    `listening_events` rows in the order of `rows`. The fingerprint and the
+    live stream are updated once for the whole batch.
+
+    The rows go out as multi-row INSERT … RETURNING statements, issued in
+    parameter order, and SQLite and PostgreSQL assign the autoincrement ids
+    in VALUES order. The RETURNING rows themselves come back unordered, so
+    sorting them by id puts them back in the order of `rows`.
+    """
+    if not rows:
+        return []
+    return sorted(_write_chunk(db, rows), key=lambda row: row.id)
@@ -0,0 +1,347 @@
+"""
+Incremental maintenance of per-user fingerprint aggregates.
+
+`FingerprintState` keeps running sums and counts of a user's track
+features, the number of distinct tracks played, and genre / artist / hour /
+mood histograms. Every flush that inserts, updates or deletes a
+`ListeningEvent` folds the change into the affected users' state rows in
+the same transaction, and so does every flush that changes the artist,
+genre or features of a `Track` someone has played (the import fills in
+missing values): those plays move from the old values to the new ones.
+Reading a fingerprint is then a single-row fetch instead of a scan of the
+whole history.
+
+A missing state row is bootstrapped with one SQL aggregation pass the first
+time it is read. The row is claimed (committed empty, at version 0) and
+locked before the history is aggregated, so an event written concurrently is
+either seen by the aggregation or folded in by its writer afterwards. Bulk
+writers that bypass the ORM call `apply` directly.
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+from sqlalchemy import case, event, extract, func, inspect, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+from app.models import FingerprintState, ListeningEvent, Track
+
+FEATURES = ("energy", "valence", "danceability", "tempo")
+TRACK_FIELDS = ("artist", "genre", *FEATURES)
+
+
+def mood_label(energy: float, valence: float) -> str:
+    if energy >= 0.55 and valence >= 0.55:
+        return "happy"
+    if energy >= 0.55 and valence < 0.55:
+        return "intense"
+    if energy < 0.55 and valence >= 0.55:
+        return "calm"
+    return "melancholic"
+
+
+def mood_case():
+    """SQL equivalent of `mood_label` over a joined `Track`."""
+    return case(
+        (Track.energy >= 0.55, case((Track.valence >= 0.55, "happy"), else_="intense")),
+        else_=case((Track.valence >= 0.55, "calm"), else_="melancholic"),
+    )
+
+
+def top_keys(histogram: dict[str, list], n: int) -> list[str]:
+    """The n most frequent keys; ties go to the key heard first."""
+    ranked = sorted(histogram.items(), key=lambda kv: (-kv[1][0], kv[1][1] or ""))
+    return [key for key, _ in ranked[:n]]
+
+
+def _stamp(listened_at: Optional[datetime]) -> Optional[str]:
+    """Comparable UTC timestamp string (the database stores naive UTC)."""
+    if listened_at is None:
+        return None
+    if listened_at.tzinfo is not None:
+        listened_at = listened_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return listened_at.isoformat()
+
+
+def _histogram_keys(track, listened_at: Optional[datetime]) -> dict[str, Optional[str]]:
+    mood = None
+    if track.energy is not None and track.valence is not None:
+        mood = mood_label(track.energy, track.valence)
+    return {
+        "genre_counts": track.genre or None,
+        "artist_counts": track.artist or None,
+        "hour_counts": str(listened_at.hour) if listened_at else None,
+        "mood_counts": mood,
+    }
+
+
+def _count(histogram: dict[str, list], key: str, n: int, stamp: Optional[str]) -> None:
+    entry = histogram.get(key)
+    if n > 0:
+        if entry is None:
+            histogram[key] = [n, stamp]
+        else:
+            entry[0] += n
+            if stamp and (entry[1] is None or stamp < entry[1]):
+                entry[1] = stamp
+    elif entry is not None:
+        # The first-heard stamp is kept on removal; it only orders ties.
+        entry[0] += n
+        if entry[0] <= 0:
+            del histogram[key]
+
+
+def _fold(state: dict, track, listened_at: Optional[datetime], n: int,
+          stamp: Optional[str]) -> None:
+    """Add `n` plays of `track` to `state` (remove them when `n` < 0)."""
+    for f in FEATURES:
+        value = getattr(track, f)
+        if value is not None:
+            state[f"{f}_sum"] += n * value
+            state[f"{f}_count"] += n
+    for column, key in _histogram_keys(track, listened_at).items():
+        if key is not None:
+            _count(state[column], key, n, stamp)
+
+
+class Contribution(NamedTuple):
+    user_id: int
+    track_id: int
+    listened_at: Optional[datetime]
+    sign: int  # +1 for an event added, -1 for an event removed
+
+
+class TrackValues(NamedTuple):
+    """The `Track` columns a fingerprint depends on (TRACK_FIELDS)."""
+    artist: Optional[str]
+    genre: Optional[str]
+    energy: Optional[float]
+    valence: Optional[float]
+    danceability: Optional[float]
+    tempo: Optional[float]
+
+
+def apply(connection: Connection, contributions: list[Contribution],
+          track_changes: Optional[dict[int, tuple[TrackValues, TrackValues]]] = None) -> set[int]:
+    """Fold event additions/removals, and edits of played tracks, into existing state rows.
+
+    Must run after the events themselves are written (the distinct-track
+    count is derived from the post-change play counts). `track_changes` maps
+    a track id to its (old, new) values; the plays of that track that were
+    counted before this change move from the old values to the new ones.
+    Users without a built state row (missing, or claimed at version 0 by a
+    bootstrap in progress) are skipped; the bootstrap counts their events.
+    Returns the ids of the users whose state was updated.
+
+    The state rows are read with SELECT ... FOR UPDATE (in user id order),
+    so concurrent writers for the same user serialise instead of
+    overwriting each other's sums.
+    """
+    track_changes = track_changes or {}
+    replays = []
+    if track_changes:
+        replays = connection.execute(
+            select(ListeningEvent.user_id, ListeningEvent.track_id, func.count(),
+                   func.min(ListeningEvent.listened_at))
+            .where(ListeningEvent.track_id.in_(track_changes))
+            .group_by(ListeningEvent.user_id, ListeningEvent.track_id)
+        ).all()
+    user_ids = {c.user_id for c in contributions} | {row[0] for row in replays}
+    if not user_ids:
+        return set()
+    states = {
+        row["user_id"]: dict(row)
+        for row in connection.execute(
+            select(FingerprintState.__table__)
+            .where(FingerprintState.user_id.in_(user_ids))
+            .order_by(FingerprintState.user_id)
+            .with_for_update()
+        ).mappings()
+        if row["version"]
+    }
+    contributions = [c for c in contributions if c.user_id in states]
+    replays = [row for row in replays if row[0] in states]
+    if not contributions and not replays:
+        return set()
+
+    net: Counter = Counter()
+    for c in contributions:
+        net[(c.user_id, c.track_id)] += c.sign
+    for user_id, track_id, plays, first in replays:
+        # Plays added or removed in this same change are folded below with
+        # the new values; only the ones counted before it move.
+        before = plays - net[(user_id, track_id)]
+        if before > 0:
+            old, new = track_changes[track_id]
+            _fold(states[user_id], old, None, -before, None)
+            _fold(states[user_id], new, None, before, _stamp(first))
+
+    track_ids = {c.track_id for c in contributions}
+    if track_ids:
+        tracks = {
+            row.id: row
+            for row in connection.execute(
+                select(Track.id, Track.artist, Track.genre,
+                       *(getattr(Track, f) for f in FEATURES))
+                .where(Track.id.in_(track_ids))
+            )
+        }
+
+        plays_after = {
+            (user_id, track_id): plays
+            for user_id, track_id, plays in connection.execute(
+                select(ListeningEvent.user_id, ListeningEvent.track_id, func.count())
+                .where(ListeningEvent.user_id.in_(states), ListeningEvent.track_id.in_(track_ids))
+                .group_by(ListeningEvent.user_id, ListeningEvent.track_id)
+            )
+        }
+        for (user_id, track_id), delta in net.items():
+            after = plays_after.get((user_id, track_id), 0)
+            states[user_id]["distinct_tracks"] += (after > 0) - (after - delta > 0)
+
+        for c in contributions:
+            state = states[c.user_id]
+            state["total_events"] += c.sign
+            track = tracks.get(c.track_id)
+            if track is not None:
+                _fold(state, track, c.listened_at, c.sign, _stamp(c.listened_at))
+
+    now = datetime.now(timezone.utc)
+    for user_id, state in states.items():
+        for f in FEATURES:
+            if state[f"{f}_count"] <= 0:  # drop accumulated float drift
+                state[f"{f}_sum"], state[f"{f}_count"] = 0.0, 0
+        values = {k: v for k, v in state.items() if k != "user_id"}
+        values["version"] += 1
+        values["updated_at"] = now
+        connection.execute(
+            update(FingerprintState).where(FingerprintState.user_id == user_id).values(**values)
+        )
+    return set(states)
+
+
+def _previous(obj: ListeningEvent) -> Optional[Contribution]:
+    """The contribution an updated event made before this flush, if it moved."""
+    insp = inspect(obj)
+    changed = False
+    values = []
+    for attr in ("user_id", "track_id", "listened_at"):
+        history = insp.attrs[attr].history
+        if history.deleted:
+            changed = True
+            values.append(history.deleted[0])
+        else:
+            values.append(getattr(obj, attr))
+    return Contribution(*values, -1) if changed else None
+
+
+def _track_change(obj: Track) -> Optional[tuple[TrackValues, TrackValues]]:
+    """(old, new) values of a flushed `Track` whose fingerprint columns changed."""
+    insp = inspect(obj)
+    old = TrackValues(*(
+        insp.attrs[attr].history.deleted[0] if insp.attrs[attr].history.deleted
+        else getattr(obj, attr)
+        for attr in TRACK_FIELDS
+    ))
+    new = TrackValues(*(getattr(obj, attr) for attr in TRACK_FIELDS))
+    return (old, new) if old != new else None
+
+
+def expire_states(session: Session, user_ids: set[int]) -> None:
+    """Expire state rows loaded into `session` after `apply` changed them."""
+    for user_id in user_ids:
+        state = session.identity_map.get(identity_key(FingerprintState, user_id))
+        if state is not None:
+            session.expire(state)
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_event_changes(session: Session, _flush_context) -> None:
+    # new/dirty/deleted still describe the pre-flush state here.
+    contributions = []
+    for obj in session.new:
+        if isinstance(obj, ListeningEvent):
+            contributions.append(Contribution(obj.user_id, obj.track_id, obj.listened_at, 1))
+    for obj in session.deleted:
+        if isinstance(obj, ListeningEvent):
+            contributions.append(Contribution(obj.user_id, obj.track_id, obj.listened_at, -1))
+    track_changes = {}
+    for obj in session.dirty:
+        if isinstance(obj, ListeningEvent):
+            previous = _previous(obj)
+            if previous is not None:
+                contributions.append(previous)
+                contributions.append(Contribution(obj.user_id, obj.track_id, obj.listened_at, 1))
+        elif isinstance(obj, Track):
+            change = _track_change(obj)
+            if change is not None:
+                track_changes[obj.id] = change
+    if contributions or track_changes:
+        expire_states(session, apply(session.connection(), contributions, track_changes))
+
+
+def _bootstrap(db: Session, state: FingerprintState) -> None:
+    """Fill a claimed state row from one aggregation pass over the user's events."""
+    events = (
+        db.query(ListeningEvent)
+        .outerjoin(Track, Track.id == ListeningEvent.track_id)
+        .filter(ListeningEvent.user_id == state.user_id)
+    )
+    totals = events.with_entities(
+        func.count(ListeningEvent.id),
+        func.count(ListeningEvent.track_id.distinct()),
+        *(agg(getattr(Track, f)) for f in FEATURES for agg in (func.sum, func.count)),
+    ).one()
+    state.total_events, state.distinct_tracks = totals[0], totals[1]
+    for i, f in enumerate(FEATURES):
+        setattr(state, f"{f}_sum", float(totals[2 + 2 * i] or 0.0))
+        setattr(state, f"{f}_count", totals[3 + 2 * i])
+
+    groupings = {
+        "genre_counts": (Track.genre, (Track.genre.isnot(None), Track.genre != "")),
+        "artist_counts": (Track.artist, (Track.artist.isnot(None), Track.artist != "")),
+        "hour_counts": (extract("hour", ListeningEvent.listened_at),
+                        (ListeningEvent.listened_at.isnot(None),)),
+        "mood_counts": (mood_case(), (Track.energy.isnot(None), Track.valence.isnot(None))),
+    }
+    for column, (key, conditions) in groupings.items():
+        rows = (events.filter(*conditions)
+                .with_entities(key, func.count(ListeningEvent.id), func.min(ListeningEvent.listened_at))
+                .group_by(key)
+                .all())
+        setattr(state, column, {
+            str(int(k)) if column == "hour_counts" else k: [n, _stamp(first)]
+            for k, n, first in rows
+        })
+
+
+def load_state(db: Session, user_id: int) -> FingerprintState:
+    """Return the user's state row, bootstrapping (and committing) it on first use."""
+    state = db.get(FingerprintState, user_id)
+    if state is not None and state.version:
+        return state
+    if state is None:
+        try:
+            with db.begin_nested():
+                db.add(FingerprintState(user_id=user_id, version=0))
+        except IntegrityError:
+            pass  # another request claimed it first
+        db.commit()
+    # A no-op write takes the row lock (the database write lock on SQLite)
+    # before reading the history. A writer that skipped the claimed row has
+    # committed by now, so its event is aggregated; later writers wait for
+    # this commit and then fold their events into the built row.
+    db.execute(update(FingerprintState).where(FingerprintState.user_id == user_id)
+               .values(version=FingerprintState.version))
+    state = db.get(FingerprintState, user_id, populate_existing=True)
+    if not state.version:
+        _bootstrap(db, state)
+        state.version = 1
+    db.commit()
+    return state
@@ -0,0 +1,311 @@
+"""
+Listening-history import from uploaded export files, run as a background
+import job.
+
+Supported files:
+
+  spotify – Spotify "extended streaming history" JSON (`ts`, `ms_played`,
+            `master_metadata_*`, `spotify_track_uri`) or the basic account
+            data `StreamingHistory*.json` (`endTime`, `artistName`,
+            `trackName`, `msPlayed`)
+  lastfm  – Last.fm scrobble CSV, either with a header (`uts` or
+            `utc_time`, `artist`, `album`, `track`) or headerless
+            `artist,album,track,date` rows
+
+The upload is spooled to a temporary file (removed once the job is done)
+and parsed incrementally: a JSON array one object at a time with
+`raw_decode`, a CSV row by row. Plays are processed EVENT_WRITE_CHUNK at a
+time. `TrackResolver` maps each play to a `tracks` row through a per-job
+cache, with one IN lookup for the tracks it has not seen yet and one INSERT
+for those the database lacks. The events go through `event_writer`. Memory
+is bounded by the chunk size plus one cache entry per distinct track, however
+large the file is.
+
+The job can be cancelled between chunks; events already written are kept.
+"""
+
+from __future__ import annotations
+
+import codecs
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from itertools import islice
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import ImportJob, Track
+from app.services import event_writer
+from app.services.job_runner import JobTracker
+from app.services.spotify_import import ImportFailed, insert_new_tracks
+
+READ_SIZE = 1 << 16
+LOOKUP_CHUNK = 500
+MAX_REPORTED_ERRORS = 20
+
+SOURCES = {"spotify": "spotify-history", "lastfm": "lastfm"}
+
+_SEPARATORS = re.compile(r"[\s,]*")
+# How far before the end of the buffer a cut-off element can fail to decode
+# (the longest partial token, "-Infinit", fails 8 characters back).
+_TRUNCATION_WINDOW = 12
+_LASTFM_TIME_FORMATS = ["%d %b %Y, %H:%M", "%d %b %Y %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"]
+
+
+@dataclass(frozen=True)
+class Play:
+    title: str
+    artist: str
+    album: Optional[str]
+    spotify_id: Optional[str]
+    listened_at: datetime
+    ms_played: Optional[int]
+
+    @property
+    def key(self) -> tuple:
+        return ("spotify", self.spotify_id) if self.spotify_id else ("name", self.title, self.artist)
+
+
+def spool(src: BinaryIO) -> str:
+    """Copy an upload to a temporary file that outlives the request; returns its path."""
+    with tempfile.NamedTemporaryFile(prefix="history-", delete=False) as dst:
+        shutil.copyfileobj(src, dst, READ_SIZE)
+        return dst.name
+
+
+def discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def detect_format(filename: Optional[str], stream: BinaryIO) -> str:
+    name = (filename or "").lower()
+    if name.endswith(".json"):
+        return "spotify"
+    if name.endswith(".csv"):
+        return "lastfm"
+    head = stream.read(64)
+    stream.seek(0)
+    return "spotify" if head.lstrip(codecs.BOM_UTF8 + b" \t\r\n").startswith(b"[") else "lastfm"
+
+
+def iter_json_array(stream: BinaryIO) -> Iterator:
+    """The elements of a top-level JSON array, decoded one at a time."""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer, pos, started, exhausted = "", 0, False, False
+    while True:
+        pos = _SEPARATORS.match(buffer, pos).end()
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array of plays")
+                started, pos = True, pos + 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as exc:
+                # Read on only if the element may just be cut off by the end of
+                # the buffer; a malformed one would pull in the rest of the file.
+                truncated = (exc.msg.startswith("Unterminated string")
+                             or exc.pos >= len(buffer) - _TRUNCATION_WINDOW)
+                if exhausted or not truncated:
+                    raise
+            else:
+                yield item
+                continue
+        elif exhausted:
+            raise ValueError("Unterminated JSON array" if started else "Empty file")
+        chunk = stream.read(READ_SIZE)
+        exhausted = not chunk
+        buffer = buffer[pos:] + text.decode(chunk, final=exhausted)
+        pos = 0
+
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _spotify_play(record: dict) -> Optional[Play]:
+    if "ts" in record:  # extended streaming history
+        title = record.get("master_metadata_track_name")
+        if not title:
+            return None  # podcast episode or audiobook chapter
+        uri = record.get("spotify_track_uri") or ""
+        return Play(
+            title=title,
+            artist=record.get("master_metadata_album_artist_name") or "Unknown",
+            album=record.get("master_metadata_album_album_name"),
+            spotify_id=uri.rsplit(":", 1)[-1] if uri.startswith("spotify:track:") else None,
+            listened_at=_utc(datetime.fromisoformat(record["ts"].replace("Z", "+00:00"))),
+            ms_played=record.get("ms_played"),
+        )
+    if "endTime" in record:  # account data StreamingHistory*.json
+        if not record.get("trackName"):
+            return None
+        return Play(
+            title=record["trackName"],
+            artist=record.get("artistName") or "Unknown",
+            album=None,
+            spotify_id=None,
+            listened_at=_utc(datetime.strptime(record["endTime"], "%Y-%m-%d %H:%M")),
+            ms_played=record.get("msPlayed"),
+        )
+    raise ValueError("not a Spotify streaming history entry")
+
+
+def _lastfm_time(value: str) -> datetime:
+    value = value.strip()
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value), tz=timezone.utc)
+    for fmt in _LASTFM_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return _utc(datetime.fromisoformat(value))
+
+
+def _lastfm_play(row: dict) -> Optional[Play]:
+    title, artist = (row.get("track") or "").strip(), (row.get("artist") or "").strip()
+    if not title or not artist:
+        raise ValueError("missing artist or track")
+    stamp = row.get("uts") or row.get("utc_time") or row.get("date") or ""
+    return Play(
+        title=title,
+        artist=artist,
+        album=(row.get("album") or "").strip() or None,
+        spotify_id=None,
+        listened_at=_lastfm_time(stamp),
+        ms_played=None,
+    )
+
+
+def lastfm_rows(stream: BinaryIO) -> Iterator[dict]:
+    """CSV rows as dicts, keyed by the header when there is one."""
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    first = next(reader, None)
+    if first is None:
+        return
+    header = [cell.strip().lower() for cell in first]
+    if {"artist", "track"} <= set(header):
+        fields = header
+    else:
+        fields = ["artist", "album", "track", "date"]
+        yield dict(zip(fields, first))
+    for cells in reader:
+        yield dict(zip(fields, cells))
+
+
+# format -> (record reader, record -> Play or None to skip)
+PARSERS: dict[str, tuple[Callable[[BinaryIO], Iterator], Callable[..., Optional[Play]]]] = {
+    "spotify": (iter_json_array, _spotify_play),
+    "lastfm": (lastfm_rows, _lastfm_play),
+}
+
+
+class TrackResolver:
+    """Maps plays to `tracks.id`, creating the tracks the database lacks in bulk."""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.ids: dict[tuple, int] = {}
+        self.created = 0
+
+    def resolve(self, plays: list[Play]) -> None:
+        missing = {p.key: p for p in plays if p.key not in self.ids}
+        if not missing:
+            return
+        self._lookup(list(missing))
+        new = [p for key, p in missing.items() if key not in self.ids]
+        if new:
+            result = self.db.connection().execute(insert_new_tracks(self.db), [
+                {"spotify_id": p.spotify_id, "title": p.title, "artist": p.artist, "album": p.album}
+                for p in new
+            ])
+            self.created += result.rowcount if result.rowcount >= 0 else len(new)
+            self._lookup([p.key for p in new])
+
+    def _lookup(self, keys: list[tuple]) -> None:
+        connection = self.db.connection()
+        sids = [key[1] for key in keys if key[0] == "spotify"]
+        names = [key[1:] for key in keys if key[0] == "name"]
+        for i in range(0, len(sids), LOOKUP_CHUNK):
+            for sid, track_id in connection.execute(
+                select(Track.spotify_id, Track.id).where(Track.spotify_id.in_(sids[i:i + LOOKUP_CHUNK]))
+            ):
+                self.ids[("spotify", sid)] = track_id
+        for i in range(0, len(names), LOOKUP_CHUNK):
+            for title, artist, track_id in connection.execute(
+                select(Track.title, Track.artist, Track.id)
+                .where(tuple_(Track.title, Track.artist).in_(names[i:i + LOOKUP_CHUNK]))
+                .order_by(Track.id)
+            ):
+                self.ids.setdefault(("name", title, artist), track_id)
+
+
+def run(db: Session, job: ImportJob, tracker: JobTracker, path: str, fmt: str) -> None:
+    """Import the history file at `path` for `job.user_id`."""
+    chunk_size = settings.EVENT_WRITE_CHUNK
+    resolver = TrackResolver(db)
+    errors: list[str] = []
+    skipped = 0
+
+    read, to_play = PARSERS[fmt]
+
+    def plays(stream: BinaryIO) -> Iterator[Play]:
+        nonlocal skipped
+        for number, record in enumerate(read(stream), start=1):
+            try:
+                play = to_play(record)
+            except (KeyError, TypeError, ValueError) as exc:
+                skipped += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(f"Record {number}: {exc}")
+                continue
+            if play is not None:
+                yield play
+
+    def rows(stream: BinaryIO) -> Iterator[dict]:
+        records = plays(stream)
+        while chunk := list(islice(records, chunk_size)):
+            tracker.checkpoint()
+            resolver.resolve(chunk)
+            for p in chunk:
+                yield {
+                    "user_id": job.user_id,
+                    "track_id": resolver.ids[p.key],
+                    "listened_at": p.listened_at,
+                    "duration_listened_ms": p.ms_played,
+                    "source": SOURCES[fmt],
+                }
+
+    def written(n: int) -> None:
+        job.events_created += n
+        job.tracks_found = len(resolver.ids)
+        job.tracks_imported = resolver.created
+        tracker.count(n)
+
+    tracker.stage("events")
+    with open(path, "rb") as stream:
+        event_writer.write_events(db, rows(stream), chunk_size=chunk_size, on_chunk=written)
+
+    if skipped:
+        errors.append(f"Skipped {skipped} unreadable record(s)")
+    job.errors = [*(job.errors or []), *errors]
+    if not job.events_created:
+        raise ImportFailed("No plays found in the uploaded file")
+    db.commit()
@@ -0,0 +1,121 @@
+"""
+Conditional GET support for catalog and analytics reads.
+
+Route dependencies that compute a cheap validator for the response before
+the endpoint runs, attach it as an `ETag` (and `Last-Modified` where there
+is a meaningful timestamp), and answer a matching `If-None-Match` /
+`If-Modified-Since` with 304 Not Modified instead of running the endpoint.
+
+  catalog reads    – the `catalog_state` token, bumped by every catalog write
+  user analytics   – the user's event watermark (max `ListeningEvent.id`,
+                     event count and fingerprint state version), their feedback
+                     watermark, the catalog token and the current UTC day,
+                     since the drift windows move with the clock
+
+Both dependencies depend on `get_current_user`, so a 304 is never served to
+an unauthenticated request.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.auth import get_current_user
+from app.database import get_db
+from app.models import CatalogState, FingerprintState, ListeningEvent, TrackFeedback, User
+from app.services.catalog_state import STATE_ID
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison (RFC 9110 §13.1.2): ignore the W/ prefix on both sides.
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def _not_modified_since(header: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+
+def check(request: Request, response: Response, etag: str,
+          last_modified: Optional[datetime] = None) -> None:
+    """Set the validators on `response`; raise 304 if the client's copy is current."""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if last_modified is not None:
+        last_modified = last_modified.replace(tzinfo=last_modified.tzinfo or timezone.utc)
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        fresh = _etag_matches(if_none_match, etag)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        fresh = (if_modified_since is not None and last_modified is not None
+                 and _not_modified_since(if_modified_since, last_modified))
+    if fresh:
+        raise HTTPException(status_code=304, headers=headers)
+
+
+def _target(request: Request) -> str:
+    return f"{request.url.path}?{request.url.query}"
+
+
+def catalog_validator(db: Session) -> tuple[Optional[str], Optional[datetime]]:
+    row = db.execute(
+        select(CatalogState.token, CatalogState.updated_at).where(CatalogState.id == STATE_ID)
+    ).first()
+    return (row.token, row.updated_at) if row else (None, None)
+
+
+def catalog_read(request: Request, response: Response,
+                 user: User = Depends(get_current_user), db: Session = Depends(get_db)) -> None:
+    """Dependency for reads that only depend on the discovery catalog."""
+    token, updated_at = catalog_validator(db)
+    check(request, response, make_etag("catalog", token, _target(request)), updated_at)
+
+
+def user_watermark(db: Session, user_id: int) -> tuple:
+    events = db.execute(
+        select(func.max(ListeningEvent.id), func.count(ListeningEvent.id))
+        .where(ListeningEvent.user_id == user_id)
+    ).one()
+    state_version = db.execute(
+        select(FingerprintState.version).where(FingerprintState.user_id == user_id)
+    ).scalar()
+    feedback = db.execute(
+        select(func.max(TrackFeedback.id), func.count(TrackFeedback.id),
+               func.max(TrackFeedback.updated_at))
+        .where(TrackFeedback.user_id == user_id)
+    ).one()
+    return (*events, state_version, *feedback)
+
+
+def user_analytics(request: Request, response: Response,
+                   user: User = Depends(get_current_user), db: Session = Depends(get_db)) -> None:
+    """Dependency for per-user analytics over listening history and feedback."""
+    token, _ = catalog_validator(db)
+    today = datetime.now(timezone.utc).date()
+    check(request, response, make_etag("user", user.id, *user_watermark(db, user.id),
+                                       token, today, _target(request)))
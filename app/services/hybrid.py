@@ -5,17 +5,16 @@ from __future__ import annotations
 import json
 import logging
 import math
-import statistics
-from collections import Counter
 from datetime import datetime, timedelta, timezone
 from typing import Any, Optional
 
-import requests as http_requests
 from fastapi import HTTPException
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from app.config import settings
-from app.models import CatalogTrack, Insight, ListeningEvent, Track, TrackFeedback, UserFingerprint
+from app.models import (
+    CatalogTrack, FingerprintState, Insight, ListeningEvent, Track, TrackFeedback, UserFingerprint,
+)
 from app.schemas import (
     ChangeMetric,
     FingerprintResult,
@@ -28,63 +27,26 @@ from app.schemas import (
     RecommendationExplainResult,
     RecommendationItem,
 )
+from app.services import enrichment
+from app.services import fingerprint as fingerprint_state
+from app.services import llm as llm_client
 
 logger = logging.getLogger(__name__)
 
 
-async def _llm_chat(prompt: str, *, max_tokens: int = 400, temperature: float = 0.2) -> Optional[str]:
-    if not settings.OPENAI_API_KEY:
-        return None
-    try:
-        resp = http_requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "llama-3.3-70b-versatile",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-            },
-            timeout=20,
-        )
-        if resp.status_code == 200:
-            return resp.json()["choices"][0]["message"]["content"].strip()
-        logger.warning("LLM call returned %s: %s", resp.status_code, resp.text)
-    except Exception as exc:
-        logger.warning("LLM call failed: %s", exc)
-    return None
-
-
-def _safe_mean(values: list[float], default: float = 0.0) -> float:
-    return round(statistics.mean(values), 4) if values else default
-
-
-def _norm_entropy(labels: list[str]) -> float:
-    if not labels:
+def _norm_entropy(counts: list[int]) -> float:
+    counts = [c for c in counts if c > 0]
+    if not counts:
         return 0.0
-    counts = Counter(labels)
-    total = sum(counts.values())
+    total = sum(counts)
     entropy = 0.0
-    for count in counts.values():
+    for count in counts:
         p = count / total
         entropy -= p * math.log2(p)
     max_entropy = math.log2(len(counts)) if len(counts) > 1 else 1.0
     return round(entropy / max_entropy, 4) if max_entropy else 0.0
 
 
-def _mood_label(energy: float, valence: float) -> str:
-    if energy >= 0.55 and valence >= 0.55:
-        return "happy"
-    if energy >= 0.55 and valence < 0.55:
-        return "intense"
-    if energy < 0.55 and valence >= 0.55:
-        return "calm"
-    return "melancholic"
-
-
 def _fingerprint_label(avg_energy: float, novelty_ratio: float, diversity_score: float, peak_hour: Optional[int]) -> str:
     if avg_energy >= 0.65 and novelty_ratio >= 0.55:
         return "Energetic Explorer"
@@ -97,89 +59,85 @@ def _fingerprint_label(avg_energy: float, novelty_ratio: float, diversity_score:
     return "Balanced Listener"
 
 
-def _load_events_and_tracks(db: Session, user_id: int, dt_from: Optional[datetime] = None, dt_to: Optional[datetime] = None):
-    q = db.query(ListeningEvent).filter(ListeningEvent.user_id == user_id)
-    if dt_from is not None:
-        q = q.filter(ListeningEvent.listened_at >= dt_from)
-    if dt_to is not None:
-        q = q.filter(ListeningEvent.listened_at <= dt_to)
-    events = q.order_by(ListeningEvent.listened_at).all()
-    track_ids = {e.track_id for e in events}
-    tracks = {t.id: t for t in db.query(Track).filter(Track.id.in_(track_ids)).all()} if track_ids else {}
-    return events, tracks
-
-
 def build_fingerprint(db: Session, user_id: int, *, persist: bool = True) -> UserFingerprint:
-    events, tracks = _load_events_and_tracks(db, user_id)
-    if not events:
+    """Derive the fingerprint from the user's aggregates; write only changed values."""
+    state = fingerprint_state.load_state(db, user_id)
+    changed = False
+    if not state.total_events:
         raise HTTPException(status_code=400, detail="Import Spotify listening data before generating a fingerprint")
 
-    energies: list[float] = []
-    valences: list[float] = []
-    danceabilities: list[float] = []
-    tempos: list[float] = []
-    genres: list[str] = []
-    artists: list[str] = []
-    hours: list[int] = []
-    moods: list[str] = []
-
-    for event in events:
-        track = tracks.get(event.track_id)
-        if not track:
-            continue
-        if track.energy is not None:
-            energies.append(track.energy)
-        if track.valence is not None:
-            valences.append(track.valence)
-        if track.danceability is not None:
-            danceabilities.append(track.danceability)
-        if track.tempo is not None:
-            tempos.append(track.tempo)
-        if track.genre:
-            genres.append(track.genre)
-        if track.artist:
-            artists.append(track.artist)
-        if event.listened_at:
-            hours.append(event.listened_at.hour)
-        if track.energy is not None and track.valence is not None:
-            moods.append(_mood_label(track.energy, track.valence))
-
-    avg_energy = _safe_mean(energies, 0.5)
-    avg_valence = _safe_mean(valences, 0.5)
-    avg_danceability = _safe_mean(danceabilities, 0.5)
-    avg_tempo = _safe_mean(tempos, 110.0)
-    novelty_ratio = round(len(set(e.track_id for e in events)) / len(events), 4) if events else 0.0
-    diversity_score = _norm_entropy(genres or artists)
-    dominant_mood = Counter(moods).most_common(1)[0][0] if moods else None
-    peak_hour = Counter(hours).most_common(1)[0][0] if hours else None
-    top_genres = [name for name, _ in Counter(genres).most_common(5)]
-    top_artists = [name for name, _ in Counter(artists).most_common(5)]
+    def mean(feature: str, default: float) -> float:
+        count = getattr(state, f"{feature}_count")
+        return round(getattr(state, f"{feature}_sum") / count, 4) if count else default
+
+    avg_energy = mean("energy", 0.5)
+    avg_valence = mean("valence", 0.5)
+    avg_danceability = mean("danceability", 0.5)
+    avg_tempo = mean("tempo", 110.0)
+    novelty_ratio = round(state.distinct_tracks / state.total_events, 4)
+    diversity_histogram = state.genre_counts or state.artist_counts
+    diversity_score = _norm_entropy([count for count, _ in diversity_histogram.values()])
+    dominant_mood = next(iter(fingerprint_state.top_keys(state.mood_counts, 1)), None)
+    peak_hour = next((int(h) for h in fingerprint_state.top_keys(state.hour_counts, 1)), None)
+    top_genres = fingerprint_state.top_keys(state.genre_counts, 5)
+    top_artists = fingerprint_state.top_keys(state.artist_counts, 5)
     label = _fingerprint_label(avg_energy, novelty_ratio, diversity_score, peak_hour)
 
+    values = {
+        "label": label,
+        "avg_energy": avg_energy,
+        "avg_valence": avg_valence,
+        "avg_danceability": avg_danceability,
+        "avg_tempo": avg_tempo,
+        "novelty_ratio": novelty_ratio,
+        "diversity_score": diversity_score,
+        "dominant_mood": dominant_mood,
+        "top_genres_json": top_genres,
+        "top_artists_json": top_artists,
+        "peak_hour": peak_hour,
+        "total_events": state.total_events,
+        "state_version": state.version,
+    }
     fp = db.query(UserFingerprint).filter(UserFingerprint.user_id == user_id).first()
     if not fp:
-        fp = UserFingerprint(user_id=user_id, label=label)
+        fp = UserFingerprint(user_id=user_id)
         db.add(fp)
+    for key, value in values.items():
+        if getattr(fp, key) != value:
+            setattr(fp, key, value)
+            changed = True
 
-    fp.label = label
-    fp.avg_energy = avg_energy
-    fp.avg_valence = avg_valence
-    fp.avg_danceability = avg_danceability
-    fp.avg_tempo = avg_tempo
-    fp.novelty_ratio = novelty_ratio
-    fp.diversity_score = diversity_score
-    fp.dominant_mood = dominant_mood
-    fp.top_genres_json = top_genres
-    fp.top_artists_json = top_artists
-    fp.peak_hour = peak_hour
-    fp.total_events = len(events)
-
-    if persist:
+    if persist and changed:
         db.commit()
         db.refresh(fp)
     return fp
 
 
+def current_fingerprint(db: Session, user_id: int) -> UserFingerprint:
+    """Read path: serve the stored fingerprint unless events changed since it was written.
+
+    The stored row is current when it was built from the state version the
+    user's aggregate state is at now. `apply` bumps the version under the row
+    lock on every change, edits that keep the event count included, so a
+    rebuild that read an older state never passes. Fresh reads never write.
+    """
+    fp = db.query(UserFingerprint).filter(UserFingerprint.user_id == user_id).first()
+    state = db.get(FingerprintState, user_id)
+    if (fp is not None and state is not None and state.version and state.total_events
+            and fp.state_version == state.version):
+        return fp
+    return build_fingerprint(db, user_id)
+
+
+async def _rewrite(user_id: int, template: str, prompt: str, *, max_tokens: int,
+                   temperature: float, defer: bool) -> tuple[str, Optional[str]]:
+    """LLM rewrite of `template`; deferred mode returns the template and an enrichment key."""
+    if defer:
+        return template, enrichment.submit(user_id, prompt, max_tokens=max_tokens, temperature=temperature)
+    llm = await llm_client.chat(prompt, max_tokens=max_tokens, temperature=temperature)
+    return llm or template, None
+
+
 def _fingerprint_evidence(fp: UserFingerprint) -> list[dict[str, Any]]:
     evidence = []
     evidence.append({"claim": f"Fingerprint label is {fp.label}", "support": f"Derived from energy={fp.avg_energy}, novelty={fp.novelty_ratio}, diversity={fp.diversity_score}"})
@@ -192,8 +150,8 @@ def _fingerprint_evidence(fp: UserFingerprint) -> list[dict[str, Any]]:
     return evidence
 
 
-async def fingerprint_result(db: Session, user_id: int) -> FingerprintResult:
-    fp = build_fingerprint(db, user_id)
+async def fingerprint_result(db: Session, user_id: int, *, defer: bool = False) -> FingerprintResult:
+    fp = current_fingerprint(db, user_id)
     traits = FingerprintTraits(
         avg_energy=fp.avg_energy,
         avg_valence=fp.avg_valence,
@@ -212,23 +170,23 @@ async def fingerprint_result(db: Session, user_id: int) -> FingerprintResult:
         f"Your fingerprint is {fp.label}: average energy {fp.avg_energy}, valence {fp.avg_valence}, "
         f"novelty ratio {fp.novelty_ratio}, and diversity score {fp.diversity_score}."
     )
-    llm = await _llm_chat(
+    explanation, enrichment_key = await _rewrite(
+            user_id, explanation,
             "Rewrite this listening-fingerprint explanation in 2 concise sentences, grounded in the data only:\n"
             + json.dumps({"label": fp.label, "traits": traits.model_dump(), "evidence": evidence}),
-            max_tokens=300, temperature=0.2,
+            max_tokens=300, temperature=0.2, defer=defer,
     )
-    if llm:
-        explanation = llm
     return FingerprintResult(
         fingerprint_label=fp.label,
         traits=traits,
         explanation=explanation,
         evidence=evidence,
+        enrichment_key=enrichment_key,
     )
 
 
 async def overview(db: Session, user_id: int) -> OverviewResult:
-    fp = build_fingerprint(db, user_id)
+    fp = current_fingerprint(db, user_id)
     unique_spotify_tracks = db.query(Track.id).join(ListeningEvent, ListeningEvent.track_id == Track.id).filter(ListeningEvent.user_id == user_id).distinct().count()
     unique_catalog_feedback_tracks = db.query(TrackFeedback.catalog_track_id).filter(TrackFeedback.user_id == user_id).distinct().count()
     return OverviewResult(
@@ -244,7 +202,7 @@ async def overview(db: Session, user_id: int) -> OverviewResult:
 
 
 async def highlights(db: Session, user_id: int) -> HighlightResult:
-    fp = build_fingerprint(db, user_id)
+    fp = current_fingerprint(db, user_id)
     return HighlightResult(
         top_artist=(fp.top_artists_json or [None])[0],
         top_genre=(fp.top_genres_json or [None])[0],
@@ -255,51 +213,79 @@ async def highlights(db: Session, user_id: int) -> HighlightResult:
     )
 
 
-async def recent_changes(db: Session, user_id: int, days: int = 30) -> RecentChangesResult:
+def _window_metrics(db: Session, user_id: int, start: datetime, end: datetime) -> dict[str, Any]:
+    """Every metric `recent_changes` reports for one time window, from one scan.
+
+    The window's events are grouped by track in SQL; totals, weighted
+    averages and the top artist/genre/mood are folded from those rows. Ties
+    rank by earliest listen, as Counter did.
+    """
+    rows = (
+        db.query(Track.id, Track.artist, Track.genre, Track.energy, Track.valence,
+                 func.count(ListeningEvent.id),
+                 func.min(ListeningEvent.listened_at),
+                 func.min(ListeningEvent.id))
+        .join(ListeningEvent, ListeningEvent.track_id == Track.id)
+        .filter(ListeningEvent.user_id == user_id,
+                ListeningEvent.listened_at >= start,
+                ListeningEvent.listened_at <= end)
+        .group_by(Track.id)
+        .all()
+    )
+    if not rows:
+        return {
+            "total_events": 0,
+            "avg_energy": None,
+            "avg_valence": None,
+            "novelty_ratio": 0.0,
+            "dominant_mood": None,
+            "top_artist": None,
+            "top_genre": None,
+        }
+
+    total = 0
+    sums = {"energy": [0.0, 0], "valence": [0.0, 0]}
+    groups: dict[str, dict[str, list]] = {"mood": {}, "artist": {}, "genre": {}}
+    for _, artist, genre, energy, valence, plays, first_at, first_id in rows:
+        total += plays
+        for feature, value in (("energy", energy), ("valence", valence)):
+            if value is not None:
+                sums[feature][0] += value * plays
+                sums[feature][1] += plays
+        mood = fingerprint_state.mood_label(energy, valence) if energy is not None and valence is not None else None
+        for name, key in (("mood", mood), ("artist", artist), ("genre", genre)):
+            if key:
+                group = groups[name].setdefault(key, [0, first_at, first_id])
+                group[0] += plays
+                group[1], group[2] = min(group[1], first_at), min(group[2], first_id)
+
+    def average(feature: str) -> Optional[float]:
+        value, count = sums[feature]
+        return round(value / count, 4) if count else None
+
+    def most_common(name: str) -> Optional[str]:
+        ranked = groups[name].items()
+        return min(ranked, key=lambda kv: (-kv[1][0], kv[1][1], kv[1][2]))[0] if ranked else None
+
+    return {
+        "total_events": total,
+        "avg_energy": average("energy"),
+        "avg_valence": average("valence"),
+        "novelty_ratio": round(len(rows) / total, 4),
+        "dominant_mood": most_common("mood"),
+        "top_artist": most_common("artist"),
+        "top_genre": most_common("genre"),
+    }
+
+
+async def recent_changes(db: Session, user_id: int, days: int = 30, *, defer: bool = False) -> RecentChangesResult:
     now = datetime.now(timezone.utc)
     recent_start = now - timedelta(days=days)
     previous_start = recent_start - timedelta(days=days)
     previous_end = recent_start
 
-    def window_metrics(start: datetime, end: datetime) -> dict[str, Any]:
-        events, tracks = _load_events_and_tracks(db, user_id, start, end)
-        if not events:
-            return {
-                "total_events": 0,
-                "avg_energy": None,
-                "avg_valence": None,
-                "novelty_ratio": 0.0,
-                "dominant_mood": None,
-                "top_artist": None,
-                "top_genre": None,
-            }
-        energies, valences, genres, artists, moods = [], [], [], [], []
-        for event in events:
-            track = tracks.get(event.track_id)
-            if not track:
-                continue
-            if track.energy is not None:
-                energies.append(track.energy)
-            if track.valence is not None:
-                valences.append(track.valence)
-            if track.genre:
-                genres.append(track.genre)
-            if track.artist:
-                artists.append(track.artist)
-            if track.energy is not None and track.valence is not None:
-                moods.append(_mood_label(track.energy, track.valence))
-        return {
-            "total_events": len(events),
-            "avg_energy": _safe_mean(energies, 0.0) if energies else None,
-            "avg_valence": _safe_mean(valences, 0.0) if valences else None,
-            "novelty_ratio": round(len(set(e.track_id for e in events)) / len(events), 4),
-            "dominant_mood": Counter(moods).most_common(1)[0][0] if moods else None,
-            "top_artist": Counter(artists).most_common(1)[0][0] if artists else None,
-            "top_genre": Counter(genres).most_common(1)[0][0] if genres else None,
-        }
-
-    prev = window_metrics(previous_start, previous_end)
-    recent = window_metrics(recent_start, now)
+    prev = _window_metrics(db, user_id, previous_start, previous_end)
+    recent = _window_metrics(db, user_id, recent_start, now)
     metrics = [
         ChangeMetric(metric="total_events", previous=prev["total_events"], recent=recent["total_events"], delta=recent["total_events"] - prev["total_events"]),
         ChangeMetric(metric="avg_energy", previous=prev["avg_energy"], recent=recent["avg_energy"], delta=(round((recent["avg_energy"] or 0) - (prev["avg_energy"] or 0), 4) if prev["avg_energy"] is not None or recent["avg_energy"] is not None else None)),
@@ -327,13 +313,12 @@ async def recent_changes(db: Session, user_id: int, days: int = 30) -> RecentCha
         f"Compared with the previous {days}-day window, your recent listening is {shift.lower()}. "
         f"Top genre shifted from {prev['top_genre'] or 'n/a'} to {recent['top_genre'] or 'n/a'} and top artist moved from {prev['top_artist'] or 'n/a'} to {recent['top_artist'] or 'n/a'}."
     )
-    llm = await _llm_chat(
+    summary, enrichment_key = await _rewrite(
+            user_id, summary,
             "Write a concise 2-sentence recent taste change summary grounded only in these metrics:\n"
             + json.dumps({"previous": prev, "recent": recent, "metrics": [m.model_dump() for m in metrics]}),
-            max_tokens=300, temperature=0.2,
+            max_tokens=300, temperature=0.2, defer=defer,
     )
-    if llm:
-        summary = llm
     return RecentChangesResult(
         previous_window=f"{previous_start.date().isoformat()} to {previous_end.date().isoformat()}",
         recent_window=f"{recent_start.date().isoformat()} to {now.date().isoformat()}",
@@ -341,6 +326,7 @@ async def recent_changes(db: Session, user_id: int, days: int = 30) -> RecentCha
         summary=summary,
         metrics=metrics,
         evidence=evidence,
+        enrichment_key=enrichment_key,
     )
 
 
@@ -381,8 +367,8 @@ def _build_reason(track: CatalogTrack, fp: UserFingerprint, context: Optional[st
     return base
 
 
-async def explain_recommendations(db: Session, user_id: int, context: Optional[str], strategy: str, max_tracks: int) -> RecommendationExplainResult:
-    fp = build_fingerprint(db, user_id)
+async def explain_recommendations(db: Session, user_id: int, context: Optional[str], strategy: str, max_tracks: int, *, defer: bool = False) -> RecommendationExplainResult:
+    fp = current_fingerprint(db, user_id)
     candidates = _candidate_tracks(db)
     if not candidates:
         raise HTTPException(status_code=400, detail="Import the catalog dataset before requesting hybrid recommendations")
@@ -423,7 +409,8 @@ async def explain_recommendations(db: Session, user_id: int, context: Optional[s
         )
 
     summary = f"Generated {len(items)} hybrid recommendations by matching your Spotify-derived fingerprint against the external catalog."
-    llm = await _llm_chat(
+    summary, enrichment_key = await _rewrite(
+            user_id, summary,
             "You are a music intelligence assistant. Write 3 sentences explaining these recommendations to the user. Reference their specific fingerprint label, mention 2 of the recommended artists by name, and explain why the audio features match their taste. Be conversational and specific. Use only this data:\n"
             + json.dumps({
                 "fingerprint_label": fp.label,
@@ -431,20 +418,19 @@ async def explain_recommendations(db: Session, user_id: int, context: Optional[s
                 "strategy": strategy,
                 "recommendations": [i.model_dump() for i in items],
             }),
-            max_tokens=400, temperature=0.4,
+            max_tokens=400, temperature=0.4, defer=defer,
     )
-    if llm:
-        summary = llm
     return RecommendationExplainResult(
         fingerprint_label=fp.label,
         strategy=strategy,
         context=context,
         recommendations=items,
         summary=summary,
+        enrichment_key=enrichment_key,
     )
 
 
-async def what_if_recommendations(db: Session, user_id: int, scenario: str, max_tracks: int) -> RecommendationExplainResult:
+async def what_if_recommendations(db: Session, user_id: int, scenario: str, max_tracks: int, *, defer: bool = False) -> RecommendationExplainResult:
     scenario_lower = scenario.lower()
     strategy = "balanced"
     context = scenario
@@ -452,11 +438,11 @@ async def what_if_recommendations(db: Session, user_id: int, scenario: str, max_
         strategy = "discovery"
     elif "comfort" in scenario_lower or "familiar" in scenario_lower or "closer to what i like" in scenario_lower:
         strategy = "comfort"
-    return await explain_recommendations(db, user_id, context=context, strategy=strategy, max_tracks=max_tracks)
+    return await explain_recommendations(db, user_id, context=context, strategy=strategy, max_tracks=max_tracks, defer=defer)
 
 
 async def generate_hybrid_insight(db: Session, user_id: int) -> Insight:
-    fp = build_fingerprint(db, user_id)
+    fp = current_fingerprint(db, user_id)
     changes = await recent_changes(db, user_id)
     snapshot = {
         "fingerprint_label": fp.label,
@@ -476,7 +462,7 @@ async def generate_hybrid_insight(db: Session, user_id: int) -> Insight:
         f"Your listening fingerprint is {fp.label}, characterised by average energy {fp.avg_energy}, valence {fp.avg_valence}, "
         f"and a novelty ratio of {fp.novelty_ratio}. Recently, your behaviour has shifted as follows: {changes.summary}"
     )
-    llm =await _llm_chat(
+    llm = await llm_client.chat(
         "Write a 4-sentence grounded hybrid music insight using only this data:\n"
         + json.dumps({"snapshot": snapshot, "evidence": evidence})
     )
@@ -530,7 +516,7 @@ async def critique_insight(db: Session, user_id: int, insight_id: int) -> Insigh
         f"Your profile is {snapshot.get('fingerprint_label', 'Balanced Listener')}, with average energy {snapshot.get('avg_energy')} and novelty ratio {snapshot.get('novelty_ratio')}. "
         f"Recent change analysis indicates: {snapshot.get('recent_shift', 'stable listening behaviour')}."
     )
-    llm = await _llm_chat(
+    llm = await llm_client.chat(
             "Rewrite this music insight to be more specific and data-driven. Replace any vague words with concrete numbers from the snapshot. Reference the fingerprint label, energy value, and novelty ratio explicitly. Keep it to 3 sentences. Use only this data:\n"
             + json.dumps({"text": text, "snapshot": snapshot}),
             max_tokens=300, temperature=0.1,
@@ -0,0 +1,237 @@
+"""
+Background execution for `import_jobs`.
+
+Jobs run on a small thread pool (IMPORT_WORKERS threads) so a slow upstream
+never occupies an API worker. Each job gets its own session, built from the
+engine of the session that enqueued it, and reports through a `JobTracker`:
+
+  pending → running → completed | failed | cancelled
+
+The tracker commits the current stage and per-stage done/total counters as
+the job advances and raises `JobCancelled` at the next checkpoint once
+cancellation has been requested.
+
+Jobs are leased. `submit` records this process (`OWNER`) on the job's
+progress row, and a heartbeat thread refreshes `updated_at` on every job the
+process still holds, pending or running, each JOB_HEARTBEAT_SECONDS. A job
+whose row has been silent for JOB_LEASE_SECONDS lost its process and is
+marked failed, at startup or by any live process's heartbeat; its inputs
+(e.g. OAuth tokens) are never persisted, so it cannot be resumed. Jobs that
+other live workers are running are left alone.
+
+IMPORT_WORKERS=0 runs jobs inline in the submitting thread.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.config import settings
+from app.models import ImportJob, ImportJobProgress, JobStatus
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = (JobStatus.PENDING, JobStatus.RUNNING)
+
+# Unique per process start, so a recycled pid never inherits old leases.
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_executor: Optional[ThreadPoolExecutor] = None
+_futures: dict[str, Future] = {}
+_lock = threading.Lock()
+_engines: dict[int, Engine] = {}
+_heartbeat: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+class JobCancelled(Exception):
+    """Raised at a checkpoint once cancellation of the job was requested."""
+
+
+class JobTracker:
+    """Stage / progress reporting and cancellation checks for one running job."""
+
+    def __init__(self, db: Session, job: ImportJob):
+        self.db = db
+        self.job = job
+        if job.tracker is None:
+            job.tracker = ImportJobProgress(counters={})
+        self.row = job.tracker
+
+    def stage(self, name: str, total: Optional[int] = None) -> None:
+        self.checkpoint()
+        self.row.stage = name
+        self.row.counters = {**(self.row.counters or {}), name: {"done": 0, "total": total}}
+        self.db.commit()
+
+    def count(self, done: int = 1, total: Optional[int] = None) -> None:
+        """Update the current stage's counters without committing."""
+        counters = dict(self.row.counters or {})
+        current = dict(counters.get(self.row.stage, {"done": 0, "total": None}))
+        current["done"] += done
+        if total is not None:
+            current["total"] = total
+        counters[self.row.stage] = current
+        self.row.counters = counters
+
+    def advance(self, done: int = 1, total: Optional[int] = None) -> None:
+        self.count(done, total)
+        self.db.commit()
+        self.checkpoint()
+
+    def checkpoint(self) -> None:
+        flag = self.db.query(ImportJobProgress.cancel_requested).filter(
+            ImportJobProgress.job_id == self.job.id).scalar()
+        if flag:
+            raise JobCancelled(self.job.id)
+
+
+def _finish(db: Session, job: ImportJob, status: JobStatus, error: Optional[str] = None) -> None:
+    job.status = status
+    job.completed_at = datetime.now(timezone.utc)
+    if error:
+        job.errors = [*(job.errors or []), error]
+    db.commit()
+
+
+def _run(session_factory: sessionmaker, job_id: str,
+         fn: Callable[[Session, ImportJob, JobTracker], None]) -> None:
+    db = session_factory()
+    try:
+        job = db.get(ImportJob, job_id)
+        if job is None or job.status not in ACTIVE:
+            return
+        tracker = JobTracker(db, job)
+        try:
+            tracker.checkpoint()
+            job.status = JobStatus.RUNNING
+            db.commit()
+            fn(db, job, tracker)
+        except JobCancelled:
+            db.rollback()
+            _finish(db, job, JobStatus.CANCELLED, "Cancelled by user")
+            return
+        except Exception as exc:
+            logger.exception("Import job %s failed", job_id)
+            db.rollback()
+            _finish(db, job, JobStatus.FAILED, str(exc))
+            return
+        if job.status in ACTIVE:
+            _finish(db, job, JobStatus.COMPLETED)
+    finally:
+        db.close()
+        with _lock:
+            _futures.pop(job_id, None)
+
+
+def submit(db: Session, job: ImportJob,
+           fn: Callable[[Session, ImportJob, JobTracker], None]) -> Future:
+    """Run `fn(db, job, tracker)` for an already committed job in the background."""
+    global _executor
+    if job.tracker is None:
+        job.tracker = ImportJobProgress(counters={})
+    job.tracker.owner = OWNER
+    job.tracker.updated_at = datetime.now(timezone.utc)
+    db.commit()
+    session_factory = sessionmaker(bind=db.get_bind(), autoflush=False)
+    if settings.IMPORT_WORKERS <= 0:
+        future: Future = Future()
+        _run(session_factory, job.id, fn)
+        future.set_result(None)
+        return future
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMPORT_WORKERS,
+                                           thread_name_prefix="import-job")
+        future = _executor.submit(_run, session_factory, job.id, fn)
+        _futures[job.id] = future
+        _start_heartbeat(db.get_bind())
+    return future
+
+
+def request_cancel(db: Session, job: ImportJob) -> None:
+    """Flag a pending or running job; the worker stops at its next checkpoint."""
+    if job.tracker is None:
+        job.tracker = ImportJobProgress(counters={})
+    job.tracker.cancel_requested = True
+    db.commit()
+
+
+def recover_orphans(engine: Engine) -> int:
+    """Fail active jobs whose lease expired (their process is gone); returns how many."""
+    now = datetime.now(timezone.utc)
+    last_seen = func.coalesce(
+        select(ImportJobProgress.updated_at)
+        .where(ImportJobProgress.job_id == ImportJob.id)
+        .scalar_subquery(),
+        ImportJob.started_at,
+    )
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(ImportJob)
+            .where(ImportJob.status.in_(ACTIVE),
+                   last_seen < now - timedelta(seconds=settings.JOB_LEASE_SECONDS))
+            .values(status=JobStatus.FAILED,
+                    completed_at=now,
+                    errors=["Interrupted by server restart"])
+        )
+    if result.rowcount:
+        logger.warning("Marked %d interrupted import job(s) as failed", result.rowcount)
+    return result.rowcount
+
+
+def heartbeat(engine: Engine) -> None:
+    """Renew the lease of every job this process still holds."""
+    with _lock:
+        held = list(_futures)
+    if not held:
+        return
+    with engine.begin() as conn:
+        conn.execute(
+            update(ImportJobProgress)
+            .where(ImportJobProgress.owner == OWNER, ImportJobProgress.job_id.in_(held))
+            .values(updated_at=datetime.now(timezone.utc))
+        )
+
+
+def _beat() -> None:
+    while not _stop.wait(settings.JOB_HEARTBEAT_SECONDS):
+        for engine in list(_engines.values()):
+            try:
+                heartbeat(engine)
+                recover_orphans(engine)
+            except Exception:
+                logger.exception("Import job heartbeat failed")
+
+
+def _start_heartbeat(engine: Engine) -> None:
+    """Start the heartbeat thread (under `_lock`) and have it cover `engine`."""
+    global _heartbeat
+    _engines[id(engine)] = engine
+    if _heartbeat is None:
+        _stop.clear()
+        _heartbeat = threading.Thread(target=_beat, name="import-job-heartbeat", daemon=True)
+        _heartbeat.start()
+
+
+def shutdown(wait: bool = False) -> None:
+    global _executor, _heartbeat
+    with _lock:
+        executor, _executor = _executor, None
+        thread, _heartbeat = _heartbeat, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
+    if thread is not None:
+        _stop.set()
+        thread.join(timeout=1.0)
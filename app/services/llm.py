@@ -0,0 +1,245 @@
+"""
+Asynchronous LLM chat client.
+
+One pooled `httpx.AsyncClient` per process is shared by every caller, so
+keep-alive connections to the provider are reused. Each call is bounded by:
+
+  concurrency  – a semaphore caps in-flight requests (LLM_MAX_CONCURRENCY)
+  timeouts     – per-call httpx timeout (LLM_TIMEOUT seconds)
+  retries      – transport errors, 429 and 5xx are retried with jittered
+                 exponential backoff (LLM_MAX_RETRIES attempts in total)
+  breaker      – after LLM_BREAKER_THRESHOLD consecutive failed calls the
+                 circuit opens and calls fail fast for LLM_BREAKER_RESET
+                 seconds, then a single trial call is let through (callers
+                 arriving while it is in flight still fail fast)
+
+Successful completions are stored in a content-addressed cache (see
+`llm_cache`), so identical requests are answered without an upstream call.
+
+`chat` never raises; it returns None on any failure so callers can fall back
+to their deterministic templates. Tests inject an `httpx` transport (for
+example `httpx.MockTransport`) instead of patching the network.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+import httpx
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from app.config import settings
+from app.services.llm_cache import LLMCache, build_cache, cache_key
+
+logger = logging.getLogger(__name__)
+
+
+class RetryableStatus(Exception):
+    """Provider answered with a status worth retrying (429 / 5xx)."""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"LLM provider returned {response.status_code}")
+        self.response = response
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed → open → half-open)."""
+
+    def __init__(self, threshold: int, reset_after: float):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # When the half-open trial call started; a trial that never reports
+        # back (e.g. its task was cancelled) is replaced after reset_after.
+        self._trial_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open":
+                return False
+            now = time.monotonic()
+            if self._trial_started is not None and now - self._trial_started < self.reset_after:
+                return False
+            self._trial_started = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial_started = None
+
+
+async def _close_pool(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+    """Close a pool that was built on `loop` (not the running one)."""
+    try:
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            await client.aclose()
+    except RuntimeError as exc:
+        # Its loop is closed, and the connections were torn down with it.
+        logger.debug("Discarding LLM pool from a closed event loop: %s", exc)
+
+
+class LLMClient:
+    def __init__(self, *, api_key: str, base_url: str, model: str,
+                 timeout: float = 20.0, max_connections: int = 20,
+                 max_concurrency: int = 8, max_retries: int = 3,
+                 backoff: float = 0.5, breaker_threshold: int = 5,
+                 breaker_reset: float = 30.0,
+                 cache: Optional[LLMCache] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.cache = cache if cache is not None else LLMCache()
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _pool(self) -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        # Pools and semaphores belong to one event loop; rebuild them if the
+        # client is first used (or reused) from a different loop, and close
+        # the pool left behind.
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            stale, stale_loop = self._client, self._loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                transport=self.transport,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+            if stale is not None:
+                await _close_pool(stale, stale_loop)
+        return self._client, self._semaphore
+
+    async def _post(self, client: httpx.AsyncClient, payload: dict,
+                    timeout: Optional[float]) -> httpx.Response:
+        response = await client.post(
+            "/chat/completions", json=payload,
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+        )
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableStatus(response)
+        return response
+
+    async def chat(self, prompt: str, *, max_tokens: int = 400, temperature: float = 0.2,
+                   timeout: Optional[float] = None) -> Optional[str]:
+        """Single-turn completion; None when disabled, failing or short-circuited."""
+        if not self.api_key:
+            return None
+        key = cache_key(self.model, prompt, max_tokens, temperature)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if not self.breaker.allow():
+            logger.warning("LLM circuit open; skipping call")
+            return None
+
+        client, semaphore = await self._pool()
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+        try:
+            async with semaphore:
+                async for attempt in AsyncRetrying(
+                    stop=stop_after_attempt(self.max_retries),
+                    wait=wait_random_exponential(multiplier=self.backoff, max=self.backoff * 8),
+                    retry=retry_if_exception_type((httpx.TransportError, RetryableStatus)),
+                    reraise=True,
+                ):
+                    with attempt:
+                        response = await self._post(client, payload, timeout)
+            if response.status_code != 200:
+                logger.warning("LLM call returned %s: %s", response.status_code, response.text)
+                self.breaker.record_failure()
+                return None
+            content = response.json()["choices"][0]["message"]["content"].strip()
+        except Exception as exc:
+            logger.warning("LLM call failed: %s", exc)
+            self.breaker.record_failure()
+            return None
+        self.breaker.record_success()
+        self.cache.set(key, content)
+        return content
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_client: Optional[LLMClient] = None
+
+
+def get_client() -> LLMClient:
+    """The process-wide client, configured from settings on first use."""
+    global _client
+    if _client is None:
+        _client = LLMClient(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.LLM_BASE_URL,
+            model=settings.LLM_MODEL,
+            timeout=settings.LLM_TIMEOUT,
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            max_retries=settings.LLM_MAX_RETRIES,
+            breaker_threshold=settings.LLM_BREAKER_THRESHOLD,
+            breaker_reset=settings.LLM_BREAKER_RESET,
+            cache=build_cache(),
+        )
+    return _client
+
+
+async def chat(prompt: str, *, max_tokens: int = 400, temperature: float = 0.2) -> Optional[str]:
+    return await get_client().chat(prompt, max_tokens=max_tokens, temperature=temperature)
+
+
+async def shutdown() -> None:
+    if _client is not None:
+        await _client.aclose()
@@ -0,0 +1,181 @@
+"""
+Content-addressed cache for LLM responses.
+
+Entries are keyed by the SHA-256 of (model, prompt, max_tokens,
+temperature), so a byte-identical request is answered without going
+upstream. There are two backends:
+
+  memory – in-process LRU bounded by LLM_CACHE_MAX_ENTRIES
+  sqlite – a standalone SQLite file (LLM_CACHE_PATH) shared by workers
+           and kept across restarts
+
+Entries expire after LLM_CACHE_TTL seconds (0 disables expiry). Every
+backend counts hits, misses, stores and evictions for `/health/detailed`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+
+
+def cache_key(model: str, prompt: str, max_tokens: int, temperature: float) -> str:
+    payload = json.dumps([model, prompt, max_tokens, temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Backend interface; subclasses implement `_get` / `_set` / `_clear`."""
+
+    backend = "none"
+
+    def __init__(self, ttl: float = 0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _expires_at(self) -> Optional[float]:
+        return time.time() + self.ttl if self.ttl > 0 else None
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._set(key, value, self._expires_at())
+            self.stores += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": self.size(),
+        }
+
+    def size(self) -> int:
+        return 0
+
+    def _get(self, key: str) -> Optional[str]:
+        return None
+
+    def _set(self, key: str, value: str, expires_at: Optional[float]) -> None:
+        pass
+
+    def _clear(self) -> None:
+        pass
+
+
+class MemoryCache(LLMCache):
+    backend = "memory"
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 0):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, Optional[float]]] = OrderedDict()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: str, expires_at: Optional[float]) -> None:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _clear(self) -> None:
+        self._entries.clear()
+
+
+class SQLiteCache(LLMCache):
+    backend = "sqlite"
+
+    def __init__(self, path: str, ttl: float = 0):
+        super().__init__(ttl)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL, created_at REAL NOT NULL)"
+        )
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self.evictions += 1
+            return None
+        return value
+
+    def _set(self, key: str, value: str, expires_at: Optional[float]) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, created_at)"
+            " VALUES (?, ?, ?, ?)",
+            (key, value, expires_at, time.time()),
+        )
+
+    def _clear(self) -> None:
+        self._conn.execute("DELETE FROM llm_cache")
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def build_cache() -> LLMCache:
+    """Cache backend selected by LLM_CACHE_BACKEND (memory | sqlite | none)."""
+    backend = settings.LLM_CACHE_BACKEND.lower()
+    if backend == "memory":
+        return MemoryCache(settings.LLM_CACHE_MAX_ENTRIES, settings.LLM_CACHE_TTL)
+    if backend == "sqlite":
+        return SQLiteCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_TTL)
+    if backend == "none":
+        return LLMCache()
+    raise ValueError(f"Unknown LLM_CACHE_BACKEND {settings.LLM_CACHE_BACKEND!r}")
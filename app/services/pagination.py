@@ -0,0 +1,88 @@
+"""
+Keyset (cursor) pagination.
+
+A page is fetched as `WHERE (k1, k2, …) > (last row's keys) ORDER BY k1, k2, …
+LIMIT n + 1` instead of `OFFSET`, so every page costs the same index seek no
+matter how deep the client has walked. The sort keys of the last row on a
+page travel back to the client as an opaque `next_cursor`:
+
+  base64url(JSON {"s": scope digest, "k": [key values]})
+
+The scope digest ties a cursor to the listing it was issued for, including
+every filter applied to it (see `scope`), so replaying it against a different
+listing or filter set is rejected with 400 instead of silently skipping rows. The last key must be unique (the
+primary key) so that ties on the leading keys never drop or repeat a row.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+
+def scope(listing: str, **filters: Any) -> str:
+    """The `page` scope for `listing` narrowed by `filters` (None for unset)."""
+    return f"{listing}|" + json.dumps(filters, sort_keys=True, default=str)
+
+
+def _digest(scope: str) -> str:
+    return hashlib.sha1(scope.encode()).hexdigest()[:12]
+
+
+def _dump(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _load(value: Any) -> Any:
+    if isinstance(value, dict) and set(value) == {"dt"}:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode(scope: str, values: Sequence[Any]) -> str:
+    payload = json.dumps({"s": _digest(scope), "k": [_dump(v) for v in values]},
+                         separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode(cursor: str, scope: str, size: int) -> list:
+    """The key values in `cursor`; 400 if it is malformed or from another listing."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = [_load(v) for v in payload["k"]]
+        valid = payload["s"] == _digest(scope) and len(values) == size
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        valid = False
+    if not valid:
+        raise HTTPException(400, "Invalid or expired cursor")
+    return values
+
+
+def page(query: Query, keys: Sequence, *, limit: int, scope: str,
+         cursor: Optional[str] = None, offset: int = 0,
+         descending: bool = False) -> tuple[list, Optional[str]]:
+    """
+    One page of `query`, which must already be ordered by `keys` (all ascending,
+    or all descending with `descending=True`). Resumes after `cursor` when
+    given, otherwise skips `offset` rows. Returns the rows and the cursor for
+    the next page, None on the last page.
+    """
+    if cursor:
+        last = tuple_(*decode(cursor, scope, len(keys)))
+        query = query.filter(tuple_(*keys) < last if descending else tuple_(*keys) > last)
+    elif offset:
+        query = query.offset(offset)
+    rows = query.add_columns(*keys).limit(limit + 1).all()
+    next_cursor = encode(scope, list(rows[limit - 1][1:])) if len(rows) > limit else None
+    return [row[0] for row in rows[:limit]], next_cursor
@@ -0,0 +1,26 @@
+"""
+Audio similarity engine for the discovery catalog.
+
+vectors – the 8-d vector layout, tempo normalisation and scalar cosine
+mood    – free-text mood parsing into feature targets
+matrix  – cached NumPy feature matrix with batched scoring, top-k and
+          the memory-mapped on-disk snapshot
+ann     – pluggable approximate nearest-neighbour index over the matrix
+engine  – similar-track and mood queries used by the REST and MCP layers
+"""
+
+from app.services.similarity.engine import Match, SearchResult, find_similar, match_mood
+from app.services.similarity.matrix import CatalogMatrix, get_catalog_matrix
+from app.services.similarity.mood import (
+    MOOD_KEYWORDS, mood_label, mood_masks, parse_mood, target_vector,
+)
+from app.services.similarity.vectors import (
+    FEATURES, TEMPO_MAX, cosine_similarity, feature_breakdown, normalize_tempo, to_vector,
+)
+
+__all__ = [
+    "CatalogMatrix", "FEATURES", "MOOD_KEYWORDS", "Match", "SearchResult", "TEMPO_MAX",
+    "cosine_similarity", "feature_breakdown", "find_similar", "get_catalog_matrix",
+    "match_mood", "mood_label", "mood_masks", "normalize_tempo", "parse_mood",
+    "target_vector", "to_vector",
+]
@@ -0,0 +1,327 @@
+"""
+Approximate nearest-neighbour (ANN) index over the catalog feature matrix.
+
+The default index is an IVF (inverted file) index: spherical k-means splits
+the unit vectors of `CatalogMatrix` into `nlist` cells, and a query only
+re-scores the rows of the `nprobe` cells whose centroids are closest to it.
+Index types are pluggable through `INDEX_TYPES` / `settings.ANN_INDEX_TYPE`.
+
+Lifecycle:
+  build        – trained from the matrix the first time a large catalog is queried
+  persist      – saved to `settings.ANN_INDEX_PATH` for the application database,
+                 on a background thread so requests never wait on the disk
+  load         – read back once at startup (`load_at_startup`)
+  sync         – on every catalog version change the index is diffed against
+                 the matrix: rows added or whose vector changed are (re)assigned
+                 to their nearest cell and deleted ids are dropped; the index is
+                 retrained once that churn exceeds REBUILD_RATIO of the trained
+                 size
+
+Catalogs smaller than `settings.ANN_MIN_ROWS` always use the exact path.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.services.similarity.matrix import CatalogMatrix, rank_top_k
+
+logger = logging.getLogger(__name__)
+
+REBUILD_RATIO = 0.5
+ASSIGN_CHUNK = 16384
+
+
+class VectorIndex(ABC):
+    """Interface every ANN index type implements.
+
+    `ids` (ascending) and `vectors` record what the index holds: each
+    indexed track id and the unit vector it was placed by. `sync` diffs
+    them against the current matrix.
+    """
+
+    kind = "base"
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray):
+        self.ids = ids
+        self.vectors = vectors
+        self.token: Optional[str] = None
+        self.trained_size = 0
+        self.inserted = 0
+
+    @classmethod
+    @abstractmethod
+    def build(cls, matrix: CatalogMatrix) -> "VectorIndex":
+        ...
+
+    @abstractmethod
+    def search(self, matrix: CatalogMatrix, query: list[float], k: int,
+               mask: Optional[np.ndarray] = None,
+               nprobe: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        ...
+
+    @abstractmethod
+    def insert(self, matrix: CatalogMatrix, rows: np.ndarray) -> None:
+        """Add matrix `rows`, whose ids are not in the index."""
+
+    @abstractmethod
+    def remove(self, keep: np.ndarray) -> None:
+        """Drop the indexed ids where the boolean mask `keep` is False."""
+
+    @abstractmethod
+    def arrays(self) -> dict[str, np.ndarray]:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def from_arrays(cls, data) -> "VectorIndex":
+        ...
+
+    def indexed_ids(self) -> np.ndarray:
+        return self.ids
+
+    def sync(self, matrix: CatalogMatrix) -> None:
+        """Bring the index in line with `matrix`.
+
+        Ids gone from the catalog are dropped, rows whose vector changed are
+        removed and re-inserted, and rows the index has not seen are inserted.
+        """
+        if len(self.ids) and len(matrix):
+            pos = np.minimum(np.searchsorted(matrix.ids, self.ids), len(matrix) - 1)
+            keep = matrix.ids[pos] == self.ids
+            keep[keep] = np.all(matrix.unit[pos[keep]] == self.vectors[keep], axis=1)
+        else:
+            keep = np.zeros(len(self.ids), dtype=bool)
+        if not keep.all():
+            self.remove(keep)
+        new_rows = np.flatnonzero(~np.isin(matrix.ids, self.ids, assume_unique=True))
+        if len(new_rows):
+            self.insert(matrix, new_rows)
+        self.inserted += int(np.count_nonzero(~keep)) + len(new_rows)
+        self.token = matrix.token
+
+    def needs_rebuild(self) -> bool:
+        return self.inserted > self.trained_size * REBUILD_RATIO
+
+    def save(self, path: str) -> None:
+        _write(path, self.kind, self.trained_size, self.arrays())
+
+
+def _write(path: str, kind: str, trained_size: int, arrays: dict[str, np.ndarray]) -> None:
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp, kind=np.array(kind), trained_size=np.array(trained_size), **arrays)
+    os.replace(tmp, path)
+
+
+def _unit(query: list[float]) -> Optional[np.ndarray]:
+    q = np.asarray(query, dtype=np.float32)
+    norm = np.linalg.norm(q)
+    return q / norm if norm else None
+
+
+def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        block = vectors[start:start + ASSIGN_CHUNK]
+        out[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def _train_centroids(unit: np.ndarray, nlist: int, iters: int,
+                     rng: np.random.Generator) -> np.ndarray:
+    """Spherical k-means on a sample of at most 64 points per cell."""
+    sample = unit[rng.choice(len(unit), min(len(unit), nlist * 64), replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = _nearest_centroid(sample, centroids)
+        sums = np.stack([np.bincount(assign, weights=sample[:, d], minlength=nlist)
+                         for d in range(sample.shape[1])], axis=1).astype(np.float32)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = np.divide(sums, norms, out=np.zeros_like(sums), where=norms > 0)
+    return centroids
+
+
+class IVFIndex(VectorIndex):
+    """Inverted-file index: one id list per k-means cell."""
+
+    kind = "ivf"
+
+    def __init__(self, centroids: np.ndarray, ids: np.ndarray, vectors: np.ndarray,
+                 cells: np.ndarray):
+        super().__init__(ids, vectors)
+        self.centroids = centroids
+        self.cells = cells  # cell of each indexed id
+        self.lists = self._group()
+
+    def _group(self) -> list[np.ndarray]:
+        order = np.argsort(self.cells, kind="stable")
+        bounds = np.searchsorted(self.cells[order], np.arange(len(self.centroids) + 1))
+        return [self.ids[order[bounds[i]:bounds[i + 1]]] for i in range(len(self.centroids))]
+
+    @classmethod
+    def build(cls, matrix: CatalogMatrix, nlist: Optional[int] = None,
+              iters: int = 10, seed: int = 0) -> "IVFIndex":
+        nlist = nlist or int(np.clip(np.sqrt(len(matrix)), 1, 4096))
+        nlist = min(nlist, len(matrix))
+        centroids = _train_centroids(matrix.unit, nlist, iters, np.random.default_rng(seed))
+        index = cls(centroids, matrix.ids.copy(), np.array(matrix.unit),
+                    _nearest_centroid(matrix.unit, centroids))
+        index.token = matrix.token
+        index.trained_size = len(matrix)
+        return index
+
+    # Both updates build new arrays instead of editing them in place, so a
+    # search or background save holding the old ones is unaffected.
+    def insert(self, matrix: CatalogMatrix, rows: np.ndarray) -> None:
+        ids = np.concatenate([self.ids, matrix.ids[rows]])
+        order = np.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.vectors = np.concatenate([self.vectors, matrix.unit[rows]])[order]
+        self.cells = np.concatenate([self.cells,
+                                     _nearest_centroid(matrix.unit[rows], self.centroids)])[order]
+        self.lists = self._group()
+
+    def remove(self, keep: np.ndarray) -> None:
+        self.ids, self.vectors, self.cells = self.ids[keep], self.vectors[keep], self.cells[keep]
+        self.lists = self._group()
+
+    def search(self, matrix: CatalogMatrix, query: list[float], k: int,
+               mask: Optional[np.ndarray] = None,
+               nprobe: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        q = _unit(query)
+        if q is None:
+            return matrix.top_k(query, k, mask)
+        lists = self.lists
+        cells = np.argsort(-(self.centroids @ q))
+        nprobe = max(1, nprobe or settings.ANN_NPROBE)
+        while True:
+            probe = cells[:nprobe]
+            rows = matrix.rows_of(np.concatenate([lists[c] for c in probe]))
+            if mask is not None:
+                rows = rows[mask[rows]]
+            # Widen the probe when filters leave fewer than k candidates.
+            if len(rows) >= k or nprobe >= len(cells):
+                break
+            nprobe *= 2
+        scores = np.round(matrix.unit[rows] @ q, 4)
+        return rank_top_k(rows, scores, k)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"centroids": self.centroids, "ids": self.ids,
+                "vectors": self.vectors, "cells": self.cells}
+
+    @classmethod
+    def from_arrays(cls, data) -> "IVFIndex":
+        return cls(data["centroids"], data["ids"], data["vectors"], data["cells"])
+
+
+INDEX_TYPES: dict[str, type[VectorIndex]] = {
+    IVFIndex.kind: IVFIndex,
+}
+
+
+def load(path: str) -> VectorIndex:
+    with np.load(path) as data:
+        index = INDEX_TYPES[str(data["kind"])].from_arrays(data)
+        index.trained_size = int(data["trained_size"])
+    return index
+
+
+def recall_at_k(index: VectorIndex, matrix: CatalogMatrix, queries: np.ndarray,
+                k: int = 10, nprobe: Optional[int] = None) -> float:
+    """Mean fraction of the exact top-k ids that the index also returns."""
+    hits = 0
+    for q in queries:
+        exact_rows, _ = matrix.top_k(list(q), k)
+        approx_rows, _ = index.search(matrix, list(q), k, nprobe=nprobe)
+        hits += len(np.intersect1d(exact_rows, approx_rows))
+    return hits / (len(queries) * k) if len(queries) else 1.0
+
+
+# ── process-wide registry ────────────────────────────────────────────────────
+
+_lock = threading.Lock()
+_indexes: dict[int, VectorIndex] = {}
+_paths: dict[int, str] = {}
+# One writer thread keeps saves ordered and off the request path.
+_saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ann-save")
+_last_save: Optional[Future] = None
+
+
+def load_at_startup(engine: Engine, path: Optional[str] = None) -> None:
+    """Register the on-disk location for `engine` and load a saved index if present."""
+    path = path or settings.ANN_INDEX_PATH
+    _paths[id(engine)] = path
+    if not os.path.exists(path):
+        return
+    try:
+        _indexes[id(engine)] = load(path)
+        logger.info("Loaded %s ANN index from %s", settings.ANN_INDEX_TYPE, path)
+    except Exception as exc:
+        logger.warning("Ignoring unreadable ANN index %s: %s", path, exc)
+
+
+def _save_in_background(index: VectorIndex, path: str) -> None:
+    def write(arrays: dict[str, np.ndarray]) -> None:
+        try:
+            _write(path, index.kind, index.trained_size, arrays)
+        except OSError as exc:
+            logger.warning("Could not save ANN index to %s: %s", path, exc)
+
+    global _last_save
+    _last_save = _saver.submit(write, index.arrays())
+
+
+def get_index(db: Session, matrix: CatalogMatrix) -> Optional[VectorIndex]:
+    """Return an index in sync with `matrix`, or None when the exact path applies."""
+    if len(matrix) < settings.ANN_MIN_ROWS:
+        return None
+    key = id(db.get_bind())
+    index = _indexes.get(key)
+    if index is not None and index.token == matrix.token:
+        return index
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None and index.token == matrix.token:
+            return index
+        if index is None or not isinstance(index, INDEX_TYPES[settings.ANN_INDEX_TYPE]):
+            index = INDEX_TYPES[settings.ANN_INDEX_TYPE].build(matrix)
+        else:
+            index.sync(matrix)
+            if index.needs_rebuild():
+                index = type(index).build(matrix)
+        _indexes[key] = index
+        if key in _paths:
+            _save_in_background(index, _paths[key])
+    return index
+
+
+def shutdown() -> None:
+    """Wait for pending index saves (called from the app lifespan)."""
+    if _last_save is not None:
+        _last_save.result()
+
+
+def nearest(db: Session, matrix: CatalogMatrix, query: list[float], k: int,
+            mask: Optional[np.ndarray] = None, *,
+            exact: bool = False) -> tuple[np.ndarray, np.ndarray, bool]:
+    """Top-k rows for `query`; returns (rows, scores, approximate)."""
+    index = None if exact else get_index(db, matrix)
+    if index is None:
+        rows, scores = matrix.top_k(query, k, mask)
+        return rows, scores, False
+    rows, scores = index.search(matrix, query, k, mask)
+    return rows, scores, True
@@ -0,0 +1,69 @@
+"""
+Catalog similarity queries shared by the REST catalog routes and MCP tools.
+
+Both entry points build a candidate mask over the cached `CatalogMatrix`,
+rank it with `ann.nearest` (ANN index or exact batched scoring), and hydrate
+only the top-k rows from the database.
+"""
+
+from __future__ import annotations
+
+from typing import NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.models import CatalogTrack
+from app.services.similarity.ann import nearest
+from app.services.similarity.matrix import CatalogMatrix, get_catalog_matrix
+from app.services.similarity.mood import target_vector
+from app.services.similarity.vectors import to_vector
+
+
+class Match(NamedTuple):
+    track: CatalogTrack
+    score: float
+    vector: np.ndarray  # the track's 8-d vector, as scored
+
+
+class SearchResult(NamedTuple):
+    matches: list[Match]
+    total_candidates: int
+    approximate: bool
+
+
+def _search(db: Session, matrix: CatalogMatrix, query: list[float], k: int,
+            mask: np.ndarray, exact: bool) -> SearchResult:
+    rows, scores, approximate = nearest(db, matrix, query, k, mask, exact=exact)
+    ids = [int(matrix.ids[r]) for r in rows]
+    tracks = {t.id: t for t in db.query(CatalogTrack).filter(CatalogTrack.id.in_(ids)).all()}
+    matches = [
+        Match(tracks[tid], round(float(score), 4), matrix.vectors[row])
+        for tid, row, score in zip(ids, rows, scores)
+        if tid in tracks
+    ]
+    return SearchResult(matches, int(np.count_nonzero(mask)), approximate)
+
+
+def find_similar(db: Session, seed: CatalogTrack, k: int, *,
+                 same_genre: bool = False, exact: bool = False) -> SearchResult:
+    """Catalog tracks closest to `seed`, excluding the seed itself."""
+    matrix = get_catalog_matrix(db)
+    mask = matrix.ids != seed.id
+    if same_genre and seed.genre:
+        mask &= matrix.genre_mask(seed.genre)
+    return _search(db, matrix, to_vector(seed), k, mask, exact)
+
+
+def match_mood(db: Session, targets: dict[str, float], k: int, *,
+               genre: Optional[str] = None, exact: bool = False) -> SearchResult:
+    """Tracks inside every `<feature>_min/_max` target, ranked against `target_vector`."""
+    matrix = get_catalog_matrix(db)
+    mask = ~np.isnan(matrix.column("energy")) & ~np.isnan(matrix.column("valence"))
+    for key, value in targets.items():
+        feature, bound = key.rsplit("_", 1)
+        column = matrix.column(feature)
+        mask &= (column >= value) if bound == "min" else (column <= value)
+    if genre:
+        mask &= matrix.genre_mask(genre)
+    return _search(db, matrix, target_vector(targets), k, mask, exact)
@@ -0,0 +1,251 @@
+"""
+Process-wide NumPy feature matrix over the discovery catalog.
+
+Holds the 8-dimensional audio vector of every catalog track (seven 0–1
+features plus tempo scaled by TEMPO_MAX) as row-normalised float32 arrays,
+so cosine similarity against a query becomes one matrix-vector product
+followed by an `argpartition` top-k. The matrix is built once per database
+from `catalog_tracks` and rebuilt only when the catalog version token
+(see `app.services.catalog_state`) changes.
+
+Snapshots: after a catalog import the matrix is written to
+`settings.CATALOG_SNAPSHOT_PATH` as one `.npy` file per array, tagged with
+the catalog token. Processes memory-map it read-only (`open_snapshot`), so
+every API worker shares the same pages through the OS page cache and a
+stale matrix is replaced from the snapshot rather than re-read from
+`catalog_tracks`. A snapshot whose token no longer matches is ignored.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import CatalogTrack
+from app.services import catalog_state
+from app.services.similarity.vectors import COLUMNS, TEMPO_MAX
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ARRAYS = ("ids", "features", "genre_codes", "vectors", "unit")
+SNAPSHOT_POINTER = "CURRENT"
+
+
+class CatalogMatrix:
+    """Immutable snapshot of catalog ids, raw features and unit vectors."""
+
+    def __init__(self, ids: np.ndarray, features: np.ndarray,
+                 genre_codes: np.ndarray, genres: list[str],
+                 token: Optional[str] = None, *,
+                 vectors: Optional[np.ndarray] = None, unit: Optional[np.ndarray] = None):
+        self.ids = ids                  # int64, ascending
+        self.features = features        # float32 (N, 8), NaN where NULL, tempo in BPM
+        self.genre_codes = genre_codes  # int32 index into `genres`, -1 where NULL
+        self.genres = genres            # lower-cased, stripped genre names
+        self.token = token
+
+        # A snapshot passes its mapped vectors/unit arrays in; never copy them.
+        if vectors is None:
+            vectors = np.nan_to_num(features, nan=0.0)
+            vectors[:, -1] /= TEMPO_MAX
+        self.vectors = vectors
+        if unit is None:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            unit = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+        self.unit = unit
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def row_of(self, track_id: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.ids, track_id))
+        if pos < len(self) and self.ids[pos] == track_id:
+            return pos
+        return None
+
+    def rows_of(self, track_ids: np.ndarray) -> np.ndarray:
+        """Vectorised `row_of`; ids no longer in the catalog are dropped."""
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.ids, track_ids), len(self) - 1)
+        return pos[self.ids[pos] == track_ids]
+
+    def column(self, name: str) -> np.ndarray:
+        return self.features[:, COLUMNS.index(name)]
+
+    def genre_mask(self, genre: str) -> np.ndarray:
+        """Rows whose genre contains `genre` (mirrors `genre ILIKE '%genre%'`)."""
+        needle = genre.strip().lower()
+        codes = [i for i, g in enumerate(self.genres) if needle in g]
+        return np.isin(self.genre_codes, codes)
+
+    def scores(self, query: list[float]) -> np.ndarray:
+        """Cosine similarity of every row against `query` (an unscaled vector)."""
+        q = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return np.zeros(len(self), dtype=np.float32)
+        return self.unit @ (q / norm)
+
+    def top_k(self, query: list[float], k: int,
+              mask: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return (rows, scores) of the k best rows, best first, ties by id.
+
+        Scores are rounded to the 4 decimals the API reports before ranking,
+        so rows that display the same score are always ordered by id.
+        """
+        scores = np.round(self.scores(query), 4)
+        if mask is not None:
+            scores[~mask] = -np.inf
+            k = min(k, int(np.count_nonzero(mask)))
+        return rank_top_k(np.arange(len(self)), scores, k)
+
+
+def rank_top_k(rows: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Pick the k best (row, score) pairs, ordered by score desc then row asc.
+
+    Every row tied with the k-th score stays a candidate, so the cut-off
+    falls by row as well, not wherever the partition happened to split.
+    """
+    k = min(k, len(rows))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+    top = np.flatnonzero(scores >= kth)
+    top = top[np.lexsort((rows[top], -scores[top]))][:k]
+    return rows[top], np.clip(scores[top], 0.0, 1.0)
+
+
+def build_matrix(db: Session, token: Optional[str] = None) -> CatalogMatrix:
+    cols = [getattr(CatalogTrack, c) for c in COLUMNS]
+    rows = db.execute(
+        select(CatalogTrack.id, CatalogTrack.genre, *cols).order_by(CatalogTrack.id)
+    ).all()
+
+    genres: list[str] = []
+    genre_index: dict[str, int] = {}
+    codes = np.full(len(rows), -1, dtype=np.int32)
+    for i, row in enumerate(rows):
+        if not row.genre:
+            continue
+        g = row.genre.strip().lower()
+        code = genre_index.get(g)
+        if code is None:
+            code = genre_index[g] = len(genres)
+            genres.append(g)
+        codes[i] = code
+
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    features = np.array([r[2:] for r in rows], dtype=np.float32).reshape(len(rows), len(COLUMNS))
+    return CatalogMatrix(ids, features, codes, genres, token)
+
+
+def save_snapshot(matrix: CatalogMatrix, path: str) -> None:
+    """Write `matrix` under `path/<token>/` and atomically make it current."""
+    target = os.path.join(path, matrix.token)
+    tmp = f"{target}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in SNAPSHOT_ARRAYS:
+        np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(getattr(matrix, name)))
+    with open(os.path.join(tmp, "genres.json"), "w") as fh:
+        json.dump(matrix.genres, fh)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+
+    pointer = os.path.join(path, SNAPSHOT_POINTER)
+    with open(f"{pointer}.tmp", "w") as fh:
+        fh.write(matrix.token)
+    os.replace(f"{pointer}.tmp", pointer)
+
+    # Processes still mapping an older snapshot keep their pages until they
+    # drop it; unlinking only removes the names.
+    for entry in os.listdir(path):
+        if entry not in (matrix.token, SNAPSHOT_POINTER):
+            full = os.path.join(path, entry)
+            if os.path.isdir(full):
+                shutil.rmtree(full, ignore_errors=True)
+
+
+def open_snapshot(path: str, token: Optional[str] = None) -> Optional[CatalogMatrix]:
+    """Memory-map the current snapshot read-only; None if absent or not at `token`."""
+    try:
+        with open(os.path.join(path, SNAPSHOT_POINTER)) as fh:
+            current = fh.read().strip()
+    except FileNotFoundError:
+        return None
+    if not current or (token is not None and current != token):
+        return None
+    directory = os.path.join(path, current)
+    try:
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                  for name in SNAPSHOT_ARRAYS}
+        with open(os.path.join(directory, "genres.json")) as fh:
+            genres = json.load(fh)
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring unreadable catalog snapshot %s: %s", directory, exc)
+        return None
+    return CatalogMatrix(arrays["ids"], arrays["features"], arrays["genre_codes"], genres,
+                         current, vectors=arrays["vectors"], unit=arrays["unit"])
+
+
+_lock = threading.Lock()
+_matrices: dict[int, CatalogMatrix] = {}
+_paths: dict[int, str] = {}
+
+
+def load_at_startup(engine: Engine, path: Optional[str] = None) -> None:
+    """Register the snapshot location for `engine` and map the current snapshot."""
+    path = path or settings.CATALOG_SNAPSHOT_PATH
+    _paths[id(engine)] = path
+    matrix = open_snapshot(path)
+    if matrix is not None:
+        _matrices[id(engine)] = matrix
+        logger.info("Mapped catalog snapshot of %d tracks from %s", len(matrix), path)
+
+
+def write_snapshot(db: Session) -> Optional[CatalogMatrix]:
+    """
+    Snapshot the committed catalog for this session's database, if a snapshot
+    location is registered for it, and switch this process to the mapped copy.
+    """
+    key = id(db.get_bind())
+    path = _paths.get(key)
+    token = catalog_state.current_token(db)
+    if path is None or token is None:
+        return None
+    with _lock:
+        save_snapshot(build_matrix(db, token), path)
+        matrix = open_snapshot(path, token)
+        if matrix is not None:
+            _matrices[key] = matrix
+    return matrix
+
+
+def get_catalog_matrix(db: Session) -> CatalogMatrix:
+    """Return the cached matrix for this session's database, rebuilding if stale."""
+    key = id(db.get_bind())
+    token = catalog_state.current_token(db)
+    matrix = _matrices.get(key)
+    if matrix is not None and matrix.token == token:
+        return matrix
+    with _lock:
+        matrix = _matrices.get(key)
+        if matrix is None or matrix.token != token:
+            matrix = None
+            if key in _paths and token is not None:
+                matrix = open_snapshot(_paths[key], token)
+            if matrix is None:
+                matrix = build_matrix(db, token)
+            _matrices[key] = matrix
+    return matrix
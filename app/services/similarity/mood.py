@@ -0,0 +1,111 @@
+"""Free-text mood parsing into audio feature targets."""
+
+from __future__ import annotations
+
+import numpy as np
+
+from app.services.similarity.vectors import FEATURES
+
+# Energy / valence split between the four mood quadrants.
+QUADRANT_SPLIT = 0.55
+
+MOOD_KEYWORDS: dict[str, dict[str, float]] = {
+    "energetic": {"energy_min": 0.7},
+    "hype":      {"energy_min": 0.75},
+    "pump":      {"energy_min": 0.75},
+    "workout":   {"energy_min": 0.7},
+    "intense":   {"energy_min": 0.7},
+    "loud":      {"energy_min": 0.65},
+    "quiet":     {"energy_max": 0.4},
+    "soft":      {"energy_max": 0.45},
+    "gentle":    {"energy_max": 0.4},
+    "calm":      {"energy_max": 0.45},
+    "chill":     {"energy_max": 0.5},
+    "relax":     {"energy_max": 0.5},
+    "sleep":     {"energy_max": 0.35},
+    "peaceful":  {"energy_max": 0.4},
+    "background": {"energy_max": 0.5},
+    "happy":     {"valence_min": 0.65},
+    "upbeat":    {"valence_min": 0.6},
+    "joyful":    {"valence_min": 0.7},
+    "positive":  {"valence_min": 0.6},
+    "fun":       {"valence_min": 0.6},
+    "party":     {"valence_min": 0.6, "energy_min": 0.65},
+    "sad":       {"valence_max": 0.4},
+    "melancholy": {"valence_max": 0.4},
+    "dark":      {"valence_max": 0.35},
+    "gloomy":    {"valence_max": 0.4},
+    "rainy":     {"valence_max": 0.45, "energy_max": 0.5},
+    "heartbreak": {"valence_max": 0.4},
+    "angry":     {"valence_max": 0.45, "energy_min": 0.65},
+    "dance":     {"danceability_min": 0.7},
+    "groove":    {"danceability_min": 0.65},
+    "club":      {"danceability_min": 0.7, "energy_min": 0.65},
+    "acoustic":  {"acousticness_min": 0.5},
+    "unplugged": {"acousticness_min": 0.6},
+    "organic":   {"acousticness_min": 0.5},
+    "sunday":    {"acousticness_min": 0.3, "energy_max": 0.55},
+    "morning":   {"energy_max": 0.6, "valence_min": 0.45},
+    "night":     {"energy_max": 0.55},
+    "late":      {"energy_max": 0.5},
+    "study":     {"energy_max": 0.55, "speechiness_max": 0.1},
+    "focus":     {"energy_max": 0.6, "speechiness_max": 0.1},
+    "drive":     {"energy_min": 0.55},
+    "road":      {"energy_min": 0.5},
+}
+
+
+def mood_label(energy: float, valence: float) -> str:
+    if energy >= QUADRANT_SPLIT and valence >= QUADRANT_SPLIT:
+        return "Happy"
+    if energy >= QUADRANT_SPLIT and valence < QUADRANT_SPLIT:
+        return "Angry"
+    if energy < QUADRANT_SPLIT and valence >= QUADRANT_SPLIT:
+        return "Calm"
+    return "Sad"
+
+
+def mood_masks(energy: np.ndarray, valence: np.ndarray) -> dict[str, np.ndarray]:
+    """Vectorised `mood_label`: one boolean mask per quadrant."""
+    high_energy = energy >= QUADRANT_SPLIT
+    high_valence = valence >= QUADRANT_SPLIT
+    return {
+        "Happy": high_energy & high_valence,
+        "Calm":  ~high_energy & high_valence,
+        "Angry": high_energy & ~high_valence,
+        "Sad":   ~high_energy & ~high_valence,
+    }
+
+
+def parse_mood(description: str) -> tuple[dict[str, float], list[str]]:
+    """Map keywords in `description` to `<feature>_min` / `<feature>_max` targets.
+
+    When several keywords constrain the same bound, the targets are averaged.
+    """
+    words = description.lower().replace(",", " ").replace(".", " ").split()
+    targets: dict[str, float] = {}
+    matched: list[str] = []
+    for word in words:
+        if word in MOOD_KEYWORDS:
+            matched.append(word)
+            for key, value in MOOD_KEYWORDS[word].items():
+                if key in targets:
+                    targets[key] = round((targets[key] + value) / 2, 3)
+                else:
+                    targets[key] = value
+    return targets, matched
+
+
+def target_vector(targets: dict[str, float]) -> list[float]:
+    """Query vector sitting inside the target bounds (0.5 where unconstrained)."""
+    def value(feature: str) -> float:
+        min_k, max_k = f"{feature}_min", f"{feature}_max"
+        if min_k in targets and max_k in targets:
+            return (targets[min_k] + targets[max_k]) / 2
+        if min_k in targets:
+            return min(targets[min_k] + 0.1, 1.0)
+        if max_k in targets:
+            return max(targets[max_k] - 0.1, 0.0)
+        return 0.5
+
+    return [value(f) for f in FEATURES] + [0.5]
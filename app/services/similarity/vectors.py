@@ -0,0 +1,41 @@
+"""The 8-dimensional audio vector layout shared by every similarity path."""
+
+from __future__ import annotations
+
+import math
+from typing import Optional
+
+FEATURES = ["energy", "valence", "danceability", "acousticness",
+            "instrumentalness", "speechiness", "liveness"]
+# Tempo lives on a different scale (0-250 BPM) so it is normalised to 0-1.
+TEMPO_MAX = 250.0
+COLUMNS = FEATURES + ["tempo"]
+VECTOR_LABELS = FEATURES + ["tempo_norm"]
+
+
+def normalize_tempo(tempo: Optional[float]) -> float:
+    return (tempo or 0.0) / TEMPO_MAX
+
+
+def to_vector(track) -> list[float]:
+    """Vector for any object exposing the audio feature attributes; NULLs become 0."""
+    vec = [getattr(track, f) or 0.0 for f in FEATURES]
+    vec.append(normalize_tempo(track.tempo))
+    return vec
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    mag_a = math.sqrt(sum(x * x for x in a))
+    mag_b = math.sqrt(sum(y * y for y in b))
+    if mag_a == 0 or mag_b == 0:
+        return 0.0
+    return round(dot / (mag_a * mag_b), 4)
+
+
+def feature_breakdown(seed_vec: list[float], candidate_vec) -> dict[str, float]:
+    """Per-dimension closeness (1 - |difference|) between two vectors."""
+    return {
+        f: round(1.0 - abs(seed_vec[i] - float(candidate_vec[i])), 4)
+        for i, f in enumerate(VECTOR_LABELS)
+    }
@@ -0,0 +1,164 @@
+"""
+Concurrent Spotify Web API client for import jobs.
+
+Every request first takes a token from one process-wide `TokenBucket`
+(SPOTIFY_RATE requests/second, bursts of SPOTIFY_BURST), so concurrent import
+jobs share a single budget. A 429 pauses the bucket for the `Retry-After`
+interval, which holds back every job, not just the one that was throttled.
+Within a job, `get_many` fans independent pages and batches out in parallel,
+bounded by SPOTIFY_MAX_CONCURRENCY in-flight requests.
+
+The bucket is thread-safe and waits with `asyncio.sleep`, so jobs running
+their own event loops on different worker threads can share it. Tests inject
+an `httpx` transport (e.g. `httpx.MockTransport`) in place of the network.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+SPOTIFY = "https://api.spotify.com/v1"
+
+
+class SpotifyUnavailable(Exception):
+    def __init__(self, detail: str = "Spotify service unavailable"):
+        super().__init__(detail)
+
+
+class TokenBucket:
+    """Token bucket with a shared pause for upstream `Retry-After` responses."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # Take a token now (the balance may go negative) and return how long
+        # the caller has to wait for it to become valid.
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    async def acquire(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+_bucket: Optional[TokenBucket] = None
+_bucket_lock = threading.Lock()
+
+
+def get_bucket() -> TokenBucket:
+    """The process-wide rate budget, configured from settings on first use."""
+    global _bucket
+    with _bucket_lock:
+        if _bucket is None:
+            _bucket = TokenBucket(settings.SPOTIFY_RATE, settings.SPOTIFY_BURST)
+        return _bucket
+
+
+class SpotifyClient:
+    """Per-job async client; use as `async with SpotifyClient(token) as sp:`."""
+
+    def __init__(self, token: str, *, bucket: Optional[TokenBucket] = None,
+                 max_concurrency: Optional[int] = None, max_retries: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.token = token
+        self.bucket = bucket or get_bucket()
+        self.max_concurrency = max_concurrency or settings.SPOTIFY_MAX_CONCURRENCY
+        self.max_retries = max_retries or settings.SPOTIFY_MAX_RETRIES
+        self.timeout = timeout or settings.SPOTIFY_TIMEOUT
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "SpotifyClient":
+        self._client = httpx.AsyncClient(
+            base_url=SPOTIFY,
+            headers={"Authorization": f"Bearer {self.token}"},
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency),
+            transport=self.transport,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._client.aclose()
+
+    async def get(self, endpoint: str) -> Any:
+        """
+        GET one endpoint. Returns the JSON body, None when the token is
+        rejected, or `{"spotify_error": "forbidden"}` on a missing scope.
+        Raises `SpotifyUnavailable` once retries are exhausted.
+        """
+        if not self.token or self.token.strip().lower() == "invalid":
+            return None
+
+        async with self._semaphore:
+            for attempt in range(1, self.max_retries + 1):
+                await self.bucket.acquire()
+                try:
+                    response = await self._client.get(f"/{endpoint}")
+                except httpx.TransportError as exc:
+                    logger.warning("Spotify request failed for %s: %s", endpoint, exc)
+                    if attempt == self.max_retries:
+                        raise SpotifyUnavailable() from exc
+                    await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+                    continue
+
+                if response.status_code == 429:
+                    wait = float(response.headers.get("Retry-After", 3))
+                    logger.info("Spotify rate limited; pausing all fetches for %ss", wait)
+                    self.bucket.pause(wait)
+                    if attempt == self.max_retries:
+                        raise SpotifyUnavailable("Spotify rate limit exceeded")
+                    continue
+                if response.status_code >= 500:
+                    if attempt == self.max_retries:
+                        raise SpotifyUnavailable()
+                    await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+                    continue
+                if response.status_code == 401:
+                    return None
+                if response.status_code == 403:
+                    return {"spotify_error": "forbidden", "status_code": 403}
+                return response.json() if response.status_code == 200 else None
+
+    async def get_many(self, endpoints: list[str],
+                       on_result: Optional[Callable[[int], None]] = None) -> list[Any]:
+        """Fetch independent endpoints in parallel; results keep request order.
+
+        `on_result(i)` is called as each response for `endpoints[i]` arrives.
+        """
+        async def fetch(i: int, endpoint: str) -> Any:
+            data = await self.get(endpoint)
+            if on_result is not None:
+                on_result(i)
+            return data
+
+        return list(await asyncio.gather(*(fetch(i, e) for i, e in enumerate(endpoints))))
@@ -0,0 +1,365 @@
+"""
+Spotify ingestion pipeline, run as a background import job.
+
+One job can fan out to multiple Spotify sources:
+- top tracks (single range or all three ranges)
+- recently played
+- saved tracks (paginated)
+- audio feature and artist-genre enrichment
+
+Independent windows, pages and batches are fetched concurrently through
+`SpotifyClient`, which shares one rate budget across all running jobs.
+
+Recently played items become real listening events. Top-track and saved-track
+imports can additionally synthesise plausible historical listening events so
+analytics endpoints remain useful even when Spotify only exposes affinity data.
+
+`run` executes on the job runner (see `job_runner`) and reports each stage
+through its `JobTracker`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models import ImportJob, Track
+from app.schemas import ImportStartRequest
+from app.services import event_writer
+from app.services.job_runner import JobTracker
+from app.services.spotify_client import SpotifyClient
+
+logger = logging.getLogger(__name__)
+
+TOP_TRACK_WINDOWS = ["long_term", "medium_term", "short_term"]
+SAVED_PAGE_SIZE = 50
+AUDIO_FEATURES_BATCH = 100
+ARTISTS_BATCH = 50
+LOOKUP_CHUNK = 500
+AUDIO_FEATURES = [
+    "danceability", "energy", "valence", "acousticness",
+    "instrumentalness", "speechiness", "liveness",
+    "loudness", "tempo",
+]
+
+
+class ImportFailed(Exception):
+    """The job cannot continue (bad token, nothing to import)."""
+
+
+@dataclass
+class Fetched:
+    tracks: dict[str, dict] = field(default_factory=dict)  # sid -> {"track", "sources"}
+    recent_plays: dict[str, list[str | None]] = field(default_factory=dict)
+    features: dict[str, dict] = field(default_factory=dict)
+    genres: dict[str, str] = field(default_factory=dict)
+    errors: list[str] = field(default_factory=list)
+
+    def collect(self, track: dict, source: str) -> bool:
+        sid = track.get("id")
+        if not sid:
+            return False
+        entry = self.tracks.setdefault(sid, {"track": track, "sources": set()})
+        entry["track"] = track
+        entry["sources"].add(source)
+        return True
+
+
+def _client(token: str) -> SpotifyClient:
+    return SpotifyClient(token)
+
+
+def _batches(ids: list[str], size: int) -> list[list[str]]:
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+async def _fetch(sp: SpotifyClient, tracker: JobTracker, body: ImportStartRequest) -> Fetched:
+    out = Fetched()
+
+    def advance(_index: int) -> None:
+        tracker.advance()
+
+    # 1) Top tracks across one or all windows
+    windows = TOP_TRACK_WINDOWS if body.time_range == "all" else [body.time_range]
+    tracker.stage("top_tracks", total=len(windows))
+    pages = await sp.get_many([f"me/top/tracks?time_range={tr}&limit=50" for tr in windows], advance)
+    for tr, data in zip(windows, pages):
+        if data is None:
+            raise ImportFailed(f"Auth failed for top tracks ({tr})")
+        for track in data.get("items") or []:
+            out.collect(track, f"top:{tr}")
+
+    # 2) Recently played
+    if body.include_recently_played:
+        tracker.stage("recently_played", total=1)
+        recent = await sp.get("me/player/recently-played?limit=50")
+        if recent is None:
+            raise ImportFailed("Auth failed for recently played")
+        for item in recent.get("items") or []:
+            track = item.get("track", {})
+            if out.collect(track, "recent"):
+                out.recent_plays.setdefault(track["id"], []).append(item.get("played_at"))
+        tracker.advance()
+
+    # 3) Saved tracks: the first page reports the library size, the rest are
+    # fetched in parallel.
+    if body.include_saved_tracks:
+        tracker.stage("saved_tracks", total=body.saved_tracks_max_pages)
+        first = await sp.get(f"me/tracks?limit={SAVED_PAGE_SIZE}&offset=0")
+        if first is None:
+            raise ImportFailed("Auth failed for saved tracks")
+        tracker.advance()
+        if first.get("spotify_error") == "forbidden":
+            out.errors.append("Saved tracks skipped: token missing user-library-read scope")
+        elif first.get("items"):
+            total = first.get("total")
+            n_pages = body.saved_tracks_max_pages
+            if isinstance(total, int):
+                n_pages = min(n_pages, math.ceil(total / SAVED_PAGE_SIZE))
+            tracker.advance(0, total=n_pages)
+            rest = await sp.get_many(
+                [f"me/tracks?limit={SAVED_PAGE_SIZE}&offset={page * SAVED_PAGE_SIZE}"
+                 for page in range(1, n_pages)],
+                advance,
+            )
+            for data in [first, *rest]:
+                items = (data or {}).get("items") or []
+                if not items:
+                    break
+                for item in items:
+                    out.collect(item.get("track", {}), "saved")
+
+    if not out.tracks:
+        raise ImportFailed("No Spotify tracks returned for this token/request")
+
+    # 4) Audio features in batches of 100
+    ids = list(out.tracks)
+    batches = _batches(ids, AUDIO_FEATURES_BATCH)
+    tracker.stage("audio_features", total=len(ids))
+    results = await sp.get_many([f"audio-features?ids={','.join(b)}" for b in batches],
+                                lambda i: tracker.advance(len(batches[i])))
+    for i, af_data in enumerate(results):
+        if af_data and isinstance(af_data, dict) and af_data.get("audio_features"):
+            for af in af_data["audio_features"]:
+                if af and af.get("id"):
+                    out.features[af["id"]] = af
+        else:
+            out.errors.append(f"Audio features failed for batch starting {i * AUDIO_FEATURES_BATCH}")
+
+    # 5) Artist genres in batches of 50
+    artist_ids: list[str] = []
+    seen_artist_ids: set[str] = set()
+    for entry in out.tracks.values():
+        for artist in entry["track"].get("artists", []):
+            aid = artist.get("id")
+            if aid and aid not in seen_artist_ids:
+                seen_artist_ids.add(aid)
+                artist_ids.append(aid)
+
+    batches = _batches(artist_ids, ARTISTS_BATCH)
+    tracker.stage("artists", total=len(artist_ids))
+    results = await sp.get_many([f"artists?ids={','.join(b)}" for b in batches],
+                                lambda i: tracker.advance(len(batches[i])))
+    for data in results:
+        if data and isinstance(data, dict) and data.get("artists"):
+            for artist in data["artists"]:
+                if artist and artist.get("id") and artist.get("genres"):
+                    out.genres[artist["id"]] = artist["genres"][0]
+    return out
+
+
+async def _fetch_with_client(tracker: JobTracker, body: ImportStartRequest) -> Fetched:
+    async with _client(body.spotify_token) as sp:
+        return await _fetch(sp, tracker, body)
+
+
+def run(db: Session, job: ImportJob, tracker: JobTracker, body: ImportStartRequest) -> None:
+    fetched = asyncio.run(_fetch_with_client(tracker, body))
+    all_sp_tracks, recent_plays, errors = fetched.tracks, fetched.recent_plays, fetched.errors
+    job.tracks_found = len(all_sp_tracks)
+
+    # 6) Upsert tracks
+    tracker.stage("tracks", total=len(all_sp_tracks))
+    sp_to_db, imported = _upsert_tracks(db, all_sp_tracks, fetched.features, fetched.genres)
+    job.tracks_imported = imported
+    job.errors = errors
+    tracker.advance(len(all_sp_tracks))
+
+    # 7) Listening events, written in chunks. There is no cancellation
+    # checkpoint inside this stage, so a job never stops with half its
+    # history written.
+    tracker.stage("events")
+
+    def written(n: int) -> None:
+        job.events_created += n
+        tracker.count(n)
+
+    event_writer.write_events(
+        db,
+        _event_rows(job.user_id, all_sp_tracks, sp_to_db, recent_plays, body.synthesise_history),
+        on_chunk=written,
+    )
+
+
+def _first_artist_id(track_data: dict) -> str | None:
+    return track_data.get("artists", [{}])[0].get("id") if track_data.get("artists") else None
+
+
+def _track_row(sid: str, track_data: dict, af: dict, genres: dict[str, str]) -> dict:
+    artists_str = ", ".join(a["name"] for a in track_data.get("artists", []))
+    first_artist_id = _first_artist_id(track_data)
+    release_year = None
+    release_date = track_data.get("album", {}).get("release_date", "")
+    if release_date:
+        try:
+            release_year = int(release_date[:4])
+        except ValueError:
+            pass
+    return {
+        "spotify_id": sid,
+        "title": track_data.get("name", "Unknown"),
+        "artist": artists_str or "Unknown Artist",
+        "album": track_data.get("album", {}).get("name"),
+        "genre": genres.get(first_artist_id) if first_artist_id else None,
+        "release_year": release_year,
+        "duration_ms": track_data.get("duration_ms"),
+        **{feature_name: af.get(feature_name) for feature_name in AUDIO_FEATURES},
+    }
+
+
+def insert_new_tracks(db: Session):
+    """INSERT for new tracks that skips rows a concurrent import already added."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sqlite_insert(Track).on_conflict_do_nothing(index_elements=["spotify_id"])
+    if dialect == "postgresql":
+        return pg_insert(Track).on_conflict_do_nothing(index_elements=["spotify_id"])
+    return insert(Track)
+
+
+def _upsert_tracks(db: Session, all_sp_tracks: dict[str, dict], features: dict[str, dict],
+                   genres: dict[str, str]) -> tuple[dict[str, int], int]:
+    """
+    Upsert every fetched track with a constant number of statements: one IN
+    lookup per chunk of ids, one executemany INSERT for the new rows, and one
+    IN lookup to map the generated ids back.
+    """
+    sids = list(all_sp_tracks)
+    existing: dict[str, Track] = {}
+    for chunk in _batches(sids, LOOKUP_CHUNK):
+        for track in db.query(Track).filter(Track.spotify_id.in_(chunk)):
+            existing[track.spotify_id] = track
+
+    new_rows = []
+    for sid, entry in all_sp_tracks.items():
+        track_data = entry["track"]
+        af = features.get(sid, {})
+        track = existing.get(sid)
+        if track is None:
+            new_rows.append(_track_row(sid, track_data, af, genres))
+            continue
+        # update empty fields if new data is richer
+        if not track.album:
+            track.album = track_data.get("album", {}).get("name")
+        if track.duration_ms is None:
+            track.duration_ms = track_data.get("duration_ms")
+        if not track.genre:
+            first_artist_id = _first_artist_id(track_data)
+            track.genre = genres.get(first_artist_id) if first_artist_id else track.genre
+        for feature_name in AUDIO_FEATURES:
+            if getattr(track, feature_name) is None and af.get(feature_name) is not None:
+                setattr(track, feature_name, af.get(feature_name))
+
+    sp_to_db = {sid: track.id for sid, track in existing.items()}
+    imported = 0
+    if new_rows:
+        result = db.connection().execute(insert_new_tracks(db), new_rows)
+        imported = result.rowcount if result.rowcount >= 0 else len(new_rows)
+        for chunk in _batches([row["spotify_id"] for row in new_rows], LOOKUP_CHUNK):
+            sp_to_db.update(db.connection().execute(
+                select(Track.spotify_id, Track.id).where(Track.spotify_id.in_(chunk))
+            ).all())
+    return sp_to_db, imported
+
+
+def _event_rows(user_id: int, all_sp_tracks: dict[str, dict], sp_to_db: dict[str, int],
+                recent_plays: dict[str, list[str | None]], synthesise_history: bool) -> Iterator[dict]:
+    """Yield real recent plays plus optional synthetic history as event rows."""
+    hours = [7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23]
+    weights = [1, 2, 3, 3, 2, 3, 2, 2, 2, 3, 4, 5, 6, 7, 8, 7, 5]
+
+    for sid, entry in all_sp_tracks.items():
+        track_id = sp_to_db.get(sid)
+        if not track_id:
+            continue
+        duration_ms = entry["track"].get("duration_ms")
+
+        if sid in recent_plays:
+            for ts_str in recent_plays[sid]:
+                listened_at = datetime.now(timezone.utc)
+                if ts_str:
+                    try:
+                        listened_at = datetime.fromisoformat(ts_str.replace("Z", "+00:00"))
+                    except ValueError:
+                        pass
+                yield {
+                    "user_id": user_id,
+                    "track_id": track_id,
+                    "listened_at": listened_at,
+                    "duration_listened_ms": duration_ms,
+                    "source": "spotify-recent",
+                }
+            continue
+
+        if not synthesise_history:
+            continue
+
+        sources = entry.get("sources", set())
+        if any(source.startswith("top:long_term") for source in sources):
+            n = random.randint(8, 20)
+            min_days, max_days = 30, 365
+            source_label = "spotify-top-long"
+        elif any(source.startswith("top:medium_term") for source in sources):
+            n = random.randint(4, 12)
+            min_days, max_days = 7, 180
+            source_label = "spotify-top-medium"
+        elif any(source.startswith("top:short_term") for source in sources):
+            n = random.randint(2, 6)
+            min_days, max_days = 1, 30
+            source_label = "spotify-top-short"
+        elif "saved" in sources:
+            n = random.randint(1, 4)
+            min_days, max_days = 14, 365
+            source_label = "spotify-saved"
+        else:
+            n = random.randint(1, 3)
+            min_days, max_days = 1, 21
+            source_label = "spotify-import"
+
+        for _ in range(n):
+            days_ago = random.randint(min_days, max_days)
+            hour = random.choices(hours, weights=weights, k=1)[0]
+            listened_at = (datetime.now(timezone.utc) - timedelta(days=days_ago)).replace(
+                hour=hour,
+                minute=random.randint(0, 59),
+                second=random.randint(0, 59),
+                microsecond=0,
+            )
+            pct = random.choices([0.3, 0.5, 0.75, 1.0], weights=[5, 10, 25, 60], k=1)[0]
+            yield {
+                "user_id": user_id,
+                "track_id": track_id,
+                "listened_at": listened_at,
+                "duration_listened_ms": int(duration_ms * pct) if duration_ms else None,
+                "source": source_label,
+            }
@@ -0,0 +1,74 @@
+"""
+Recall@k and latency benchmark: ANN index vs exact catalog similarity.
+
+Runs against the imported catalog in DATABASE_URL, or against a synthetic
+catalog of --rows tracks when --synthetic is given.
+
+Usage:  python data/benchmark_ann.py [--synthetic --rows 1000000] [--k 10] [--queries 200]
+"""
+
+import os, sys, time, argparse
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+
+def synthetic_matrix(rows, seed=0):
+    from app.services.similarity.matrix import CatalogMatrix
+    rng = np.random.default_rng(seed)
+    features = np.clip(rng.normal(0.5, 0.2, (rows, 8)), 0, 1).astype(np.float32)
+    features[:, 7] = rng.normal(120.0, 25.0, rows)
+    return CatalogMatrix(np.arange(1, rows + 1), features,
+                         np.full(rows, -1, dtype=np.int32), [])
+
+
+def db_matrix():
+    from app.database import SessionLocal
+    from app.services.similarity.matrix import build_matrix
+    db = SessionLocal()
+    try:
+        return build_matrix(db)
+    finally:
+        db.close()
+
+
+def timed(fn, queries):
+    start = time.perf_counter()
+    for q in queries:
+        fn(list(q))
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--synthetic", action="store_true")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    args = parser.parse_args()
+
+    from app.services.similarity.ann import IVFIndex, recall_at_k
+
+    matrix = synthetic_matrix(args.rows) if args.synthetic else db_matrix()
+    if not len(matrix):
+        print("Catalog is empty — import it first or pass --synthetic.")
+        return
+    print(f"Catalog rows: {len(matrix)}")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(matrix)
+    print(f"IVF build: {time.perf_counter() - start:.2f}s ({len(index.lists)} cells)")
+
+    rng = np.random.default_rng(1)
+    queries = matrix.vectors[rng.choice(len(matrix), min(args.queries, len(matrix)), replace=False)]
+    exact_ms = timed(lambda q: matrix.top_k(q, args.k), queries)
+    print(f"exact      recall@{args.k}=1.000  {exact_ms:.2f} ms/query")
+    for nprobe in args.nprobe:
+        recall = recall_at_k(index, matrix, queries, args.k, nprobe=nprobe)
+        ms = timed(lambda q: index.search(matrix, q, args.k, nprobe=nprobe), queries)
+        print(f"ivf n={nprobe:<4} recall@{args.k}={recall:.3f}  {ms:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -534,6 +534,191 @@ class TestAnalyticsV3:
         r = client.get("/api/v1/analytics/fingerprint")
         assert r.status_code == 401
 
+    def test_fingerprint_state_tracks_event_changes(self):
+        from app.models import FingerprintState
+        token = self._setup()
+        headers = self._auth(token)
+        before = client.get("/api/v1/analytics/fingerprint", headers=headers).json()["traits"]
+
+        extra = seed_track(title="New Song", artist="New Artist", genre="folk",
+                           energy=0.2, valence=0.9, tempo=90.0)
+        created = seed_event(token, extra, days_ago=2)
+        with db_session() as db:
+            state = db.get(FingerprintState, created["user_id"])
+            assert state.total_events == before["total_events"] + 1
+            assert state.genre_counts["folk"][0] == 1
+        events = client.get("/api/v1/listening-events?limit=100", headers=headers).json()["items"]
+        r = client.patch(f"/api/v1/listening-events/{events[-1]['id']}",
+                         json={"listened_at": "2024-01-01T03:15:00+00:00"}, headers=headers)
+        assert r.status_code == 200 and r.json()["listened_at"].startswith("2024-01-01T03:15")
+        r = client.delete(f"/api/v1/listening-events/{events[-2]['id']}", headers=headers)
+        assert r.status_code == 204
+
+        with db_session() as db:
+            assert db.get(FingerprintState, created["user_id"]).total_events == before["total_events"]
+        incremental = client.get("/api/v1/analytics/fingerprint", headers=headers).json()["traits"]
+
+        with db_session() as db:  # force a full rebuild from the event table
+            db.query(FingerprintState).delete()
+            db.commit()
+        rebuilt = client.get("/api/v1/analytics/fingerprint", headers=headers).json()["traits"]
+
+        assert incremental["total_events"] == before["total_events"]
+        assert "folk" in incremental["top_genres"]
+        for key, value in rebuilt.items():
+            if isinstance(value, float):
+                assert incremental[key] == pytest.approx(value, abs=1e-4), key
+            else:
+                assert incremental[key] == value, key
+
+    def test_fingerprint_state_follows_track_updates(self):
+        from app.models import FingerprintState, ListeningEvent, Track
+        token = self._setup()
+        headers = self._auth(token)
+        bare = seed_track(title="Bare", artist="Later Artist", genre=None,
+                          energy=None, valence=None, tempo=None)
+        created = [seed_event(token, bare, days_ago=d) for d in (2, 3, 4)]
+        client.get("/api/v1/analytics/fingerprint", headers=headers)
+
+        with db_session() as db:  # what a re-import filling in missing values does
+            track = db.get(Track, bare)
+            track.genre, track.energy, track.valence, track.tempo = "metal", 0.95, 0.1, 170.0
+            db.add(ListeningEvent(user_id=created[0]["user_id"], track_id=bare,
+                                  listened_at=datetime.now(timezone.utc) - timedelta(days=1)))
+            db.delete(db.get(ListeningEvent, created[1]["id"]))
+            db.commit()
+        incremental = client.get("/api/v1/analytics/fingerprint", headers=headers).json()["traits"]
+
+        with db_session() as db:
+            db.query(FingerprintState).delete()
+            db.commit()
+        rebuilt = client.get("/api/v1/analytics/fingerprint", headers=headers).json()["traits"]
+
+        assert "metal" in incremental["top_genres"]
+        for key, value in rebuilt.items():
+            if isinstance(value, float):
+                assert incremental[key] == pytest.approx(value, abs=1e-4), key
+            else:
+                assert incremental[key] == value, key
+
+    def test_state_bootstrap_counts_events_written_after_the_claim(self):
+        from app.models import FingerprintState, ListeningEvent, User
+        from app.services import fingerprint
+        token = self._setup()
+        with db_session() as db:
+            user_id = db.query(User).one().id
+            total = db.query(ListeningEvent).count()
+            # Another request claimed the row and has not aggregated yet.
+            db.add(FingerprintState(user_id=user_id, version=0))
+            db.commit()
+        seed_event(token, seed_track(title="Racing"), days_ago=1)
+        with db_session() as db:
+            claimed = db.get(FingerprintState, user_id)
+            assert (claimed.version, claimed.total_events) == (0, 0)  # writers skip it
+
+            state = fingerprint.load_state(db, user_id)
+            assert state.version == 1 and state.total_events == total + 1
+
+    def test_stale_rebuild_is_not_served_after_count_preserving_edit(self):
+        from app.models import ListeningEvent, UserFingerprint
+        token = self._setup()
+        headers = self._auth(token)
+        client.get("/api/v1/analytics/fingerprint", headers=headers)
+        moved = seed_track(title="Moved", genre="polka", energy=0.1, valence=0.9)
+        with db_session() as db:
+            events = db.query(ListeningEvent).all()
+            for e in events:
+                e.track_id = moved
+            db.commit()
+        with db_session() as db:
+            # A rebuild that read the state before the edit but committed after it.
+            db.query(UserFingerprint).one().updated_at = datetime.now(timezone.utc) + timedelta(hours=1)
+            db.commit()
+        traits = client.get("/api/v1/analytics/fingerprint", headers=headers).json()["traits"]
+        assert traits["top_genres"] == ["polka"] and traits["total_events"] == len(events)
+
+    def test_fingerprint_reads_do_not_rewrite_row(self):
+        from app.models import UserFingerprint
+        token = self._setup()
+        headers = self._auth(token)
+        client.get("/api/v1/analytics/fingerprint", headers=headers)
+        with db_session() as db:
+            written = db.query(UserFingerprint).one().updated_at
+
+        for path in ("fingerprint", "overview", "highlights", "fingerprint"):
+            assert client.get(f"/api/v1/analytics/{path}", headers=headers).status_code == 200
+        with db_session() as db:
+            assert db.query(UserFingerprint).one().updated_at == written
+
+        seed_event(token, seed_track(title="Fresh", genre="ambient"), days_ago=1)
+        traits = client.get("/api/v1/analytics/fingerprint", headers=headers).json()["traits"]
+        assert traits["total_events"] == 13
+        with db_session() as db:
+            assert db.query(UserFingerprint).one().updated_at > written
+
+    def test_fingerprint_async_enrichment(self, monkeypatch):
+        from app.services import enrichment, llm
+        enrichment.clear()
+        prompts = []
+
+        async def fake_chat(prompt, *, max_tokens=400, temperature=0.2):
+            prompts.append(prompt)
+            return "Rewritten by the model."
+
+        monkeypatch.setattr(llm, "chat", fake_chat)
+        token = self._setup()
+        sync = client.get("/api/v1/analytics/fingerprint", headers=self._auth(token)).json()
+        assert sync["explanation"] == "Rewritten by the model." and sync["enrichment_key"] is None
+
+        r = client.get("/api/v1/analytics/fingerprint?enrich=async", headers=self._auth(token))
+        assert r.status_code == 200
+        d = r.json()
+        assert d["explanation"].startswith("Your fingerprint is")
+        assert len(prompts) == 2
+
+        r = client.get(f"/api/v1/ai/enrichments/{d['enrichment_key']}", headers=self._auth(token))
+        assert r.status_code == 200
+        assert r.json() == {"key": d["enrichment_key"], "status": "ready",
+                            "text": "Rewritten by the model."}
+
+    def test_enrichment_is_private_to_requester(self):
+        from app.services import enrichment
+        enrichment.clear()
+        token = self._setup()
+        d = client.get("/api/v1/analytics/changes/recent?enrich=async", headers=self._auth(token)).json()
+        assert d["summary"].startswith("Compared with the previous")
+        r = client.get(f"/api/v1/ai/enrichments/{d['enrichment_key']}", headers=self._auth(token))
+        assert r.json()["status"] == "failed"  # no API key configured; template stands
+
+        register(username="other", email="other@x.com")
+        other = login("other")["access_token"]
+        r = client.get(f"/api/v1/ai/enrichments/{d['enrichment_key']}", headers=self._auth(other))
+        assert r.status_code == 404
+        assert client.get("/api/v1/analytics/fingerprint?enrich=later",
+                          headers=self._auth(token)).status_code == 422
+
+    def test_enrichment_survives_another_worker(self, tmp_path, monkeypatch):
+        import httpx
+        from app.services import enrichment, llm
+        from app.services.llm_cache import SQLiteCache
+        enrichment.clear()
+        monkeypatch.setattr(llm, "_client", llm.LLMClient(
+            api_key="test-key", base_url="http://llm.test/v1", model="stub",
+            cache=SQLiteCache(str(tmp_path / "llm.sqlite3")),
+            transport=httpx.MockTransport(lambda request: httpx.Response(
+                200, json={"choices": [{"message": {"content": "From the model."}}]}))))
+        token = self._setup()
+        key = client.get("/api/v1/analytics/fingerprint?enrich=async",
+                         headers=self._auth(token)).json()["enrichment_key"]
+        enrichment.clear()  # the poll lands on a worker that never saw the request
+
+        r = client.get(f"/api/v1/ai/enrichments/{key}", headers=self._auth(token))
+        assert r.status_code == 200
+        assert r.json() == {"key": key, "status": "ready", "text": "From the model."}
+        register(username="other", email="other@x.com")
+        other = login("other")["access_token"]
+        assert client.get(f"/api/v1/ai/enrichments/{key}", headers=self._auth(other)).status_code == 404
+
     # ── highlights ────────────────────────────────────────────────────────────
 
     def test_highlights_structure(self):
@@ -585,11 +770,496 @@ class TestAnalyticsV3:
         assert d["fingerprint_shift"] == "Stable"
         assert d["metrics"] is not None
 
+    def test_recent_changes_window_values(self):
+        register(username="windows", email="windows@x.com")
+        token = login("windows")["access_token"]
+        loud = seed_track(title="Loud", artist="Band A", genre="rock", energy=0.9, valence=0.3)
+        soft = seed_track(title="Soft", artist="Band B", genre="folk", energy=0.2, valence=0.8)
+        for days_ago in (40, 45):
+            seed_event(token, loud, days_ago=days_ago)
+        seed_event(token, soft, days_ago=50)
+        for days_ago in (3, 4):
+            seed_event(token, soft, days_ago=days_ago)
+        seed_event(token, loud, days_ago=5)
+        r = client.get("/api/v1/analytics/changes/recent",
+                       headers={"Authorization": f"Bearer {token}"})
+        m = {x["metric"]: x for x in r.json()["metrics"]}
+        assert (m["total_events"]["previous"], m["total_events"]["recent"]) == (3, 3)
+        assert m["avg_energy"]["previous"] == pytest.approx(0.6667, abs=1e-4)
+        assert m["novelty_ratio"]["recent"] == pytest.approx(0.6667, abs=1e-4)
+        assert (m["top_artist"]["previous"], m["top_artist"]["recent"]) == ("Band A", "Band B")
+        assert (m["top_genre"]["previous"], m["top_genre"]["recent"]) == ("rock", "folk")
+        assert (m["dominant_mood"]["previous"], m["dominant_mood"]["recent"]) == ("intense", "calm")
+
+    def test_window_metrics_match_python_aggregation(self):
+        import random
+        import statistics
+        from collections import Counter
+        from app.models import ListeningEvent, Track, User
+        from app.services import hybrid
+        from app.services.fingerprint import mood_label
+        register(username="sqlagg", email="sqlagg@x.com")
+        rnd = random.Random(4)
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with db_session() as db:
+            user_id = db.query(User.id).filter(User.username == "sqlagg").scalar()
+            tracks = [Track(title=f"W{i}", artist=rnd.choice(["X", "Y", "Z", ""]),
+                            genre=rnd.choice(["rock", "jazz", None]),
+                            energy=rnd.choice([None, round(rnd.random(), 2)]),
+                            valence=round(rnd.random(), 2)) for i in range(12)]
+            db.add_all(tracks)
+            db.flush()
+            db.add_all([ListeningEvent(user_id=user_id, track_id=rnd.choice(tracks).id,
+                                       listened_at=now - timedelta(hours=rnd.randint(1, 24 * 20)))
+                        for _ in range(150)])
+            db.commit()
+            start, end = now - timedelta(days=21), now
+
+            # The per-event loop recent_changes used before aggregating in SQL.
+            events = (db.query(ListeningEvent)
+                      .filter(ListeningEvent.user_id == user_id,
+                              ListeningEvent.listened_at >= start, ListeningEvent.listened_at <= end)
+                      .order_by(ListeningEvent.listened_at).all())
+            by_id = {t.id: t for t in tracks}
+            energies, valences, genres, artists, moods = [], [], [], [], []
+            for e in events:
+                t = by_id[e.track_id]
+                if t.energy is not None:
+                    energies.append(t.energy)
+                if t.valence is not None:
+                    valences.append(t.valence)
+                if t.genre:
+                    genres.append(t.genre)
+                if t.artist:
+                    artists.append(t.artist)
+                if t.energy is not None and t.valence is not None:
+                    moods.append(mood_label(t.energy, t.valence))
+            expected = {
+                "total_events": len(events),
+                "avg_energy": round(statistics.mean(energies), 4),
+                "avg_valence": round(statistics.mean(valences), 4),
+                "novelty_ratio": round(len({e.track_id for e in events}) / len(events), 4),
+                "dominant_mood": Counter(moods).most_common(1)[0][0],
+                "top_artist": Counter(artists).most_common(1)[0][0],
+                "top_genre": Counter(genres).most_common(1)[0][0],
+            }
+            got = hybrid._window_metrics(db, user_id, start, end)
+        for key in ("avg_energy", "avg_valence"):
+            assert got.pop(key) == pytest.approx(expected.pop(key), abs=1e-4)
+        assert got == expected
+
+    def test_recent_changes_one_scan_per_window(self):
+        from sqlalchemy import event
+        register(username="onescan", email="onescan@x.com")
+        token = login("onescan")["access_token"]
+        a = seed_track(title="A", artist="Tie 1", genre="rock", energy=0.9, valence=0.9)
+        b = seed_track(title="B", artist="Tie 2", genre="rock", energy=0.9, valence=0.9)
+        seed_event(token, b, days_ago=6)
+        seed_event(token, a, days_ago=5)
+        statements = []
+
+        def listener(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(ENGINE, "before_cursor_execute", listener)
+        try:
+            r = client.get("/api/v1/analytics/changes/recent",
+                           headers={"Authorization": f"Bearer {token}"})
+        finally:
+            event.remove(ENGINE, "before_cursor_execute", listener)
+        m = {x["metric"]: x for x in r.json()["metrics"]}
+        assert m["top_artist"]["recent"] == "Tie 2"  # tie goes to the earlier listen
+        assert m["dominant_mood"]["recent"] == "happy"
+        assert sum("JOIN listening_events" in sql for sql in statements) == 2
+
     def test_overview_requires_auth(self):
         r = client.get("/api/v1/analytics/overview")
         assert r.status_code == 401
 
 
+class TestListeningEventPagination:
+    def test_cursor_walks_history_newest_first(self):
+        from app.models import ListeningEvent
+        register()
+        token = login()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        tid = seed_track()
+        for days in (1, 2, 3):
+            seed_event(token, tid, days_ago=days)
+        same_time = datetime(2024, 1, 1, 12, 0)
+        with db_session() as db:
+            user_id = db.query(ListeningEvent.user_id).first()[0]
+            db.add_all([ListeningEvent(user_id=user_id, track_id=tid, listened_at=same_time)
+                        for _ in range(4)])
+            db.commit()
+
+        ids, cursor = [], None
+        while True:
+            url = "/api/v1/listening-events?limit=2&include_total=false"
+            d = client.get(url + (f"&cursor={cursor}" if cursor else ""), headers=headers).json()
+            assert d["total"] is None
+            ids += [e["id"] for e in d["items"]]
+            cursor = d["next_cursor"]
+            if cursor is None:
+                break
+        everything = client.get("/api/v1/listening-events?limit=100", headers=headers).json()
+        assert everything["total"] == 7 and everything["next_cursor"] is None
+        assert ids == [e["id"] for e in everything["items"]]
+
+    def test_catalog_cursor_is_rejected(self):
+        register()
+        headers = {"Authorization": f"Bearer {login()['access_token']}"}
+        seed_catalog_track(name="A", external_id="a")
+        seed_catalog_track(name="B", external_id="b")
+        cursor = client.get("/api/v1/catalog?limit=1", headers=headers).json()["next_cursor"]
+        r = client.get(f"/api/v1/listening-events?cursor={cursor}", headers=headers)
+        assert r.status_code == 400
+
+    def test_events_cursor_is_bound_to_date_range(self):
+        register()
+        token = login()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        tid = seed_track()
+        for days in (1, 2, 3):
+            seed_event(token, tid, days_ago=days)
+        url = "/api/v1/listening-events?limit=1&from=2000-01-01"
+        cursor = client.get(url, headers=headers).json()["next_cursor"]
+        assert client.get(f"{url}&cursor={cursor}", headers=headers).status_code == 200
+        r = client.get(f"/api/v1/listening-events?limit=1&cursor={cursor}", headers=headers)
+        assert r.status_code == 400
+
+
+class TestEventBatch:
+    def _auth(self):
+        user_id = register()["id"]
+        token = login()["access_token"]
+        return user_id, {"Authorization": f"Bearer {token}"}
+
+    def test_batch_reports_each_item(self):
+        from app.models import FingerprintState
+        _, headers = self._auth()
+        tid = seed_track()
+        client.get("/api/v1/analytics/fingerprint", headers=headers)  # start incremental state
+        at = "2024-03-01T10:00:00"
+        events = [{"track_id": tid, "listened_at": at}, {"track_id": 999},
+                  {"track_id": tid, "listened_at": at}, {"track_id": tid, "duration_listened_ms": 5}]
+        r = client.post("/api/v1/listening-events/batch", json={"events": events}, headers=headers)
+        assert r.status_code == 200, r.text
+        d = r.json()
+        assert (d["created"], d["rejected"]) == (3, 1)
+        assert [i["status"] for i in d["items"]] == ["created", "rejected", "created", "created"]
+        assert d["items"][1]["error"] == "Track not found"
+
+        listed = {e["id"]: e for e in client.get("/api/v1/listening-events", headers=headers).json()["items"]}
+        created = [d["items"][i]["id"] for i in (0, 2, 3)]
+        assert sorted(listed) == sorted(created)
+        assert listed[created[2]]["duration_listened_ms"] == 5
+        with db_session() as db:
+            assert db.query(FingerprintState).one().total_events == 3
+
+    def test_batch_is_one_lookup_and_one_insert(self):
+        from sqlalchemy import event
+        _, headers = self._auth()
+        tids = [seed_track(title=f"T{i}") for i in range(3)]
+        events = [{"track_id": tids[i % 3]} for i in range(300)]
+        statements = []
+        listener = lambda conn, cursor, sql, *args: statements.append(sql)  # noqa: E731
+        event.listen(ENGINE, "before_cursor_execute", listener)
+        try:
+            r = client.post("/api/v1/listening-events/batch", json={"events": events}, headers=headers)
+        finally:
+            event.remove(ENGINE, "before_cursor_execute", listener)
+        assert r.json()["created"] == 300
+        assert len({i["id"] for i in r.json()["items"]}) == 300
+        assert sum(sql.startswith("INSERT INTO listening_events") for sql in statements) == 1
+        assert sum("FROM tracks" in sql for sql in statements) == 2  # validation + stream payloads
+
+    def test_batch_ids_follow_submission_order(self):
+        _, headers = self._auth()
+        tids = [seed_track(title=f"T{i}") for i in range(2)]
+        # Identical plays, then descending times, so content cannot tell rows apart.
+        events = [{"track_id": tids[0], "listened_at": "2024-03-01T10:00:00+02:00"}] * 3
+        events += [{"track_id": tids[i % 2], "duration_listened_ms": i,
+                    "listened_at": f"2024-03-0{9 - i}T10:00:00"} for i in range(6)]
+        r = client.post("/api/v1/listening-events/batch", json={"events": events}, headers=headers)
+        ids = [item["id"] for item in r.json()["items"]]
+        assert None not in ids and len(set(ids)) == len(events)
+        for item, sent in zip(r.json()["items"][3:], events[3:]):
+            got = client.get(f"/api/v1/listening-events/{item['id']}", headers=headers).json()
+            assert (got["track_id"], got["duration_listened_ms"]) == (sent["track_id"],
+                                                                      sent["duration_listened_ms"])
+
+    def test_batch_ids_follow_submission_order_across_insert_pages(self):
+        from app.models import ListeningEvent
+        _, headers = self._auth()
+        tid = seed_track()
+        # More rows than one INSERT statement carries (insertmanyvalues pages).
+        events = [{"track_id": tid, "duration_listened_ms": i} for i in range(2500)]
+        r = client.post("/api/v1/listening-events/batch", json={"events": events}, headers=headers)
+        ids = [item["id"] for item in r.json()["items"]]
+        with db_session() as db:
+            durations = dict(db.query(ListeningEvent.id, ListeningEvent.duration_listened_ms))
+        assert [durations[i] for i in ids] == list(range(2500))
+
+    def test_batch_publishes_one_stream_message(self):
+        import asyncio
+        from app.services import event_stream
+        user_id, headers = self._auth()
+        tid = seed_track()
+
+        async def run():
+            subscription = event_stream.subscribe(user_id)
+            try:
+                await asyncio.to_thread(client.post, "/api/v1/listening-events/batch",
+                                        json={"events": [{"track_id": tid}] * 4}, headers=headers)
+                return await subscription.get(timeout=2), await subscription.get(timeout=0.05)
+            finally:
+                event_stream.unsubscribe(subscription)
+
+        batch, nothing_more = asyncio.run(run())
+        assert len(batch) == 4 and nothing_more == []
+
+    def test_batch_size_is_bounded(self):
+        _, headers = self._auth()
+        r = client.post("/api/v1/listening-events/batch", json={"events": []}, headers=headers)
+        assert r.status_code == 422
+        r = client.post("/api/v1/listening-events/batch",
+                        json={"events": [{"track_id": 1}] * 5001}, headers=headers)
+        assert r.status_code == 422
+
+
+class TestHistoryExport:
+    def _history(self):
+        register()
+        token = login()["access_token"]
+        tids = [seed_track(title=f"Song {i}", artist=f"Artist {i}", genre="jazz") for i in range(2)]
+        for days, tid in ((3, tids[0]), (1, tids[1]), (2, tids[0])):
+            seed_event(token, tid, days_ago=days)
+        return {"Authorization": f"Bearer {token}"}
+
+    def test_ndjson_export_streams_history_with_tracks(self):
+        import json
+        headers = self._history()
+        r = client.get("/api/v1/listening-events/export", headers=headers)
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in r.text.splitlines()]
+        assert [row["title"] for row in rows] == ["Song 0", "Song 0", "Song 1"]
+        assert rows[0]["listened_at"] < rows[1]["listened_at"] < rows[2]["listened_at"]
+        assert rows[0]["genre"] == "jazz" and rows[0]["duration_listened_ms"] == 200000
+
+    def test_csv_export_has_header_and_filters(self):
+        import csv
+        import io
+        headers = self._history()
+        since = (datetime.now(timezone.utc) - timedelta(days=2, hours=1)).isoformat()
+        r = client.get("/api/v1/listening-events/export", params={"format": "csv", "from": since},
+                       headers=headers)
+        assert r.headers["content-type"].startswith("text/csv")
+        assert "listening-history.csv" in r.headers["content-disposition"]
+        rows = list(csv.DictReader(io.StringIO(r.text)))
+        assert [row["artist"] for row in rows] == ["Artist 0", "Artist 1"]
+
+    def test_export_is_written_in_batches(self, monkeypatch):
+        from app.models import User
+        from app.services import history_export
+        headers = self._history()
+        monkeypatch.setattr(history_export, "EXPORT_BATCH", 2)
+        with db_session() as db:
+            user_id = db.query(User).one().id
+        chunks = list(history_export.export(ENGINE, user_id, "ndjson"))
+        assert [chunk.count("\n") for chunk in chunks] == [2, 1]
+        assert client.get("/api/v1/listening-events/export?format=xml", headers=headers).status_code == 422
+
+
+class TestEventStreamHub:
+    @pytest.fixture(autouse=True)
+    def fresh_hub(self, monkeypatch):
+        from app.services import event_stream
+        hub = event_stream.Hub()
+        monkeypatch.setattr(event_stream, "hub", hub)
+        monkeypatch.setattr(event_stream, "_broker", event_stream.LocalBroker(hub))
+        return hub
+
+    def test_create_event_pushes_to_subscriber(self):
+        import asyncio
+        from app.services import event_stream
+        user_id = register()["id"]
+        token = login()["access_token"]
+        tid = seed_track(title="Pushed")
+
+        async def run():
+            subscription = event_stream.subscribe(user_id)
+            try:
+                created = await asyncio.to_thread(seed_event, token, tid, 1)
+                return created, await subscription.get(timeout=2)
+            finally:
+                event_stream.unsubscribe(subscription)
+
+        created, batch = asyncio.run(run())
+        assert [(p["event_id"], p["track_title"]) for p in batch] == [(created["id"], "Pushed")]
+        assert event_stream.hub.subscriber_count() == 0
+
+    def test_bulk_writer_publishes_one_batch_per_chunk(self):
+        import asyncio
+        from app.services import event_stream
+        from app.services.event_writer import write_events
+        user_id = register()["id"]
+        tid = seed_track(title="Bulk")
+        rows = [{"user_id": user_id, "track_id": tid, "duration_listened_ms": 1000, "source": "test",
+                 "listened_at": datetime(2024, 1, 1) + timedelta(minutes=i)} for i in range(5)]
+
+        async def run():
+            subscription = event_stream.subscribe(user_id)
+            try:
+                with db_session() as db:
+                    await asyncio.to_thread(write_events, db, rows, chunk_size=2)
+                return [await subscription.get(timeout=2) for _ in range(3)]
+            finally:
+                event_stream.unsubscribe(subscription)
+
+        batches = asyncio.run(run())
+        assert [len(b) for b in batches] == [2, 2, 1]
+        ids = [p["event_id"] for b in batches for p in b]
+        assert ids == sorted(ids) and all(p["track_title"] == "Bulk" for b in batches for p in b)
+
+    def test_slow_subscriber_is_dropped_instead_of_blocking(self):
+        import asyncio
+        from app.services.event_stream import Hub, SubscriberOverflow
+
+        async def run():
+            hub = Hub(queue_size=2)
+            subscription = hub.subscribe(7)
+            for i in range(3):
+                hub.deliver(7, [{"event_id": i}])
+            await asyncio.sleep(0)
+            with pytest.raises(SubscriberOverflow):
+                await subscription.get(timeout=1)
+            return await subscription.get(timeout=0.01)
+
+        assert asyncio.run(run()) == []
+
+    @staticmethod
+    def _open_stream(monkeypatch, user_id, **resume):
+        """Start the SSE endpoint's body generator directly (TestClient buffers whole bodies)."""
+        import json
+        from types import SimpleNamespace
+        import app.database
+        from app.routes.events import stream_events
+        monkeypatch.setattr(app.database, "SessionLocal", TestSession)
+
+        async def open_():
+            response = await stream_events(last_event_id=resume.get("last_event_id"),
+                                           resume_after=resume.get("resume_after"),
+                                           user=SimpleNamespace(id=user_id))
+            return response.body_iterator
+
+        async def next_frame(body):
+            lines = (await body.__anext__()).strip().splitlines()
+            fields = dict(line.split(": ", 1) for line in lines)
+            return fields.get("id"), fields["event"], json.loads(fields["data"])
+
+        return open_, next_frame
+
+    def test_reconnect_with_last_event_id_replays_from_buffer(self, monkeypatch):
+        import asyncio
+        from sqlalchemy import event
+        user_id = register()["id"]
+        token = login()["access_token"]
+        tid = seed_track()
+        open_, next_frame = self._open_stream(monkeypatch, user_id)
+
+        async def first_session():
+            body = await open_()
+            connected = await next_frame(body)
+            created = await asyncio.to_thread(seed_event, token, tid, 1)
+            frame = await next_frame(body)
+            await body.aclose()
+            return connected, created, frame
+
+        connected, created, frame = asyncio.run(first_session())
+        assert connected[1] == "connected" and connected[2]["resumed"] is False
+        assert frame[:2] == (str(created["id"]), "new_event")
+        missed = [seed_event(token, tid, 1)["id"] for _ in range(2)]  # while disconnected
+
+        resume_open, _ = self._open_stream(monkeypatch, user_id, last_event_id=created["id"])
+        statements = []
+        listener = lambda conn, cursor, sql, *args: statements.append(sql)  # noqa: E731
+
+        async def reconnect():
+            body = await resume_open()
+            frames = [await next_frame(body) for _ in range(3)]
+            await body.aclose()
+            return frames
+
+        event.listen(ENGINE, "before_cursor_execute", listener)
+        try:
+            connected, *replayed = asyncio.run(reconnect())
+        finally:
+            event.remove(ENGINE, "before_cursor_execute", listener)
+        assert connected[2]["resumed"] is True and connected[2]["last_seen_id"] == created["id"]
+        assert [(int(i), name) for i, name, _ in replayed] == [(m, "new_event") for m in missed]
+        assert statements == []
+
+    def test_resume_reads_database_when_buffer_is_cold(self, monkeypatch):
+        import asyncio
+        user_id = register()["id"]
+        token = login()["access_token"]
+        tid = seed_track()
+        ids = [seed_event(token, tid, days)["id"] for days in (3, 2, 1)]
+        open_, next_frame = self._open_stream(monkeypatch, user_id, resume_after=ids[0])
+
+        async def run():
+            body = await open_()
+            frames = [await next_frame(body) for _ in range(3)]
+            await body.aclose()
+            return frames
+
+        connected, *replayed = asyncio.run(run())
+        assert connected[2]["resumed"] is True
+        assert [int(i) for i, _, _ in replayed] == ids[1:]
+
+    def test_resume_too_far_behind_asks_for_resync(self, monkeypatch, fresh_hub):
+        import asyncio
+        user_id = register()["id"]
+        token = login()["access_token"]
+        tid = seed_track()
+        ids = [seed_event(token, tid, days)["id"] for days in (4, 3, 2, 1)]
+        fresh_hub.replay_size = 2
+        open_, next_frame = self._open_stream(monkeypatch, user_id, resume_after=ids[0])
+
+        async def run():
+            body = await open_()
+            frames = [await next_frame(body) for _ in range(2)]
+            await body.aclose()
+            return frames
+
+        connected, resync = asyncio.run(run())
+        assert connected[0] == str(ids[-1]) and connected[2]["resumed"] is False
+        assert resync[1] == "resync" and resync[2]["last_event_id"] == ids[0]
+
+    def test_sqlite_broker_fans_out_across_workers(self, tmp_path):
+        import asyncio
+        from app.services.event_stream import Hub, SQLiteBroker
+        path = str(tmp_path / "broker.sqlite3")
+        publisher = SQLiteBroker(Hub(), path, poll_interval=0.02)
+        receiving_hub = Hub()
+        receiver = SQLiteBroker(receiving_hub, path, poll_interval=0.02)
+
+        async def run():
+            receiver.start()
+            subscription = receiving_hub.subscribe(3)
+            publisher.publish(3, [{"event_id": 1}])
+            publisher.publish(4, [{"event_id": 2}])
+            return await subscription.get(timeout=2)
+
+        try:
+            assert asyncio.run(run()) == [{"event_id": 1}]
+        finally:
+            publisher.close()
+            receiver.close()
+
+
 # ── Catalog endpoints — entirely untested ─────────────────────────────────────
 
 class TestCatalogSearch:
@@ -674,6 +1344,107 @@ class TestCatalogSearch:
                        headers=self._auth())
         assert r.status_code == 422
 
+    def test_search_ranks_and_tolerates_typos(self):
+        seed_catalog_track(name="Beat It", artist="Michael Jackson", external_id="fts-1")
+        seed_catalog_track(name="Yesterday", artist="The Beatles", external_id="fts-2")
+        seed_catalog_track(name="Here Comes the Sun", artist="The Beatles", external_id="fts-3")
+        headers = self._auth()
+        d = client.get("/api/v1/catalog?q=beatles", headers=headers).json()
+        assert (d["total"], d["fuzzy"]) == (2, False)
+        assert {i["artist"] for i in d["items"]} == {"The Beatles"}
+
+        d = client.get("/api/v1/catalog?q=beatels", headers=headers).json()
+        assert d["fuzzy"] is True
+        assert [i["artist"] for i in d["items"][:2]] == ["The Beatles", "The Beatles"]
+        assert client.get("/api/v1/catalog?q=zzzzqx", headers=headers).json()["total"] == 0
+
+    def test_search_index_follows_catalog_writes(self):
+        from app.models import CatalogTrack
+        track_id = seed_catalog_track(name="Original Title", external_id="fts-sync")
+        with db_session() as db:
+            db.get(CatalogTrack, track_id).name = "Renamed Anthem"
+            db.commit()
+        headers = self._auth()
+        assert client.get("/api/v1/catalog?q=Original", headers=headers).json()["total"] == 0
+        assert client.get("/api/v1/catalog?q=anthem", headers=headers).json()["total"] == 1
+        with db_session() as db:
+            db.delete(db.get(CatalogTrack, track_id))
+            db.commit()
+        assert client.get("/api/v1/catalog?q=anthem", headers=headers).json()["total"] == 0
+
+    def test_bulk_catalog_import_is_searchable(self, tmp_path):
+        from app.services.catalog_import import import_catalog_tracks
+        path = tmp_path / "catalog.csv"
+        path.write_text(TestCatalogStreamingImport.CSV)
+        with db_session() as db:
+            import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=str(path), chunk_size=2)
+        d = client.get("/api/v1/catalog?q=duo", headers=self._auth()).json()
+        assert sorted(i["name"] for i in d["items"]) == ["Song Five", "Song Four"]
+
+    def test_search_without_trigram_tokenizer_falls_back_to_ilike(self, monkeypatch, caplog):
+        from app.services import catalog_search
+        # SQLite builds before 3.34 reject the tokenizer the same way.
+        monkeypatch.setattr(catalog_search, "FTS_TOKENIZER", "no_such_tokenizer")
+        Base.metadata.drop_all(bind=ENGINE)
+        with caplog.at_level("WARNING", logger=catalog_search.__name__):
+            Base.metadata.create_all(bind=ENGINE)
+            catalog_search.ensure_index(ENGINE)
+        assert "no such tokenizer" in caplog.text
+
+        seed_catalog_track(name="Yesterday", artist="The Beatles", external_id="ilike-1")
+        seed_catalog_track(name="Beat It", artist="Michael Jackson", external_id="ilike-2")
+        headers = self._auth()
+        d = client.get("/api/v1/catalog?q=beatles", headers=headers).json()
+        assert (d["total"], d["fuzzy"]) == (1, False)
+        assert d["items"][0]["name"] == "Yesterday"
+        assert client.get("/api/v1/catalog?q=beatels", headers=headers).json()["total"] == 0
+
+    def test_short_query_falls_back_to_substring_scan(self):
+        self._populate(3)
+        d = client.get("/api/v1/catalog?q=g 1", headers=self._auth()).json()
+        assert [i["name"] for i in d["items"]] == ["Song 1"]
+
+    def _walk(self, url, headers):
+        names, cursor = [], None
+        while True:
+            d = client.get(url + (f"&cursor={cursor}" if cursor else ""), headers=headers).json()
+            names += [i["name"] for i in d["items"]]
+            cursor = d["next_cursor"]
+            if cursor is None:
+                return names
+
+    def test_cursor_pagination_walks_every_track_once(self):
+        self._populate(7)
+        seed_catalog_track(name="Song 3", artist="Cover Band", external_id="ext-dup")
+        headers = self._auth()
+        names = self._walk("/api/v1/catalog?limit=3&include_total=false", headers)
+        assert names == sorted(names) and len(names) == 8
+        ranked = self._walk("/api/v1/catalog?q=band&limit=2", headers)
+        assert sorted(ranked) == sorted(names)
+
+    def test_include_total_false_skips_count(self):
+        self._populate(3)
+        d = client.get("/api/v1/catalog?limit=2&include_total=false", headers=self._auth()).json()
+        assert d["total"] is None and len(d["items"]) == 2 and d["next_cursor"]
+
+    def test_cursor_from_another_query_is_rejected(self):
+        self._populate(3)
+        headers = self._auth()
+        cursor = client.get("/api/v1/catalog?q=band&limit=1", headers=headers).json()["next_cursor"]
+        assert client.get(f"/api/v1/catalog?q=song&cursor={cursor}", headers=headers).status_code == 400
+        assert client.get("/api/v1/catalog?cursor=garbage", headers=headers).status_code == 400
+
+    def test_cursor_is_bound_to_every_filter(self):
+        self._populate(5)
+        headers = self._auth()
+        url = "/api/v1/catalog?genre=o&min_energy=0.2&limit=1"
+        cursor = client.get(url, headers=headers).json()["next_cursor"]
+        assert client.get(f"{url}&cursor={cursor}", headers=headers).status_code == 200
+        for other in ("genre=o&min_energy=0.5", "genre=rock&min_energy=0.2",
+                      "genre=o&min_energy=0.2&max_valence=0.5"):
+            r = client.get(f"/api/v1/catalog?{other}&limit=1&cursor={cursor}", headers=headers)
+            assert r.status_code == 400, other
+
 
 class TestCatalogGetById:
     def _auth(self):
@@ -763,6 +1534,323 @@ class TestCatalogSimilarTracks:
         for item in r.json()["results"]:
             assert item["genre"] and "jazz" in item["genre"].lower()
 
+    def test_similar_tracks_ranked_by_cosine_similarity(self):
+        from app.services.similarity import cosine_similarity, to_vector
+        from app.models import CatalogTrack
+        seed_id = self._populate_similar()
+        seed_catalog_track(name="Far Away", energy=0.05, valence=0.95,
+                           danceability=0.1, acousticness=0.9, tempo=60.0,
+                           external_id="far-away")
+        r = client.get(f"/api/v1/catalog/{seed_id}/similar?limit=10",
+                       headers=self._auth())
+        results = r.json()["results"]
+        with db_session() as db:
+            seed = db.get(CatalogTrack, seed_id)
+            expected = sorted(
+                (round(cosine_similarity(to_vector(seed), to_vector(t)), 4), t.id)
+                for t in db.query(CatalogTrack).filter(CatalogTrack.id != seed_id)
+            )
+        assert [item["id"] for item in results] == [
+            tid for _, tid in sorted(expected, key=lambda x: (-x[0], x[1]))
+        ]
+        assert results[-1]["name"] == "Far Away"
+
+    def test_top_k_breaks_ties_at_the_cutoff_by_id(self):
+        import numpy as np
+        from app.services.similarity.matrix import rank_top_k
+        rng = np.random.default_rng(7)
+        rows = rng.permutation(200).astype(np.int64)
+        scores = np.full(200, 0.5, dtype=np.float32)
+        scores[rows >= 190] = 0.9
+        for k in (1, 5, 12, 40):
+            top, top_scores = rank_top_k(rows, scores, k)
+            expected = sorted(range(200), key=lambda r: (-(0.9 if r >= 190 else 0.5), r))[:k]
+            assert list(top) == expected and len(top_scores) == k
+
+    def test_similar_tracks_sees_catalog_changes(self):
+        seed_id = self._populate_similar()
+        headers = self._auth()
+        first = client.get(f"/api/v1/catalog/{seed_id}/similar", headers=headers)
+        assert len(first.json()["results"]) == 5
+        twin_id = seed_catalog_track(name="Twin", energy=0.7, valence=0.6,
+                                     external_id="similar-twin")
+        second = client.get(f"/api/v1/catalog/{seed_id}/similar", headers=headers)
+        assert second.json()["results"][0]["id"] == twin_id
+
+
+class TestCatalogANNIndex:
+    def _auth(self):
+        register(username="annuser", email="ann@x.com")
+        return {"Authorization": f"Bearer {login('annuser')['access_token']}"}
+
+    def _matrix(self, rows=5000, start_id=1):
+        import numpy as np
+        from app.services.similarity.matrix import CatalogMatrix
+        rng = np.random.default_rng(start_id)
+        features = rng.random((rows, 8), dtype=np.float32)
+        features[:, 7] *= 200.0
+        return CatalogMatrix(np.arange(start_id, start_id + rows), features,
+                             np.full(rows, -1, dtype=np.int32), [])
+
+    def test_ivf_recall_against_exact(self):
+        from app.services.similarity.ann import IVFIndex, recall_at_k
+        matrix = self._matrix()
+        index = IVFIndex.build(matrix)
+        assert recall_at_k(index, matrix, matrix.vectors[:50], k=10) >= 0.9
+
+    def test_ivf_persist_load_and_incremental_insert(self, tmp_path):
+        import numpy as np
+        from app.services.similarity import ann as ann_index
+        from app.services.similarity.matrix import CatalogMatrix
+        matrix = self._matrix(rows=2000)
+        path = str(tmp_path / "index.npz")
+        ann_index.IVFIndex.build(matrix).save(path)
+
+        loaded = ann_index.load(path)
+        assert sorted(loaded.indexed_ids()) == list(matrix.ids)
+
+        extra = self._matrix(rows=10, start_id=5000)
+        grown = CatalogMatrix(np.concatenate([matrix.ids, extra.ids]),
+                              np.concatenate([matrix.features, extra.features]),
+                              np.full(2010, -1, dtype=np.int32), [], token="v2")
+        loaded.sync(grown)
+        assert loaded.token == "v2"
+        rows, _ = loaded.search(grown, list(grown.vectors[-1]), 1)
+        assert grown.ids[rows[0]] == 5009
+
+    def test_ivf_sync_moves_edited_and_drops_deleted_rows(self):
+        import numpy as np
+        from app.services.similarity.ann import IVFIndex, VectorIndex, _nearest_centroid
+        from app.services.similarity.matrix import CatalogMatrix
+        with pytest.raises(TypeError):
+            VectorIndex(np.empty(0), np.empty((0, 8)))
+        matrix = self._matrix(rows=2000)
+        index = IVFIndex.build(matrix)
+
+        keep = matrix.ids != 5
+        features = matrix.features[keep].copy()
+        edited = int(np.flatnonzero(matrix.ids[keep] == 10)[0])
+        features[edited] = [0.9, 0.05, 0.9, 0.05, 0.9, 0.05, 0.9, 20.0]
+        changed = CatalogMatrix(matrix.ids[keep], features,
+                                np.full(len(features), -1, dtype=np.int32), [], token="v2")
+        index.sync(changed)
+
+        assert 5 not in index.indexed_ids()
+        assert len(index.indexed_ids()) == 1999
+        pos = int(np.searchsorted(index.ids, 10))
+        assert np.array_equal(index.vectors[pos], changed.unit[edited])
+        assert index.cells[pos] == _nearest_centroid(changed.unit[edited:edited + 1], index.centroids)[0]
+        rows, _ = index.search(changed, list(changed.vectors[edited]), 5, nprobe=1)
+        assert 10 in changed.ids[rows]
+
+    def test_index_saved_off_request_path(self, monkeypatch, tmp_path):
+        from app.config import settings
+        from app.services.similarity import ann as ann_index
+        monkeypatch.setattr(settings, "ANN_MIN_ROWS", 1)
+        path = str(tmp_path / "index.npz")
+        monkeypatch.setitem(ann_index._paths, id(ENGINE), path)
+        seed_id = seed_catalog_track(name="Saved Seed", external_id="ann-saved")
+        seed_catalog_track(name="Saved Other", energy=0.2, external_id="ann-saved-2")
+        r = client.get(f"/api/v1/catalog/{seed_id}/similar?limit=1", headers=self._auth())
+        assert r.status_code == 200
+        ann_index.shutdown()
+        assert seed_id in ann_index.load(path).indexed_ids()
+
+    def test_similar_tracks_exact_switch(self, monkeypatch):
+        from app.config import settings
+        monkeypatch.setattr(settings, "ANN_MIN_ROWS", 1)
+        seed_id = seed_catalog_track(name="ANN Seed", external_id="ann-seed")
+        for i in range(6):
+            seed_catalog_track(name=f"ANN {i}", energy=0.3 + i * 0.1,
+                               external_id=f"ann-{i}")
+        headers = self._auth()
+        approx = client.get(f"/api/v1/catalog/{seed_id}/similar?limit=3", headers=headers).json()
+        exact = client.get(f"/api/v1/catalog/{seed_id}/similar?limit=3&exact=true",
+                           headers=headers).json()
+        assert approx["algorithm"].startswith("ivf-approximate-")
+        assert exact["algorithm"] == "cosine-similarity-8d-audio-features"
+        assert [t["id"] for t in approx["results"]] == [t["id"] for t in exact["results"]]
+
+    def test_recommend_by_mood_exact_switch(self, monkeypatch):
+        from app.config import settings
+        monkeypatch.setattr(settings, "ANN_MIN_ROWS", 1)
+        for i in range(6):
+            seed_catalog_track(name=f"Happy {i}", energy=0.8, valence=0.7 + i * 0.04,
+                               external_id=f"happy-{i}")
+        headers = self._auth()
+        body = {"description": "happy party vibes", "limit": 3}
+        approx = client.post("/api/v1/catalog/recommend-by-mood", json=body, headers=headers)
+        exact = client.post("/api/v1/catalog/recommend-by-mood?exact=true", json=body,
+                            headers=headers)
+        assert approx.status_code == exact.status_code == 200
+        assert approx.json()["total_candidates"] == exact.json()["total_candidates"] == 6
+        assert len(approx.json()["results"]) == 3
+
+
+class TestCatalogStreamingImport:
+    CSV = (
+        "track_id,track_name,artist_name,track_genre,energy,valence,tempo\n"
+        "a1,Song One,Band,rock,0.8,0.6,120\n"
+        "a2,Song Two,Band,rock,not-a-number,0.4,98\n"
+        "a1,Song One (dupe),Band,rock,0.1,0.1,80\n"
+        ",Loose Song,Solo,,0.3,0.2,\n"
+        "a3,,Nameless,pop,0.5,0.5,100\n"
+        "a4,Song Four,Duo,jazz,0.2,0.9,70\n"
+        "a5,Song Five,Duo,jazz,0.6,0.7,110\n"
+    )
+
+    def _csv(self, tmp_path):
+        path = tmp_path / "catalog.csv"
+        path.write_text(self.CSV)
+        return str(path)
+
+    def test_chunked_import_normalises_and_deduplicates(self, tmp_path):
+        from app.models import CatalogTrack
+        from app.services import catalog_state
+        from app.services.catalog_import import import_catalog_tracks
+        path = self._csv(tmp_path)
+        with db_session() as db:
+            result = import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=path, chunk_size=2)
+            assert (result["inserted"], result["updated"], result["total_rows"]) == (5, 0, 7)
+            assert result["rows_per_second"] > 0
+            token = catalog_state.current_token(db)
+            assert token is not None
+            one = db.query(CatalogTrack).filter_by(external_id="a1").one()
+            assert (one.name, one.artist, one.genre, one.energy) == ("Song One", "Band", "rock", 0.8)
+            assert db.query(CatalogTrack).filter_by(external_id="a2").one().energy is None
+            loose = db.query(CatalogTrack).filter_by(external_id="Loose Song::Solo").one()
+            assert (loose.genre, loose.tempo) == (None, None)
+
+            again = import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=path, chunk_size=3)
+            assert (again["inserted"], again["updated"], again["resumed_from"]) == (0, 5, 0)
+            assert db.query(CatalogTrack).count() == 5
+            assert catalog_state.current_token(db) != token
+
+    def test_interrupted_import_resumes_after_last_chunk(self, tmp_path, monkeypatch):
+        from app.models import CatalogTrack
+        from app.services import catalog_import
+        path = self._csv(tmp_path)
+        real_write = catalog_import._write_chunk
+        calls = []
+
+        def flaky_write(connection, rows):
+            calls.append([row["external_id"] for row in rows])
+            if len(calls) == 2:
+                raise RuntimeError("connection lost")
+            return real_write(connection, rows)
+
+        monkeypatch.setattr(catalog_import, "_write_chunk", flaky_write)
+        with db_session() as db:
+            with pytest.raises(RuntimeError):
+                catalog_import.import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=path, chunk_size=3)
+            db.rollback()
+            assert db.query(CatalogTrack).count() == 2
+
+            result = catalog_import.import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=path, chunk_size=3)
+            assert result["resumed_from"] == 3
+            assert (result["inserted"], result["total_rows"]) == (5, 7)
+            assert calls[2][0] == "Loose Song::Solo"
+            assert db.query(CatalogTrack).count() == 5
+
+    def test_catalog_version_bumped_once_per_import(self, tmp_path, monkeypatch):
+        from app.services import catalog_import, catalog_state
+        bumps = []
+        real_bump = catalog_state.bump
+        monkeypatch.setattr(catalog_state, "bump", lambda connection: (bumps.append(1), real_bump(connection)))
+        with db_session() as db:
+            catalog_import.import_catalog_tracks(db, "test/catalog", "catalog.csv",
+                                                 csv_path=self._csv(tmp_path), chunk_size=2)
+        assert len(bumps) == 1
+
+    def test_interrupted_import_changes_catalog_etag(self, tmp_path, monkeypatch):
+        from app.services import catalog_import
+        register()
+        headers = {"Authorization": f"Bearer {login()['access_token']}"}
+        seed_catalog_track(name="Existing", external_id="existing")
+        first = client.get("/api/v1/catalog", headers=headers)
+        etag = first.headers["ETag"]
+        real_write = catalog_import._write_chunk
+        calls = []
+
+        def flaky_write(connection, rows):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("connection lost")
+            return real_write(connection, rows)
+
+        monkeypatch.setattr(catalog_import, "_write_chunk", flaky_write)
+        with db_session() as db:
+            with pytest.raises(RuntimeError):
+                catalog_import.import_catalog_tracks(db, "test/catalog", "catalog.csv",
+                                                     csv_path=self._csv(tmp_path), chunk_size=3)
+        changed = client.get("/api/v1/catalog", headers={**headers, "If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["ETag"] != etag
+        assert changed.json()["total"] == 3
+
+    def test_resumed_import_keeps_dropping_repeated_ids(self, tmp_path, monkeypatch):
+        from app.models import CatalogTrack
+        from app.services import catalog_import
+        path = self._csv(tmp_path)
+        real_write = catalog_import._write_chunk
+        calls = []
+
+        def flaky_write(connection, rows):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("connection lost")
+            return real_write(connection, rows)
+
+        monkeypatch.setattr(catalog_import, "_write_chunk", flaky_write)
+        with db_session() as db:
+            # The "a1" repeat sits in the second chunk, after the checkpoint.
+            with pytest.raises(RuntimeError):
+                catalog_import.import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=path, chunk_size=2)
+            db.rollback()
+
+            result = catalog_import.import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=path, chunk_size=2)
+            assert result["resumed_from"] == 2
+            assert (result["inserted"], result["updated"]) == (5, 0)
+            one = db.query(CatalogTrack).filter_by(external_id="a1").one()
+            assert (one.name, one.energy) == ("Song One", 0.8)
+
+    def test_import_writes_memory_mapped_snapshot(self, tmp_path, monkeypatch):
+        import numpy as np
+        from app.services import catalog_state
+        from app.services.catalog_import import import_catalog_tracks
+        from app.services.similarity import matrix as catalog_matrix
+        snapshot_dir = str(tmp_path / "snapshot")
+        monkeypatch.setitem(catalog_matrix._paths, id(ENGINE), snapshot_dir)
+        with db_session() as db:
+            import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=self._csv(tmp_path))
+            token = catalog_state.current_token(db)
+            # A fresh worker maps the snapshot instead of reading catalog_tracks.
+            catalog_matrix._matrices.pop(id(ENGINE), None)
+            mapped = catalog_matrix.get_catalog_matrix(db)
+            assert isinstance(mapped.unit, np.memmap) and not mapped.features.flags.writeable
+            assert mapped.token == token and mapped.genres == ["rock", "jazz"]
+            assert list(mapped.ids) == list(catalog_matrix.build_matrix(db).ids)
+
+        seed_catalog_track(name="Added Later", external_id="later")
+        with db_session() as db:
+            assert catalog_matrix.open_snapshot(snapshot_dir, catalog_state.current_token(db)) is None
+            rebuilt = catalog_matrix.get_catalog_matrix(db)
+            assert not isinstance(rebuilt.unit, np.memmap) and len(rebuilt) == 6
+
+    def test_catalog_analytics_served_from_snapshot(self, tmp_path, monkeypatch):
+        from app.services.catalog_import import import_catalog_tracks
+        from app.services.similarity import matrix as catalog_matrix
+        monkeypatch.setitem(catalog_matrix._paths, id(ENGINE), str(tmp_path / "snapshot"))
+        with db_session() as db:
+            import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=self._csv(tmp_path))
+        register(username="snapuser", email="snap@x.com")
+        headers = {"Authorization": f"Bearer {login('snapuser')['access_token']}"}
+        genres = client.get("/api/v1/catalog/genres", headers=headers).json()
+        assert {g["genre"]: g["track_count"] for g in genres["genres"]} == {"rock": 1, "jazz": 2}
+        mood = client.get("/api/v1/catalog/mood-map", headers=headers).json()
+        assert mood["total_tracks"] == 4
+        happy = next(q for q in mood["quadrants"] if q["mood"] == "Happy")
+        assert happy["example_tracks"] == ["Song One — Band", "Song Five — Duo"]
+
 
 class TestCatalogMoodMap:
     def _auth(self):
@@ -867,6 +1955,100 @@ class TestCatalogGenres:
         assert r.status_code == 401
 
 
+class TestCatalogStats:
+    def _auth(self):
+        register(username="statsuser", email="stats@x.com")
+        return {"Authorization": f"Bearer {login('statsuser')['access_token']}"}
+
+    def test_reports_are_materialized_and_versioned(self, monkeypatch):
+        from app.services import catalog_stats
+        for i in range(3):
+            seed_catalog_track(genre="pop", energy=0.7, valence=0.7, external_id=f"cs-{i}")
+        headers = self._auth()
+        first = client.get("/api/v1/catalog/genres", headers=headers).json()
+        assert first["catalog_version"] >= 1
+
+        def recompute(db, matrix):
+            raise AssertionError("report recomputed for an unchanged catalog")
+
+        monkeypatch.setitem(catalog_stats.REPORTS, catalog_stats.GENRES, recompute)
+        assert client.get("/api/v1/catalog/genres", headers=headers).json() == first
+
+    def test_catalog_change_rebuilds_report(self):
+        seed_catalog_track(genre="pop", energy=0.7, valence=0.7, external_id="cs-a")
+        headers = self._auth()
+        before = client.get("/api/v1/catalog/mood-map", headers=headers).json()
+        seed_catalog_track(genre="pop", energy=0.2, valence=0.2, external_id="cs-b")
+        after = client.get("/api/v1/catalog/mood-map", headers=headers).json()
+        assert after["catalog_version"] > before["catalog_version"]
+        assert (before["total_tracks"], after["total_tracks"]) == (1, 2)
+
+    def test_import_rebuilds_all_reports(self, tmp_path):
+        from app.models import CatalogState, CatalogStats
+        from app.services.catalog_import import import_catalog_tracks
+        path = tmp_path / "catalog.csv"
+        path.write_text(TestCatalogStreamingImport.CSV)
+        with db_session() as db:
+            import_catalog_tracks(db, "test/catalog", "catalog.csv", csv_path=str(path))
+            version = db.query(CatalogState.version).scalar()
+            rows = {r.name: r for r in db.query(CatalogStats)}
+            assert set(rows) == {"mood_map", "audio_dna", "genres"}
+            assert all(r.version == version for r in rows.values())
+            assert rows["audio_dna"].payload["catalog_version"] == version
+
+
+class TestConditionalRequests:
+    def _auth(self):
+        register(username="etaguser", email="etag@x.com")
+        token = login("etaguser")["access_token"]
+        return token, {"Authorization": f"Bearer {token}"}
+
+    def test_catalog_etag_and_304(self):
+        seed_catalog_track(energy=0.8, valence=0.8, external_id="etag-1")
+        _, headers = self._auth()
+        first = client.get("/api/v1/catalog/mood-map", headers=headers)
+        etag = first.headers["ETag"]
+        assert first.status_code == 200 and "Last-Modified" in first.headers
+
+        again = client.get("/api/v1/catalog/mood-map", headers={**headers, "If-None-Match": etag})
+        assert again.status_code == 304 and again.content == b""
+        assert again.headers["ETag"] == etag
+        since = client.get("/api/v1/catalog/mood-map",
+                           headers={**headers, "If-Modified-Since": first.headers["Last-Modified"]})
+        assert since.status_code == 304
+
+        seed_catalog_track(energy=0.2, valence=0.2, external_id="etag-2")
+        changed = client.get("/api/v1/catalog/mood-map", headers={**headers, "If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+    def test_304_never_skips_authentication(self):
+        seed_catalog_track(external_id="etag-auth")
+        _, headers = self._auth()
+        etag = client.get("/api/v1/catalog/genres", headers=headers).headers["ETag"]
+        r = client.get("/api/v1/catalog/genres", headers={"If-None-Match": etag})
+        assert r.status_code == 401
+
+    def test_analytics_etag_follows_event_watermark(self):
+        token, headers = self._auth()
+        track_ids = seed_listening_history(token, n_tracks=2, events_per_track=2)
+        client.get("/api/v1/analytics/highlights", headers=headers)
+        etag = client.get("/api/v1/analytics/highlights", headers=headers).headers["ETag"]
+        cached = client.get("/api/v1/analytics/highlights", headers={**headers, "If-None-Match": etag})
+        assert cached.status_code == 304
+
+        event = seed_event(token, track_ids[0], days_ago=1)
+        r = client.get("/api/v1/analytics/highlights", headers={**headers, "If-None-Match": etag})
+        assert r.status_code == 200
+        etag = r.headers["ETag"]
+
+        moved = (datetime.now(timezone.utc) - timedelta(days=2, hours=5)).isoformat()
+        patched = client.patch(f"/api/v1/listening-events/{event['id']}", headers=headers,
+                               json={"listened_at": moved})
+        assert patched.status_code == 200
+        r = client.get("/api/v1/analytics/highlights", headers={**headers, "If-None-Match": etag})
+        assert r.status_code == 200
+
+
 class TestCatalogRecommendByMood:
     def _auth(self):
         register(username="recuser", email="rec@x.com")
@@ -1236,6 +2418,602 @@ class TestAIInsightCritique:
         assert r.status_code == 401
 
 
+# ── Async LLM client ─────────────────────────────────────────────────────────
+
+class TestLLMClient:
+    def _client(self, handler, **kwargs):
+        import httpx
+        from app.services.llm import LLMClient
+        kwargs.setdefault("backoff", 0.0)
+        return LLMClient(api_key="test-key", base_url="http://llm.test/v1", model="stub",
+                         transport=httpx.MockTransport(handler), **kwargs)
+
+    @staticmethod
+    def _reply(text="Grounded summary."):
+        import httpx
+        return httpx.Response(200, json={"choices": [{"message": {"content": f" {text} "}}]})
+
+    def test_retries_transient_errors(self):
+        import asyncio
+        import httpx
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                return httpx.Response(503)
+            return self._reply()
+
+        llm = self._client(handler)
+        assert asyncio.run(llm.chat("hi")) == "Grounded summary."
+        assert len(calls) == 2
+        assert calls[0].headers["Authorization"] == "Bearer test-key"
+        assert calls[0].url.path == "/v1/chat/completions"
+
+    def test_circuit_opens_after_repeated_failures(self):
+        import asyncio
+        import httpx
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            raise httpx.ConnectError("refused")
+
+        llm = self._client(handler, max_retries=1, breaker_threshold=2, breaker_reset=60)
+
+        async def run():
+            return [await llm.chat("hi") for _ in range(4)]
+
+        assert asyncio.run(run()) == [None] * 4
+        assert len(calls) == 2
+        assert llm.breaker.state == "open"
+
+    def test_half_open_lets_one_trial_through(self):
+        import asyncio
+        import httpx
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                raise httpx.ConnectError("refused")
+            await asyncio.sleep(0.01)
+            return self._reply()
+
+        llm = self._client(handler, max_retries=1, breaker_threshold=1, breaker_reset=0.05)
+
+        async def run():
+            assert await llm.chat("first") is None
+            await asyncio.sleep(0.06)
+            return await asyncio.gather(*(llm.chat(f"probe {i}") for i in range(5)))
+
+        results = asyncio.run(run())
+        assert len(calls) == 2
+        assert results.count("Grounded summary.") == 1 and results.count(None) == 4
+        assert llm.breaker.state == "closed"
+
+    def test_pool_from_a_previous_loop_is_closed(self):
+        import asyncio
+        llm = self._client(lambda request: self._reply())
+        asyncio.run(llm.chat("one"))
+        first = llm._client
+        asyncio.run(llm.chat("two"))
+        assert first.is_closed
+        assert llm._client is not first and not llm._client.is_closed
+
+    def test_concurrency_is_capped(self):
+        import asyncio
+        in_flight, peak = 0, 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return self._reply()
+
+        llm = self._client(handler, max_concurrency=3)
+
+        async def run():
+            return await asyncio.gather(*(llm.chat(f"q{i}") for i in range(10)))
+
+        assert asyncio.run(run()) == ["Grounded summary."] * 10
+        assert peak == 3
+
+    def test_disabled_without_api_key(self):
+        import asyncio
+        import httpx
+        from app.services.llm import LLMClient
+        llm = LLMClient(api_key="", base_url="http://llm.test/v1", model="stub",
+                        transport=httpx.MockTransport(lambda r: pytest.fail("network used")))
+        assert asyncio.run(llm.chat("hi")) is None
+
+    def test_cache_serves_repeated_prompts(self):
+        import asyncio
+        from app.services.llm_cache import MemoryCache
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return self._reply()
+
+        llm = self._client(handler, cache=MemoryCache())
+
+        async def run():
+            return [await llm.chat("same"), await llm.chat("same"),
+                    await llm.chat("same", temperature=0.7)]
+
+        assert asyncio.run(run()) == ["Grounded summary."] * 3
+        assert len(calls) == 2
+        stats = llm.cache.stats()
+        assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 2, 2)
+
+    def test_failures_are_not_cached(self):
+        import asyncio
+        import httpx
+        from app.services.llm_cache import MemoryCache
+        llm = self._client(lambda r: httpx.Response(400), cache=MemoryCache())
+        assert asyncio.run(llm.chat("hi")) is None
+        assert llm.cache.stats()["entries"] == 0
+
+    def test_memory_cache_lru_and_ttl(self, monkeypatch):
+        import time
+        from app.services.llm_cache import MemoryCache
+        cache = MemoryCache(max_entries=2, ttl=60)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        assert cache.get("a") == "1"
+        cache.set("c", "3")
+        assert cache.get("b") is None
+        assert cache.get("a") == "1" and cache.get("c") == "3"
+
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 61)
+        assert cache.get("a") is None
+        assert cache.stats()["evictions"] == 2
+
+    def test_sqlite_cache_persists_across_instances(self, tmp_path):
+        from app.services.llm_cache import SQLiteCache, cache_key
+        path = str(tmp_path / "llm.sqlite3")
+        key = cache_key("stub", "hi", 400, 0.2)
+        first = SQLiteCache(path, ttl=60)
+        first.set(key, "stored")
+        first.close()
+        second = SQLiteCache(path, ttl=60)
+        assert second.get(key) == "stored"
+        assert second.get(cache_key("stub", "hi", 400, 0.3)) is None
+        assert second.stats()["hit_ratio"] == 0.5
+        second.close()
+
+
+
+# ── Spotify import jobs ──────────────────────────────────────────────────────
+
+def fake_spotify(n_tracks=3, n_saved=0, delay=0.0):
+    """Local stand-in for the Spotify Web API, served through `httpx.MockTransport`."""
+    import asyncio
+    import httpx
+
+    def track(i):
+        return {"id": f"sp{i}", "name": f"Song {i}", "duration_ms": 200000,
+                "artists": [{"id": f"ar{i % 2}", "name": f"Artist {i % 2}"}],
+                "album": {"name": "Album", "release_date": "2020-05-01"}}
+
+    top = [track(i) for i in range(n_tracks)]
+    saved = [track(1000 + i) for i in range(n_saved)]
+
+    def respond(request):
+        path, params = request.url.path.removeprefix("/v1/"), request.url.params
+        if path == "me/top/tracks":
+            return {"items": top}
+        if path == "me/player/recently-played":
+            return {"items": [{"track": top[0], "played_at": "2024-03-01T10:00:00Z"}]}
+        if path == "me/tracks":
+            offset = int(params["offset"])
+            return {"items": [{"track": t} for t in saved[offset:offset + 50]], "total": len(saved)}
+        if path == "audio-features":
+            return {"audio_features": [{"id": sid, "energy": 0.6, "valence": 0.4,
+                                        "danceability": 0.5, "tempo": 120.0}
+                                       for sid in params["ids"].split(",")]}
+        if path == "artists":
+            return {"artists": [{"id": aid, "genres": ["indie" if aid == "ar0" else "jazz"]}
+                                for aid in params["ids"].split(",")]}
+        return None
+
+    async def handler(request):
+        if delay:
+            await asyncio.sleep(delay)
+        body = respond(request)
+        return httpx.Response(200, json=body) if body is not None else httpx.Response(404)
+
+    return handler
+
+
+def use_fake_spotify(monkeypatch, handler, bucket=None):
+    import httpx
+    from app.services import spotify_import
+    from app.services.spotify_client import SpotifyClient, TokenBucket
+    bucket = bucket or TokenBucket(rate=1000, capacity=1000)
+    monkeypatch.setattr(spotify_import, "_client", lambda token: SpotifyClient(
+        token, bucket=bucket, transport=httpx.MockTransport(handler)))
+
+
+class TestSpotifyImportJobs:
+    @pytest.fixture(autouse=True)
+    def inline_jobs(self, monkeypatch):
+        from app.config import settings
+        monkeypatch.setattr(settings, "IMPORT_WORKERS", 0)
+
+    def _auth(self):
+        register()
+        return {"Authorization": f"Bearer {login()['access_token']}"}
+
+    def _start(self, headers, token="tok"):
+        return client.post("/api/v1/imports/spotify", headers=headers, json={
+            "spotify_token": token, "time_range": "short_term", "synthesise_history": False,
+        })
+
+    def test_import_is_queued_and_reports_progress(self, monkeypatch):
+        use_fake_spotify(monkeypatch, fake_spotify())
+        headers = self._auth()
+        r = self._start(headers)
+        assert r.status_code == 202
+        assert r.json()["status"] == "pending"
+
+        job = client.get(f"/api/v1/imports/jobs/{r.json()['id']}", headers=headers).json()
+        assert job["status"] == "completed"
+        assert (job["tracks_found"], job["tracks_imported"], job["events_created"]) == (3, 3, 1)
+        assert job["stage"] == "events"
+        assert job["progress"]["audio_features"] == {"done": 3, "total": 3}
+        assert job["progress"]["artists"] == {"done": 2, "total": 2}
+        with db_session() as db:
+            from app.models import Track
+            assert {t.genre for t in db.query(Track).all()} == {"indie", "jazz"}
+
+    def test_auth_failure_fails_job(self, monkeypatch):
+        use_fake_spotify(monkeypatch, fake_spotify())
+        headers = self._auth()
+        job_id = self._start(headers, token="invalid").json()["id"]
+        job = client.get(f"/api/v1/imports/jobs/{job_id}", headers=headers).json()
+        assert job["status"] == "failed"
+        assert job["errors"] == ["Auth failed for top tracks (short_term)"]
+
+    def test_cancel_stops_job_at_next_checkpoint(self, monkeypatch):
+        from app.models import ImportJob, ImportJobProgress, Track
+        serve = fake_spotify()
+
+        async def handler(request):
+            if request.url.path.endswith("audio-features"):  # user cancels mid-import
+                with db_session() as db:
+                    db.query(ImportJobProgress).update({"cancel_requested": True})
+                    db.commit()
+            return await serve(request)
+
+        use_fake_spotify(monkeypatch, handler)
+        headers = self._auth()
+        job_id = self._start(headers).json()["id"]
+        job = client.get(f"/api/v1/imports/jobs/{job_id}", headers=headers).json()
+        assert job["status"] == "cancelled" and job["cancel_requested"] is True
+        assert job["stage"] == "audio_features"
+        with db_session() as db:
+            assert db.query(Track).count() == 0
+            assert db.get(ImportJob, job_id).completed_at is not None
+
+        r = client.post(f"/api/v1/imports/jobs/{job_id}/cancel", headers=headers)
+        assert r.status_code == 409
+
+    def test_saved_pages_are_fetched_concurrently(self, monkeypatch):
+        serve = fake_spotify(n_saved=420, delay=0.02)
+        in_flight, peak = 0, 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                return await serve(request)
+            finally:
+                in_flight -= 1
+
+        use_fake_spotify(monkeypatch, handler)
+        headers = self._auth()
+        r = client.post("/api/v1/imports/spotify", headers=headers, json={
+            "spotify_token": "tok", "time_range": "all", "saved_tracks_max_pages": 20,
+            "synthesise_history": False,
+        })
+        job = client.get(f"/api/v1/imports/jobs/{r.json()['id']}", headers=headers).json()
+        assert job["status"] == "completed"
+        assert job["tracks_found"] == 423
+        assert job["progress"]["saved_tracks"] == {"done": 9, "total": 9}
+        assert job["progress"]["audio_features"] == {"done": 423, "total": 423}
+        assert peak > 1
+
+    def test_track_upsert_uses_constant_statements(self, monkeypatch):
+        from sqlalchemy import event
+        from app.models import Track
+        use_fake_spotify(monkeypatch, fake_spotify(n_tracks=3, n_saved=200))
+        headers = self._auth()
+        with db_session() as db:  # already known, but missing audio features
+            db.add(Track(spotify_id="sp1", title="Song 1", artist="Artist 1"))
+            db.commit()
+
+        statements = []
+        listener = lambda conn, cursor, sql, *args: statements.append(sql)  # noqa: E731
+        event.listen(ENGINE, "before_cursor_execute", listener)
+        try:
+            job_id = self._start(headers).json()["id"]
+        finally:
+            event.remove(ENGINE, "before_cursor_execute", listener)
+        job = client.get(f"/api/v1/imports/jobs/{job_id}", headers=headers).json()
+
+        assert (job["tracks_found"], job["tracks_imported"]) == (203, 202)
+        assert sum(sql.startswith("INSERT INTO tracks") for sql in statements) == 1
+        assert sum("FROM tracks" in sql for sql in statements) <= 3
+        with db_session() as db:
+            assert db.query(Track).count() == 203
+            known = db.query(Track).filter_by(spotify_id="sp1").one()
+            assert (known.energy, known.genre, known.album) == (0.6, "jazz", "Album")
+            assert db.query(Track).filter_by(spotify_id="sp1000").one().genre == "indie"
+
+    def test_events_are_written_in_chunks(self, monkeypatch):
+        import math
+        from sqlalchemy import event
+        from app.config import settings
+        from app.models import FingerprintState, ListeningEvent
+        monkeypatch.setattr(settings, "EVENT_WRITE_CHUNK", 7)
+        use_fake_spotify(monkeypatch, fake_spotify(n_tracks=6))
+        headers = self._auth()
+        token = headers["Authorization"].split()[1]
+        seed_event(token, seed_track(), days_ago=3)
+        assert client.get("/api/v1/analytics/fingerprint", headers=headers).status_code == 200
+
+        statements = []
+        listener = lambda conn, cursor, sql, *args: statements.append(sql)  # noqa: E731
+        event.listen(ENGINE, "before_cursor_execute", listener)
+        try:
+            r = client.post("/api/v1/imports/spotify", headers=headers, json={
+                "spotify_token": "tok", "time_range": "long_term"})
+        finally:
+            event.remove(ENGINE, "before_cursor_execute", listener)
+        job = client.get(f"/api/v1/imports/jobs/{r.json()['id']}", headers=headers).json()
+
+        assert job["status"] == "completed"
+        created = job["events_created"]
+        assert created >= 5 * 8 + 1  # five long-term tracks (8-20 plays) plus one recent play
+        assert job["progress"]["events"]["done"] == created
+        assert sum(sql.startswith("INSERT INTO listening_events") for sql in statements) == math.ceil(created / 7)
+        with db_session() as db:
+            assert db.query(ListeningEvent).count() == created + 1
+            assert db.query(FingerprintState).one().total_events == created + 1
+
+    def test_event_writer_reports_each_chunk(self):
+        from app.models import ListeningEvent
+        from app.services import event_writer
+        user_id = register()["id"]
+        track_id = seed_track()
+        rows = ({"user_id": user_id, "track_id": track_id, "source": "bulk",
+                 "listened_at": datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=i),
+                 "duration_listened_ms": 1000} for i in range(25))
+        chunks = []
+        with db_session() as db:
+            assert event_writer.write_events(db, rows, chunk_size=10, on_chunk=chunks.append) == 25
+        assert chunks == [10, 10, 5]
+        with db_session() as db:
+            assert db.query(ListeningEvent).filter_by(source="bulk").count() == 25
+
+    def test_retry_after_pauses_shared_bucket(self):
+        import asyncio
+        import time
+        import httpx
+        from app.services.spotify_client import SpotifyClient, TokenBucket
+        bucket = TokenBucket(rate=1000, capacity=1000)
+        seen = []
+
+        def handler(request):
+            seen.append((request.url.path, time.monotonic()))
+            if len(seen) == 1:
+                return httpx.Response(429, headers={"Retry-After": "0.2"})
+            return httpx.Response(200, json={"ok": True})
+
+        async def run():
+            async with SpotifyClient("tok", bucket=bucket, transport=httpx.MockTransport(handler)) as a, \
+                       SpotifyClient("tok", bucket=bucket, transport=httpx.MockTransport(handler)) as b:
+                first = asyncio.create_task(a.get("me/top/tracks"))
+                await asyncio.sleep(0.05)  # the 429 has paused the shared bucket
+                return await asyncio.gather(first, b.get("artists?ids=x"))
+
+        assert asyncio.run(run()) == [{"ok": True}, {"ok": True}]
+        assert len(seen) == 3
+        assert all(at - seen[0][1] >= 0.19 for _, at in seen[1:])
+
+    def test_token_bucket_limits_rate(self):
+        import asyncio
+        import time
+        from app.services.spotify_client import TokenBucket
+        bucket = TokenBucket(rate=50, capacity=1)
+
+        async def run():
+            start = time.monotonic()
+            await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+            return time.monotonic() - start
+
+        assert asyncio.run(run()) >= 0.09
+
+    def test_startup_fails_only_jobs_with_expired_leases(self):
+        from app.models import ImportJob, ImportJobProgress, JobStatus
+        from app.services import job_runner
+        user_id = register()["id"]
+        now = datetime.now(timezone.utc)
+        stale = now - timedelta(hours=1)
+        with db_session() as db:
+            db.add_all([
+                ImportJob(id="orphan", user_id=user_id, status=JobStatus.RUNNING, started_at=stale,
+                          tracker=ImportJobProgress(counters={}, owner="gone:1", updated_at=stale)),
+                ImportJob(id="sibling", user_id=user_id, status=JobStatus.RUNNING, started_at=stale,
+                          tracker=ImportJobProgress(counters={}, owner="live:2", updated_at=now)),
+                ImportJob(id="queued", user_id=user_id, status=JobStatus.PENDING, started_at=now),
+                ImportJob(id="done", user_id=user_id, status=JobStatus.COMPLETED, started_at=stale),
+            ])
+            db.commit()
+        assert job_runner.recover_orphans(ENGINE) == 1
+        with db_session() as db:
+            assert db.get(ImportJob, "orphan").status == JobStatus.FAILED
+            assert db.get(ImportJob, "sibling").status == JobStatus.RUNNING
+            assert db.get(ImportJob, "queued").status == JobStatus.PENDING
+            assert db.get(ImportJob, "done").status == JobStatus.COMPLETED
+
+    def test_heartbeat_renews_held_jobs(self, monkeypatch):
+        import threading
+        from app.config import settings
+        from app.models import ImportJob, ImportJobProgress
+        from app.services import job_runner
+        monkeypatch.setattr(settings, "IMPORT_WORKERS", 1)
+        user_id = register()["id"]
+        release = threading.Event()
+        with db_session() as db:
+            job = ImportJob(user_id=user_id)
+            db.add(job)
+            db.commit()
+            future = job_runner.submit(db, job, lambda *_: release.wait(5))
+            job_id = job.id
+        try:
+            with db_session() as db:
+                row = db.get(ImportJobProgress, job_id)
+                assert row.owner == job_runner.OWNER
+                row.updated_at = datetime.now(timezone.utc) - timedelta(hours=1)
+                db.commit()
+            job_runner.heartbeat(ENGINE)
+            assert job_runner.recover_orphans(ENGINE) == 0
+        finally:
+            release.set()
+            future.result(timeout=5)
+            job_runner.shutdown(wait=True)
+
+class TestHistoryUpload:
+    EXTENDED = [
+        {"ts": "2023-05-01T08:00:00Z", "ms_played": 180000, "master_metadata_track_name": "Über Song",
+         "master_metadata_album_artist_name": "Band A", "master_metadata_album_album_name": "LP",
+         "spotify_track_uri": "spotify:track:known"},
+        {"ts": "2023-05-01T09:00:00Z", "ms_played": 200000, "master_metadata_track_name": "Second",
+         "master_metadata_album_artist_name": "Band B", "spotify_track_uri": "spotify:track:new"},
+        {"ts": "2023-05-02T09:00:00Z", "ms_played": 1000, "master_metadata_track_name": "Second",
+         "master_metadata_album_artist_name": "Band B", "spotify_track_uri": "spotify:track:new"},
+        {"ts": "2023-05-02T10:00:00Z", "ms_played": 900000, "master_metadata_track_name": None,
+         "episode_name": "A podcast"},
+        {"unexpected": True},
+    ]
+
+    @pytest.fixture(autouse=True)
+    def inline_jobs(self, monkeypatch):
+        from app.config import settings
+        monkeypatch.setattr(settings, "IMPORT_WORKERS", 0)
+
+    def _auth(self):
+        register()
+        return {"Authorization": f"Bearer {login()['access_token']}"}
+
+    def _upload(self, headers, name, content, **form):
+        r = client.post("/api/v1/imports/history", headers=headers, data=form,
+                        files={"file": (name, content)})
+        assert r.status_code == 202, r.text
+        return client.get(f"/api/v1/imports/jobs/{r.json()['id']}", headers=headers).json()
+
+    def test_spotify_extended_history(self, monkeypatch):
+        import json
+        import os
+        from app.models import ListeningEvent, Track
+        from app.services import history_import
+        with db_session() as db:
+            db.add(Track(spotify_id="known", title="Über Song", artist="Band A"))
+            db.commit()
+        monkeypatch.setattr(history_import, "READ_SIZE", 7)  # split objects and UTF-8 sequences
+        spooled = []
+        monkeypatch.setattr(history_import, "discard",
+                            lambda path, real=history_import.discard: (spooled.append(path), real(path)))
+        job = self._upload(self._auth(), "Streaming_History_Audio_2023.json",
+                           json.dumps(self.EXTENDED, ensure_ascii=False).encode())
+
+        assert job["status"] == "completed", job
+        assert job["source"] == "spotify-history"
+        assert (job["events_created"], job["tracks_found"], job["tracks_imported"]) == (3, 2, 1)
+        assert job["errors"][0].startswith("Record 5") and "Skipped 1" in job["errors"][-1]
+        with db_session() as db:
+            rows = db.query(ListeningEvent.duration_listened_ms, Track.spotify_id).join(Track).all()
+        assert sorted(rows) == [(1000, "new"), (180000, "known"), (200000, "new")]
+        assert spooled and not os.path.exists(spooled[0])
+
+    def test_lastfm_csv_with_and_without_header(self):
+        from app.models import ListeningEvent
+        headers = self._auth()
+        existing = seed_track(title="Song", artist="Band")
+        job = self._upload(headers, "scrobbles.csv",
+                           "uts,utc_time,artist,artist_mbid,album,album_mbid,track,track_mbid\n"
+                           "1683000000,\"02 May 2023, 04:00\",Band,,Album,,Song,\n"
+                           "1683003600,\"02 May 2023, 05:00\",Other,,,,Tune,\n")
+        assert (job["events_created"], job["tracks_imported"]) == (2, 1)
+        job = self._upload(headers, "export", "Band,Album,Song,03 May 2023 10:00\n,,,\n", format="lastfm")
+        assert job["source"] == "lastfm" and job["events_created"] == 1 and job["tracks_imported"] == 0
+        with db_session() as db:
+            assert db.query(ListeningEvent).filter(ListeningEvent.track_id == existing).count() == 2
+            times = [e.listened_at for e in db.query(ListeningEvent).order_by(ListeningEvent.listened_at)]
+        assert times[0] == datetime(2023, 5, 2, 4, 0)
+
+    def test_events_are_written_in_chunks(self, monkeypatch):
+        import json
+        from sqlalchemy import event
+        from app.config import settings
+        monkeypatch.setattr(settings, "EVENT_WRITE_CHUNK", 2)
+        plays = [dict(self.EXTENDED[1], ts=f"2023-06-0{d}T10:00:00Z") for d in range(1, 6)]
+        statements = []
+        listener = lambda conn, cursor, sql, *args: statements.append(sql)  # noqa: E731
+        headers = self._auth()
+        event.listen(ENGINE, "before_cursor_execute", listener)
+        try:
+            job = self._upload(headers, "history.json", json.dumps(plays).encode())
+        finally:
+            event.remove(ENGINE, "before_cursor_execute", listener)
+        assert job["events_created"] == 5 and job["progress"]["events"]["done"] == 5
+        assert sum(sql.startswith("INSERT INTO listening_events") for sql in statements) == 3
+        assert sum(sql.startswith("INSERT INTO tracks") for sql in statements) == 1
+
+    def test_unreadable_upload_fails_the_job(self):
+        headers = self._auth()
+        job = self._upload(headers, "history.json", b'{"not": "an array"}')
+        assert job["status"] == "failed"
+        r = client.post("/api/v1/imports/history", headers=headers, data={"format": "xml"},
+                        files={"file": ("x.xml", b"<x/>")})
+        assert r.status_code == 422
+
+    def test_json_elements_split_at_every_read_boundary(self, monkeypatch):
+        import io
+        import json
+        from app.services import history_import
+        items = [{"a": -1.5e-3, "b": True, "c": False, "d": None, "e": "x\u00e9\n\"y"},
+                 ["\U0001f600", 123456789, -0.0, {"g": float("-inf")}], "caf\u00e9"]
+        payload = json.dumps(items).encode()
+        for size in range(1, 12):
+            monkeypatch.setattr(history_import, "READ_SIZE", size)
+            assert list(history_import.iter_json_array(io.BytesIO(payload))) == items
+
+    def test_malformed_json_record_fails_without_reading_the_rest(self, monkeypatch):
+        import io
+        from app.services import history_import
+
+        class CountingStream(io.BytesIO):
+            consumed = 0
+
+            def read(self, size=-1):
+                chunk = super().read(size)
+                self.consumed += len(chunk)
+                return chunk
+
+        monkeypatch.setattr(history_import, "READ_SIZE", 64)
+        stream = CountingStream(b'[{"ts": oops}, ' + b'{"ts": "2024-01-01T00:00:00Z"}, ' * 10000 + b"{}]")
+        with pytest.raises(ValueError):
+            list(history_import.iter_json_array(stream))
+        assert stream.consumed <= 64
+
 
 # ── MCP server — entirely untested ───────────────────────────────────────────
 
@@ -1361,6 +3139,36 @@ class TestMCPInvoke:
         assert r.json()["success"] is True
         assert "similar_tracks" in r.json()["result"]
 
+    def test_find_similar_tracks_agrees_with_rest(self):
+        self._populate_catalog()
+        headers = self._auth()
+        seed_id = client.get("/api/v1/catalog", headers=headers).json()["items"][0]["id"]
+        rest = client.get(f"/api/v1/catalog/{seed_id}/similar?limit=4", headers=headers).json()
+        mcp = client.post("/api/v1/mcp/invoke",
+                          json={"tool": "find_similar_tracks",
+                                "arguments": {"track_id": seed_id, "limit": 4}},
+                          headers=headers).json()["result"]
+        assert [(t["id"], t["similarity_score"]) for t in mcp["similar_tracks"]] == [
+            (t["id"], t["similarity_score"]) for t in rest["results"]
+        ]
+
+    def test_recommend_by_mood_agrees_with_rest(self):
+        self._populate_catalog()
+        headers = self._auth()
+        description = "happy, upbeat party"
+        rest = client.post("/api/v1/catalog/recommend-by-mood",
+                           json={"description": description, "limit": 5},
+                           headers=headers).json()
+        mcp = client.post("/api/v1/mcp/invoke",
+                          json={"tool": "recommend_by_mood",
+                                "arguments": {"description": description, "limit": 5}},
+                          headers=headers).json()["result"]
+        assert mcp["matched_keywords"] == rest["matched_keywords"] == ["happy", "upbeat", "party"]
+        assert mcp["total_candidates"] == rest["total_candidates"]
+        assert [(t["id"], t["mood_match_score"]) for t in mcp["recommendations"]] == [
+            (t["id"], t["mood_match_score"]) for t in rest["results"]
+        ]
+
 
     def test_invoke_find_similar_tracks_missing_id_returns_error(self):
         r = client.post("/api/v1/mcp/invoke",